@@ -0,0 +1,237 @@
+"""Admission control for writes: per-user rate limits and a bound on queued writes.
+
+Every write a client asks for goes through AdmissionController before it reaches the store. Each user has
+a token bucket (WRITE_RATE writes a second, bursts of up to WRITE_BURST); a write the
+bucket can't pay for is refused. All users share a bound on the writes waiting for the
+store's single writer, so one user's flood can't lengthen the queue everyone else's
+writes wait in. A refusal raises Overloaded with the seconds after which a retry should
+be admitted, for a 429 response with Retry-After. AdmissionMiddleware refuses writes on
+routes that name their user in the path before their bodies are parsed.
+
+Clipboard updates are coalesced: while one for a user is still queued, a newer one
+replaces its text instead of queueing another write, and both requests get the result
+of the single write. Only the latest text is stored, as only the latest matters, and a
+coalesced update costs no token.
+"""
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from urllib.parse import unquote
+
+from fastapi.responses import JSONResponse
+
+import storage
+
+WRITE_RATE = float(os.environ.get("CLIPBOARD_WRITE_RATE", "20"))  # Sustained writes per second per user
+WRITE_BURST = float(os.environ.get("CLIPBOARD_WRITE_BURST", "40"))  # Writes a user can make at once after idling
+MAX_PENDING_WRITES = int(os.environ.get("CLIPBOARD_MAX_PENDING_WRITES", "256"))  # Admitted writes not yet committed
+MAX_BUCKETS = 100000  # Buckets kept; full (idle) ones are dropped past this, losing nothing
+MAX_DRAIN_BYTES = 1024 * 1024  # Body of a refused request read and discarded at most; past it the connection drops
+
+# Write routes that name their user in the path, so AdmissionMiddleware can refuse them unread
+USER_WRITE_PATH = re.compile(
+    r"^/(?:update-history|delete-history|clear-history|delete-copied-text|clear-copied-text"
+    r"|update-history-limit|update-retention|upload)/(?P<user>[^/]+)$"
+    r"|^/history/(?P<history_user>[^/]+)/(?:batch|ingest|import)$"
+    r"|^/uploads/(?P<upload_user>[^/]+)/[^/]+/commit$"
+)
+
+
+class Overloaded(Exception):
+    """A write was refused; retry_after is the whole number of seconds to wait before retrying."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def overloaded_response(e):
+    """429 response for a refused write."""
+    return JSONResponse(
+        status_code=429,
+        content={"status": "error", "message": e.reason, "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def wait(self, rate, burst, now):
+        """Seconds until a token is available (0 if one is), without spending it."""
+        tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        return 0.0 if tokens >= 1 else (1 - tokens) / rate
+
+    def take(self, rate, burst, now):
+        """Spend a token if there is one. Returns 0, or the seconds until one is available."""
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class PendingClipboard:
+    """A queued clipboard write whose text newer updates may still replace."""
+
+    def __init__(self, text):
+        self.text = text
+        self.started = False
+        self.future = None  # concurrent.futures.Future of (version, text) from the store's writer
+
+
+class AdmissionController:
+    def __init__(self, rate=WRITE_RATE, burst=WRITE_BURST, max_pending=MAX_PENDING_WRITES, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_pending = max_pending
+        self.clock = clock
+        self.pending = 0
+        self.admitted = 0
+        self.coalesced = 0
+        self.rejected = {"rate": 0, "queue": 0}
+        self._buckets = {}
+        self._clipboards = {}  # username -> PendingClipboard not yet started
+        self._write_seconds = 0.01  # Moving average of admitted writes' time to commit, for Retry-After
+        self._lock = threading.Lock()  # Requests on the event loop and the clipboard monitor thread both admit
+
+    def _admit(self, username):
+        # Called with the lock held. Checks the shared queue first, so a refused write costs no token.
+        if self.pending >= self.max_pending:
+            self.rejected["queue"] += 1
+            raise Overloaded("Too many writes queued", self.pending * self._write_seconds)
+        now = self.clock()
+        bucket = self._buckets.get(username)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._drop_idle_buckets(now)
+            bucket = self._buckets[username] = TokenBucket(self.burst, now)
+        wait = bucket.take(self.rate, self.burst, now)
+        if wait:
+            self.rejected["rate"] += 1
+            raise Overloaded("Too many writes for this user", wait)
+        self.pending += 1
+        self.admitted += 1
+
+    def check(self, username):
+        """Raise Overloaded if a write by `username` would be refused now, without admitting it."""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected["queue"] += 1
+                raise Overloaded("Too many writes queued", self.pending * self._write_seconds)
+            bucket = self._buckets.get(username)
+            wait = bucket.wait(self.rate, self.burst, self.clock()) if bucket is not None else 0.0
+            if wait:
+                self.rejected["rate"] += 1
+                raise Overloaded("Too many writes for this user", wait)
+
+    def _drop_idle_buckets(self, now):
+        full_after = self.burst / self.rate
+        for username, bucket in list(self._buckets.items()):
+            if now - bucket.updated >= full_after:
+                del self._buckets[username]
+
+    def _done(self, started):
+        with self._lock:
+            self.pending -= 1
+            self._write_seconds += 0.1 * ((time.perf_counter() - started) - self._write_seconds)
+
+    async def write(self, username, fn, *args):
+        """Run a storage write operation for `username` if admitted. Raises Overloaded if not."""
+        with self._lock:
+            self._admit(username)
+        started = time.perf_counter()
+        try:
+            return await storage.get_store().awrite(fn, *args)
+        finally:
+            self._done(started)
+
+    def write_sync(self, username, fn, *args):
+        """write() for threads outside the event loop, such as the clipboard monitor."""
+        with self._lock:
+            self._admit(username)
+        started = time.perf_counter()
+        try:
+            return storage.get_store().write(fn, *args)
+        finally:
+            self._done(started)
+
+    async def set_clipboard(self, username, text):
+        """Set the user's clipboard, coalescing with an update still queued.
+
+        Returns (version, stored text, coalesced); coalesced is True when this request's
+        text was handed to a write another request had queued.
+        """
+        with self._lock:
+            pending = self._clipboards.get(username)
+            if pending is not None and not pending.started:
+                pending.text = text
+                self.coalesced += 1
+                future, coalesced = pending.future, True
+            else:
+                self._admit(username)
+                pending = self._clipboards[username] = PendingClipboard(text)
+                # Submitted under the lock, so the writer can't start it before it is registered
+                future = pending.future = storage.get_store().writer.submit(self._apply_clipboard, username, pending)
+                coalesced = False
+        if coalesced:
+            version, stored = await asyncio.wrap_future(future)
+            return version, stored, True
+        started = time.perf_counter()
+        try:
+            version, stored = await asyncio.wrap_future(future)
+        finally:
+            self._done(started)
+        return version, stored, False
+
+    def _apply_clipboard(self, conn, username, pending):
+        # Runs on the writer thread: from here on, newer updates queue a write of their own
+        with self._lock:
+            pending.started = True
+            if self._clipboards.get(username) is pending:
+                del self._clipboards[username]
+            text = pending.text
+        return storage.set_clipboard(conn, username, text), text
+
+    def stats(self):
+        return {
+            "pending": self.pending, "max_pending": self.max_pending, "rate": self.rate, "burst": self.burst,
+            "admitted": self.admitted, "coalesced": self.coalesced, "rejected": dict(self.rejected),
+        }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware refusing writes that would be refused anyway before their body is read.
+
+    Routing, body parsing and validation are most of what a request costs, so a flood
+    of refused writes is cheap only if it is turned away here. The endpoint still goes
+    through the controller, which admits the write and takes the token.
+    """
+
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST":
+            match = USER_WRITE_PATH.match(scope["path"])
+            if match is not None:
+                try:
+                    self.controller.check(unquote(next(user for user in match.groups() if user)))
+                except Overloaded as e:
+                    # Discard the body unparsed: a connection closed with it unread resets, losing the 429
+                    message, drained = {"type": "http.request", "more_body": True}, 0
+                    while message.get("more_body") and message["type"] == "http.request" and drained <= MAX_DRAIN_BYTES:
+                        message = await receive()
+                        drained += len(message.get("body", b""))
+                    return await overloaded_response(e)(scope, receive, send)
+        await self.app(scope, receive, send)
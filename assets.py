@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:  # Optional: without it assets are offered as gzip only
+    brotli = None
+
+COMPRESS_MIN_SIZE = 512  # Bytes; smaller files aren't worth a compressed copy
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+RELOAD_INTERVAL = 1.0  # Seconds between mtime checks when reloading is on
+
+# /static/... references in the index, rewritten to their content-hashed URLs
+STATIC_REF = re.compile(r'(?P<attr>(?:href|src)=")(?P<path>/static/[^"?#]+)"')
+
+
+class Asset:
+    """One file held in memory with its precompressed copies."""
+
+    def __init__(self, body, content_type, mtime):
+        self.body = body
+        self.content_type = content_type
+        self.mtime = mtime
+        self.digest = hashlib.sha256(body).hexdigest()[:12]
+        self.etag = f'"{self.digest}"'
+        self.encoded = {}  # Content-Encoding -> body
+        if len(body) >= COMPRESS_MIN_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            self.encoded["gzip"] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(body)
+
+    def negotiate(self, accept_encoding):
+        """(body, Content-Encoding or None) for a request's Accept-Encoding header."""
+        accepted = {token.split(";")[0].strip() for token in (accept_encoding or "").lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.encoded:
+                return self.encoded[encoding], encoding
+        return self.body, None
+
+
+def hashed_path(path, digest):
+    """/static/js/script.js -> /static/js/script.<digest>.js"""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{digest}{ext}"
+
+
+class AssetStore:
+    """The index page and everything under the static directory, served from memory.
+
+    Files are read and compressed once, at load(). Each static file is reachable at
+    its plain URL (revalidated by ETag) and at a content-hashed URL, which the index
+    links to and which is cached as immutable: a changed file gets a new URL. With
+    reload on, files whose mtime changed are picked up at most every RELOAD_INTERVAL.
+    """
+
+    def __init__(self, static_dir, index_path, prefix="/static", reload=False):
+        self.static_dir = static_dir
+        self.index_path = index_path
+        self.prefix = prefix
+        self.reload = reload
+        self.index = None
+        self._files = {}  # Plain URL path -> Asset
+        self._hashed = {}  # Content-hashed URL path -> plain URL path
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def load(self):
+        files, hashed = {}, {}
+        for directory, _, names in os.walk(self.static_dir):
+            for name in names:
+                full = os.path.join(directory, name)
+                url = f"{self.prefix}/{os.path.relpath(full, self.static_dir).replace(os.sep, '/')}"
+                old = self._files.get(url)
+                mtime = os.stat(full).st_mtime_ns
+                asset = old if old is not None and old.mtime == mtime else self._read(full, mtime)
+                files[url] = asset
+                hashed[hashed_path(url, asset.digest)] = url
+        with open(self.index_path, "rb") as f:
+            html = f.read().decode()
+        html = STATIC_REF.sub(lambda m: m["attr"] + self._link(files, m["path"]) + '"', html)
+        index = Asset(html.encode(), "text/html; charset=utf-8", os.stat(self.index_path).st_mtime_ns)
+        with self._lock:
+            self._files, self._hashed, self.index = files, hashed, index
+            self._checked = time.monotonic()
+
+    def _link(self, files, path):
+        asset = files.get(path)
+        return hashed_path(path, asset.digest) if asset is not None else path
+
+    @staticmethod
+    def _read(path, mtime):
+        with open(path, "rb") as f:
+            body = f.read()
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if content_type.startswith("text/") or content_type == "application/javascript":
+            content_type += "; charset=utf-8"
+        return Asset(body, content_type, mtime)
+
+    def get_index(self):
+        self._maybe_reload()
+        return self.index
+
+    def get(self, path):
+        """(Asset, Cache-Control) for a URL path under the prefix, or None."""
+        self._maybe_reload()
+        plain = self._hashed.get(path)
+        if plain is not None:
+            return self._files[plain], IMMUTABLE
+        asset = self._files.get(path)
+        return (asset, REVALIDATE) if asset is not None else None
+
+    def _maybe_reload(self):
+        if self.index is None:
+            self.load()
+        elif self.reload and time.monotonic() - self._checked >= RELOAD_INTERVAL:
+            self._checked = time.monotonic()
+            if self._changed():
+                self.load()
+
+    def _changed(self):
+        try:
+            if os.stat(self.index_path).st_mtime_ns != self.index.mtime:
+                return True
+            count = 0
+            for directory, _, names in os.walk(self.static_dir):
+                for name in names:
+                    count += 1
+                    full = os.path.join(directory, name)
+                    url = f"{self.prefix}/{os.path.relpath(full, self.static_dir).replace(os.sep, '/')}"
+                    asset = self._files.get(url)
+                    if asset is None or os.stat(full).st_mtime_ns != asset.mtime:
+                        return True
+            return count != len(self._files)
+        except OSError:
+            return True
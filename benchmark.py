@@ -0,0 +1,1695 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# Helpers
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fake_clipboard(delay):
+    """Stand-in for pyperclip.copy that costs as much as an xclip subprocess."""
+    def copy(text):
+        time.sleep(delay)
+    return copy
+
+
+class InProcessServer:
+    """Runs server.app under uvicorn on a background thread with a temporary users.db."""
+
+    def __init__(self, copy_delay=0.0, wrap=None):
+        import uvicorn
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ["CLIPBOARD_DB_PATH"] = os.path.join(self.tmpdir.name, "users.db")
+        os.chdir(REPO_DIR)
+        import server
+        import storage
+
+        logging.getLogger().setLevel(logging.WARNING)  # Keep per-request logging out of the numbers
+        storage.init_db(os.environ["CLIPBOARD_DB_PATH"])
+        server.clipboard_worker.copy_fn = fake_clipboard(copy_delay)
+        self.server_module = server
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        app = wrap(server.app) if wrap else server.app
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning")
+        self.uvicorn = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.uvicorn.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.uvicorn.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.uvicorn.should_exit = True
+        self.thread.join()
+        self.tmpdir.cleanup()
+
+
+def bulk_insert_history(conn, table, rows):
+    """Load (username, text, timestamp) rows straight into a history table, skipping trimming."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO blobs (hash, text, size) VALUES (content_hash(?), ?, length(?))",
+        ((text, text, text) for _, text, _ in rows),
+    )
+    conn.executemany(f"INSERT INTO {table} (username, hash, timestamp) VALUES (?, content_hash(?), ?)", rows)
+
+
+def run_clients(count, duration, request_fn):
+    """Run request_fn(session) in a loop on `count` threads and return the number of completed calls."""
+    done = [0] * count
+    deadline = time.perf_counter() + duration
+
+    def client(i):
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                request_fn(session)
+                done[i] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(done)
+
+
+# Scenario: /fetch-history throughput with and without concurrent clipboard writes
+def bench_fetch_under_writes(args):
+    with InProcessServer(copy_delay=args.copy_delay) as srv:
+        requests.post(f"{srv.url}/login", json={"username": "bench", "password": "bench"})
+        for i in range(10):
+            requests.post(f"{srv.url}/update-history/bench", json={"text": f"snippet {i}"})
+
+        def fetch(session):
+            session.get(f"{srv.url}/fetch-history/bench").raise_for_status()
+
+        def write(session):
+            session.post(f"{srv.url}/update-clipboard", json={"username": "bench", "text": "x" * 256}).raise_for_status()
+
+        idle = run_clients(args.readers, args.duration, fetch)
+
+        writes = [0]
+        writers = threading.Thread(target=lambda: writes.__setitem__(0, run_clients(args.writers, args.duration, write)))
+        writers.start()
+        loaded = run_clients(args.readers, args.duration, fetch)
+        writers.join()
+
+    print(f"fetch-history alone:           {idle / args.duration:8.1f} req/s")
+    print(f"fetch-history during writes:   {loaded / args.duration:8.1f} req/s")
+    print(f"update-clipboard during test:  {writes[0] / args.duration:8.1f} req/s "
+          f"(clipboard copy {args.copy_delay * 1000:.0f} ms each)")
+    print(f"throughput retained:           {loaded / max(idle, 1) * 100:8.1f} %")
+
+
+# Scenario: add_history_item (insert + trim) cost as the history tables grow
+def bench_insert_scaling(args):
+    import storage
+
+    users_per_step = 1000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = storage.init_db(os.path.join(tmpdir, "users.db"))
+        filled = 0
+        print(f"{'rows':>12}  {'insert+trim':>12}")
+        for target in (int(n) for n in args.rows.split(",")):
+            # Bulk-load filler users with a full history each, bypassing the writer for speed
+            def fill(conn, start, stop):
+                rows = [(f"filler{i // storage.MAX_HISTORY_ITEMS}", f"snippet {i}", i) for i in range(start, stop)]
+                bulk_insert_history(conn, "history", rows)
+            while filled < target:
+                step = min(target - filled, 100000)
+                store.write(fill, filled, filled + step)
+                filled += step
+
+            active = [f"user{i}" for i in range(users_per_step)]
+            start = time.perf_counter()
+            for i in range(args.inserts):
+                store.write(storage.add_history_item, "history", random.choice(active), f"new snippet {i}")
+            elapsed = time.perf_counter() - start
+            print(f"{filled:>12,}  {elapsed / args.inserts * 1e6:>9.1f} us")
+        store.close()
+
+
+# Scenario: idle CPU and change-to-capture latency of the clipboard watcher backends
+def bench_watcher(args):
+    from clipboard_watcher import ClipboardWatcher, FakeBackend, PollingBackend
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        clip_file = os.path.join(tmpdir, "clipboard")
+        with open(clip_file, "w") as f:
+            f.write("initial")
+
+        # Like xclip/xsel, every read of the simulated clipboard forks a subprocess
+        def paste():
+            return subprocess.run(["cat", clip_file], capture_output=True, text=True).stdout
+
+        def copy_to_file(text):
+            with open(clip_file, "w") as f:
+                f.write(text)
+
+        fake = FakeBackend("initial")
+        cases = [
+            ("fixed 0.5 s poll (before)", PollingBackend(paste, min_interval=0.5, max_interval=0.5), copy_to_file),
+            ("adaptive poll", PollingBackend(paste), copy_to_file),
+            ("event-driven (fake)", fake, fake.set_text),
+        ]
+        print(f"{'backend':<28} {'idle CPU':>9} {'reads/s':>8} {'p50 lag':>9} {'max lag':>9}")
+        for label, backend, copy in cases:
+            copy_to_file("initial")
+            watcher = ClipboardWatcher(backend)
+            captured = threading.Event()
+            watcher.subscribe(lambda text: captured.set())
+            watcher.start()
+
+            # Idle: nothing changes, count CPU spent by us and by forked readers once
+            # the adaptive poller has settled at its slowest interval
+            time.sleep(3)
+            before, polls_before = os.times(), getattr(backend, "polls", 0)
+            time.sleep(args.duration)
+            after = os.times()
+            cpu = (after.user + after.system + after.children_user + after.children_system) - (
+                before.user + before.system + before.children_user + before.children_system)
+            reads = (getattr(backend, "polls", 0) - polls_before) / args.duration
+
+            # Latency: copies arrive at irregular intervals
+            lags = []
+            for i in range(args.changes):
+                time.sleep(random.uniform(0.2, 1.5))
+                captured.clear()
+                start = time.perf_counter()
+                copy(f"change {i}")
+                captured.wait(5)
+                lags.append(time.perf_counter() - start)
+            watcher.stop()
+            lags.sort()
+            print(f"{label:<28} {cpu / args.duration * 100:>8.2f}% {reads:>8.1f} "
+                  f"{lags[len(lags) // 2] * 1000:>6.1f} ms {lags[-1] * 1000:>6.1f} ms")
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+# Scenario: full-text search latency over a large synthetic history
+def bench_search(args):
+    import storage
+
+    rng = random.Random(42)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(20000)]
+    users = [f"user{i}" for i in range(args.users)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = storage.init_db(os.path.join(tmpdir, "users.db"))
+
+        def fill(conn, start, stop):
+            rows = [(users[i % len(users)], " ".join(rng.choices(vocabulary, k=rng.randint(5, 25))), i) for i in range(start, stop)]
+            bulk_insert_history(conn, "history", rows)
+
+        start = time.perf_counter()
+        for offset in range(0, args.snippets, 50000):
+            store.write(fill, offset, min(offset + 50000, args.snippets))
+        print(f"indexed {args.snippets:,} snippets for {len(users):,} users in {time.perf_counter() - start:.1f} s")
+
+        for label, terms in (("one word", 1), ("two words", 2), ("prefix", 0)):
+            samples = []
+            for _ in range(args.searches):
+                if terms:
+                    query = " ".join(rng.choices(vocabulary, k=terms))
+                else:
+                    query = rng.choice(vocabulary)[:2]
+                begin = time.perf_counter()
+                store.read(storage.search_history, "history", rng.choice(users), query, 20)
+                samples.append(time.perf_counter() - begin)
+            print(f"{label:<10} p50 {percentile(samples, 50) * 1000:7.2f} ms   "
+                  f"p95 {percentile(samples, 95) * 1000:7.2f} ms   p99 {percentile(samples, 99) * 1000:7.2f} ms")
+        store.close()
+
+
+def db_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+# Scenario: months of traffic on a large database, with and without the maintenance scheduler
+def bench_maintenance(args):
+    import storage
+    from maintenance import VACUUM_MIN_PAGES, MaintenanceScheduler
+
+    day = 86400
+    users = [f"user{i}" for i in range(args.users)]
+    print(f"{len(users):,} users copying {args.daily_items} items a day each for {args.months} months; "
+          f"retention {args.retention_days} days when scheduled")
+    print(f"{'run':<10} {'month':>5} {'rows':>10} {'file MB':>8} {'free MB':>8} {'page p95':>9} {'search p95':>11} {'max step':>9}")
+    final = {}  # Run label -> (rows, database stats) at the end of the run
+    for label in ("none", "scheduled"):
+        rng = random.Random(7)
+        vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(20000)]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "users.db")
+            store = storage.init_db(path)
+            days = args.retention_days if label == "scheduled" else 0
+            store.write(lambda conn: conn.executemany(
+                "INSERT INTO users (username, password, history_limit, retention_days) VALUES (?, 'pw', 1000000, ?)",
+                ((user, days) for user in users),
+            ))
+            now = 1700000000
+            scheduler = MaintenanceScheduler(clock=lambda: now, pause=0)
+            freed = 0
+
+            def traffic(conn, start):
+                for kind, table in storage.HISTORY_TABLES.items():
+                    rows = [
+                        (user, f"{user} {start + i} " + " ".join(rng.choices(vocabulary, k=rng.randint(5, 60))), start + i * 60)
+                        for user in users for i in range(args.daily_items // 2)
+                    ]
+                    bulk_insert_history(conn, table, rows)
+
+            for d in range(1, args.months * 30 + 1):
+                store.write(traffic, now)
+                now += day
+                if label == "scheduled":
+                    scheduler.run("checkpoint")
+                    if d % 30 == 0:
+                        scheduler.run("optimize")
+                    if d % 7 == 0:
+                        scheduler.run("retention")
+                    if d % 7 == 0 or d % 30 == 0:
+                        freed += scheduler.run("vacuum")["freed_pages"]
+                if d % 30 == 0:
+                    pages, searches = [], []
+                    for user in rng.sample(users, min(200, len(users))):
+                        start = time.perf_counter()
+                        store.read(storage.get_history_page, "history", user)
+                        pages.append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        store.read(storage.search_history, "copied", user, rng.choice(vocabulary))
+                        searches.append(time.perf_counter() - start)
+                    stats = store.read(storage.database_stats)
+                    rows = sum(store.read(lambda conn, t=table: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0])
+                               for table in storage.HISTORY_TABLES.values())
+                    print(f"{label:<10} {d // 30:>5} {rows:>10,} {stats['file_bytes'] / 1e6:>8.1f} "
+                          f"{stats['free_pages'] * stats['page_size'] / 1e6:>8.1f} {percentile(pages, 95) * 1000:>7.2f}ms "
+                          f"{percentile(searches, 95) * 1000:>9.2f}ms {scheduler.max_step_seconds * 1000:>7.1f}ms")
+            if label == "scheduled":
+                # A last pass, so nothing is left waiting for the next weekly run
+                scheduler.run("retention")
+                freed += scheduler.run("vacuum")["freed_pages"]
+                for name in ("retention", "vacuum", "optimize", "checkpoint"):
+                    task = scheduler.tasks[name]
+                    print(f"  {name}: {task.runs} runs, last {task.last_seconds * 1000:.0f} ms: {task.last_result}")
+                oldest = min(store.read(lambda conn, t=table: conn.execute(f"SELECT MIN(timestamp) FROM {t}").fetchone()[0])
+                             for table in storage.HISTORY_TABLES.values())
+            rows = sum(store.read(lambda conn, t=table: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0])
+                       for table in storage.HISTORY_TABLES.values())
+            final[label] = (rows, store.read(storage.database_stats))
+            storage.close_db()
+
+    (rows_none, none), (rows_kept, kept) = final["none"], final["scheduled"]
+    oldest_days = (now - oldest) / day
+    checks = [
+        (rows_kept < rows_none, f"retention kept {rows_kept:,} of {rows_none:,} rows"),
+        (oldest_days <= args.retention_days, f"oldest row {oldest_days:.1f} days old, limit {args.retention_days}"),
+        (freed > 0 and kept["free_pages"] < VACUUM_MIN_PAGES,
+         f"vacuum freed {freed:,} pages, {kept['free_pages']:,} free at the end (unmaintained: {none['free_pages']:,})"),
+        (kept["file_bytes"] < none["file_bytes"],
+         f"file {kept['file_bytes'] / 1e6:.1f} MB, unmaintained {none['file_bytes'] / 1e6:.1f} MB"),
+        (scheduler.max_step_seconds <= args.step_budget,
+         f"longest step held the writer {scheduler.max_step_seconds * 1000:.0f} ms, budget {args.step_budget * 1000:.0f} ms"),
+    ]
+    for ok, detail in checks:
+        print(f"{'PASS' if ok else 'FAIL'}  {detail}")
+    if not all(ok for ok, _ in checks):
+        sys.exit(1)
+
+
+# Scenario: storage cost when many users keep copying the same large snippets
+def bench_dedup(args):
+    import storage
+
+    rng = random.Random(7)
+    snippets = [f"log line {i} " * (args.snippet_size // 12) for i in range(args.distinct)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "users.db")
+        store = storage.init_db(path)
+        logical = 0
+        start = time.perf_counter()
+        for i in range(args.inserts):
+            text = rng.choice(snippets)
+            logical += len(text)
+            store.write(storage.add_history_item, rng.choice(("history", "copied")), f"user{i % 50}", text)
+        elapsed = time.perf_counter() - start
+        blobs, rows = store.read(lambda conn: (
+            conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0],
+            conn.execute("SELECT (SELECT COUNT(*) FROM history) + (SELECT COUNT(*) FROM copied_text_history)").fetchone()[0],
+        ))
+        store.close()  # Closing the last connection checkpoints the WAL into users.db
+        print(f"{args.inserts:,} copies of {args.distinct} distinct {args.snippet_size:,}-byte snippets")
+        print(f"rows kept:        {rows:,} history rows referencing {blobs:,} blobs")
+        print(f"bytes copied:     {logical / 1e6:8.1f} MB")
+        print(f"users.db size:    {db_size(path) / 1e6:8.1f} MB")
+        print(f"insert+trim:      {elapsed / args.inserts * 1e6:8.1f} us")
+
+
+# Scenario: per-item write endpoints vs. one /history/{username}/batch request per user action
+def bench_batch(args):
+    with InProcessServer(copy_delay=0.0) as srv:
+        users = [f"bench{i}" for i in range(args.writers)]
+        for user in users:
+            requests.post(f"{srv.url}/login", json={"username": user, "password": "bench"})
+        counter = iter(range(10 ** 9))
+
+        def action_user():
+            return users[next(counter) % len(users)]
+
+        def per_item(session):
+            user = action_user()
+            for i in range(args.batch_size):
+                session.post(f"{srv.url}/update-history/{user}", json={"text": f"item {i}"}).raise_for_status()
+
+        def batched(session):
+            user = action_user()
+            ops = [{"op": "add", "list": "history", "text": f"item {i}"} for i in range(args.batch_size)]
+            session.post(f"{srv.url}/history/{user}/batch", json={"ops": ops}).raise_for_status()
+
+        def both_separate(session):
+            user = action_user()
+            session.post(f"{srv.url}/update-clipboard", json={"username": user, "text": "both"}).raise_for_status()
+            session.post(f"{srv.url}/update-history/{user}", json={"text": "both"}).raise_for_status()
+
+        def both_batched(session):
+            user = action_user()
+            ops = [{"op": "clipboard", "text": "both"}, {"op": "add", "list": "history", "text": "both"}]
+            session.post(f"{srv.url}/history/{user}/batch", json={"ops": ops}).raise_for_status()
+
+        print(f"{args.writers} clients, {args.duration:.0f} s per measurement")
+        for label, fn, items in (
+            (f"{args.batch_size} adds, per-item endpoint", per_item, args.batch_size),
+            (f"{args.batch_size} adds, one batch", batched, args.batch_size),
+            ("'both' mode, two requests", both_separate, 2),
+            ("'both' mode, one batch", both_batched, 2),
+        ):
+            actions = run_clients(args.writers, args.duration, fn)
+            print(f"{label:<32} {actions / args.duration:8.1f} actions/s   {actions * items / args.duration:8.1f} ops/s")
+
+
+# Scenario: logging cost per request, old f-string handlers vs. the queued, sampled, redacted setup
+def bench_logging(args):
+    import logging_setup
+    from logging_setup import Payload, configure_logging, log_sampled
+
+    history = [f"snippet {i} " * (args.snippet_size // 10 // 10) for i in range(10)]
+    text = "x" * args.snippet_size
+    username = "bench"
+    devnull = open(os.devnull, "w")
+
+    old = logging.getLogger("bench.old")
+    old.propagate = False
+    handler = logging.StreamHandler(devnull)
+    handler.setFormatter(logging.Formatter(logging_setup.LOG_FORMAT))
+    old.addHandler(handler)
+    old.setLevel(logging.INFO)
+
+    new = logging.getLogger("bench.new")
+    new.propagate = False
+
+    def old_request():
+        old.info(f"[INFO] Fetching history for user: {username}")
+        old.info(f"[INFO] History fetched for user {username}: {history}")
+        old.info(f"[INFO] Clipboard updated for user {username}: {text}")
+
+    def new_request(sampled):
+        if sampled:
+            log_sampled(new, "fetch", "[INFO] Fetching history for user: %s", username)
+            log_sampled(new, "fetch", "[INFO] History fetched for user %s: %s items", username, len(history))
+        else:
+            new.info("[INFO] Fetching history for user: %s", username)
+            new.info("[INFO] History fetched for user %s: %s items", username, len(history))
+        new.info("[INFO] Clipboard updated for user %s: %s", username, Payload(text))
+
+    print(f"{args.inserts:,} simulated requests (fetch-history + update-clipboard logging), "
+          f"{args.snippet_size:,}-byte payloads")
+    for label, fn, queued in (
+        ("f-strings, synchronous handler", old_request, False),
+        ("lazy + redacted, queue handler", lambda: new_request(False), True),
+        ("... and fetch logs sampled", lambda: new_request(True), True),
+    ):
+        listener = configure_logging(stream=devnull, logger=new) if queued else None
+        start = time.perf_counter()
+        for _ in range(args.inserts):
+            fn()
+        on_thread = time.perf_counter() - start
+        if listener:
+            listener.stop()  # Drains the queue
+        total = time.perf_counter() - start
+        print(f"{label:<32} {on_thread / args.inserts * 1e6:8.2f} us per request on the request thread, "
+              f"{total / args.inserts * 1e6:8.2f} us including the listener")
+    devnull.close()
+
+
+# Scenario: realistic mixed traffic across many users, with baselines that fail on regression
+DEFAULT_MIX = "fetch-history=40,fetch-copied-text=30,update-history=15,update-clipboard=10,login=5"
+
+
+def parse_mix(spec):
+    mix = {}
+    for entry in spec.split(","):
+        name, _, weight = entry.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(LOAD_REQUESTS)
+    if unknown:
+        raise SystemExit(f"Unknown request types in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def _fetch(path):
+    def fetch(session, url, user, etags, rng):
+        # Revalidate with the ETag from the previous fetch, as the browser does
+        key = (path, user)
+        headers = {"If-None-Match": etags[key]} if key in etags else {}
+        response = session.get(f"{url}/{path}/{user}", headers=headers)
+        if response.status_code == 200 and "ETag" in response.headers:
+            etags[key] = response.headers["ETag"]
+        return response
+    return fetch
+
+
+def _update_history(session, url, user, etags, rng):
+    return session.post(f"{url}/update-history/{user}", json={"text": f"snippet {rng.randrange(10 ** 6)} " * rng.randint(1, 20)})
+
+
+def _update_clipboard(session, url, user, etags, rng):
+    return session.post(f"{url}/update-clipboard", json={"username": user, "text": f"clip {rng.randrange(10 ** 6)}"})
+
+
+def _login(session, url, user, etags, rng):
+    return session.post(f"{url}/login", json={"username": user, "password": "bench"})
+
+
+LOAD_REQUESTS = {
+    "fetch-history": _fetch("fetch-history"),
+    "fetch-copied-text": _fetch("fetch-copied-text"),
+    "update-history": _update_history,
+    "update-clipboard": _update_clipboard,
+    "login": _login,
+}
+
+
+def run_mixed_load(url, users, clients, duration, mix, seed=0):
+    """Drive weighted mixed traffic from `clients` threads; returns {request type: (latencies, errors)} and elapsed."""
+    names, weights = list(mix), list(mix.values())
+    results = {name: ([], [0]) for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(i):
+        rng = random.Random(seed * 1000 + i)
+        etags = {}
+        latencies = {name: [] for name in names}
+        errors = dict.fromkeys(names, 0)
+        with requests.Session() as session:
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                user = rng.choice(users)
+                begin = time.perf_counter()
+                try:
+                    ok = LOAD_REQUESTS[name](session, url, user, etags, rng).status_code < 400
+                except requests.RequestException:
+                    ok = False
+                latencies[name].append(time.perf_counter() - begin)
+                errors[name] += not ok
+        with lock:
+            for name in names:
+                results[name][0].extend(latencies[name])
+                results[name][1][0] += errors[name]
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return {name: (latencies, errors[0]) for name, (latencies, errors) in results.items()}, elapsed
+
+
+def summarize_load(results, elapsed):
+    summary = {}
+    everything = []
+    for name, (latencies, errors) in results.items():
+        everything.extend(latencies)
+        if latencies:
+            summary[name] = {
+                "rps": len(latencies) / elapsed,
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "errors": errors,
+            }
+    summary["total"] = {
+        "rps": len(everything) / elapsed,
+        "p50": percentile(everything, 50),
+        "p95": percentile(everything, 95),
+        "p99": percentile(everything, 99),
+        "errors": sum(errors for _, errors in results.values()),
+    }
+    return summary
+
+
+def print_load_summary(summary):
+    print(f"{'request':<20} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, row in summary.items():
+        print(f"{name:<20} {row['rps']:9.1f} {row['p50'] * 1000:9.2f} {row['p95'] * 1000:9.2f} "
+              f"{row['p99'] * 1000:9.2f} {row['errors']:7d}")
+
+
+def compare_to_baseline(summary, baseline, tolerance):
+    """Regressions as messages: throughput below, or p95/p99 above, the baseline by more than `tolerance`."""
+    failures = []
+    for name, row in summary.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if row["rps"] < base["rps"] * (1 - tolerance):
+            failures.append(f"{name}: {row['rps']:.1f} req/s vs baseline {base['rps']:.1f}")
+        for key in ("p95", "p99"):
+            if row[key] > base[key] * (1 + tolerance):
+                failures.append(f"{name}: {key} {row[key] * 1000:.2f} ms vs baseline {base[key] * 1000:.2f} ms")
+        if row["errors"] > base["errors"]:
+            failures.append(f"{name}: {row['errors']} errors vs baseline {base['errors']}")
+    return failures
+
+
+def bench_load(args):
+    mix = parse_mix(args.mix)
+    users = [f"user{i}" for i in range(args.users)]
+    if args.url:
+        url, srv = args.url.rstrip("/"), None
+    else:
+        srv = InProcessServer(copy_delay=args.copy_delay).__enter__()
+        url = srv.url
+    try:
+        with requests.Session() as session:
+            for user in users:
+                session.post(f"{url}/login", json={"username": user, "password": "bench"}).raise_for_status()
+        if args.warmup:
+            run_mixed_load(url, users, args.clients, args.warmup, mix, seed=args.seed + 1)
+        results, elapsed = run_mixed_load(url, users, args.clients, args.duration, mix, seed=args.seed)
+    finally:
+        if srv is not None:
+            srv.__exit__(None, None, None)
+
+    summary = summarize_load(results, elapsed)
+    print(f"{len(users):,} users, {args.clients} clients, {args.duration:.0f} s, mix {args.mix}")
+    print_load_summary(summary)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"args": {"users": args.users, "clients": args.clients, "mix": args.mix}, "summary": summary}, f, indent=2)
+        print(f"baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["summary"]
+        failures = compare_to_baseline(summary, baseline, args.tolerance)
+        if failures:
+            print(f"REGRESSION (tolerance {args.tolerance:.0%}):")
+            for failure in failures:
+                print(f"  {failure}")
+            sys.exit(1)
+        print(f"no regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+# Scenario: throughput of serve.py as the worker count grows
+class ServeProcess:
+    """Runs serve.py in a subprocess, with a temporary database unless `db` is given."""
+
+    def __init__(self, workers, db=None, port=None, extra_args=(), env=None):
+        self.tmpdir = tempfile.TemporaryDirectory() if db is None else None
+        self.env = env or {}
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.cmd = [
+            sys.executable, os.path.join(REPO_DIR, "serve.py"), "--port", str(self.port),
+            "--db", db or os.path.join(self.tmpdir.name, "users.db"), "--workers", str(workers), *extra_args,
+        ]
+
+    def __enter__(self):
+        env = dict(os.environ, CLIPBOARD_LOG_LEVEL="WARNING", **self.env)
+        self.process = subprocess.Popen(self.cmd, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                if requests.get(f"{self.url}/health", timeout=1).ok:
+                    return self
+            except requests.RequestException:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError("serve.py did not become healthy")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        if self.tmpdir is not None:
+            self.tmpdir.cleanup()
+
+
+# Scenario: latency of well-behaved users while one client floods writes, with and without admission control
+UNLIMITED = {"CLIPBOARD_WRITE_RATE": "1e9", "CLIPBOARD_WRITE_BURST": "1e9", "CLIPBOARD_MAX_PENDING_WRITES": "1000000000"}
+
+
+ABUSE_BATCH = 50  # Items in each of the abusive client's batch writes
+
+
+def flood_bodies(rng, text_size, variants=32):
+    """The abusive client's requests as (path, JSON body) pairs, encoded once so sending them costs it little."""
+    bodies = []
+    for _ in range(variants):
+        text = f"{rng.random()} " + "x" * text_size
+        bodies.append(("/update-clipboard", json.dumps({"username": "abuser", "text": text}).encode()))
+        bodies.append(("/update-history/abuser", json.dumps({"text": text}).encode()))
+        ops = [{"op": "add", "list": "history", "text": f"{rng.random()} {text[:1024]}"} for _ in range(ABUSE_BATCH)]
+        bodies.append(("/history/abuser/batch", json.dumps({"ops": ops}).encode()))
+    return bodies
+
+
+def flood(url, stop, counts, bodies, rate):
+    """One thread of an abusive client: clipboard, history and batch writes for one user, ignoring Retry-After.
+
+    Requests go out at `rate` a second whatever the responses (open loop), as a client
+    that floods does not slow down for faster refusals; a thread that falls behind sends
+    back to back.
+    """
+    due = time.perf_counter()
+    with requests.Session() as session:
+        for path, body in itertools.cycle(bodies):
+            if stop.is_set():
+                break
+            due += 1 / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                due -= delay
+            response = session.post(f"{url}{path}", data=body, headers={"Content-Type": "application/json"})
+            counts[response.status_code] = counts.get(response.status_code, 0) + 1
+
+
+def bench_admission(args):
+    mix = parse_mix(args.mix)
+    users = [f"user{i}" for i in range(args.users)]
+    print(f"{len(users):,} users on {args.clients} clients ({args.mix}); abuser at {args.abuse_rate:.0f} req/s on {args.abusers} threads, "
+          f"{args.snippet_size:,}-byte writes and {ABUSE_BATCH}-item batches; {args.duration:.0f} s per run")
+    print(f"{'run':<24} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'write p99':>10} {'errors':>7} "
+          f"{'abuser ok/s':>12} {'429/s':>8}")
+    for label, env, abusers in (
+        ("alone", {}, 0),
+        ("abuser, no limits", UNLIMITED, args.abusers),
+        ("abuser, admission", {}, args.abusers),
+    ):
+        with ServeProcess(1, env=env) as srv:
+            with requests.Session() as session:
+                for user in users + ["abuser"]:
+                    session.post(f"{srv.url}/login", json={"username": user, "password": "bench"}).raise_for_status()
+            stop, counts = threading.Event(), [{} for _ in range(abusers)]
+            bodies = flood_bodies(random.Random(args.seed), args.snippet_size)
+            threads = [
+                threading.Thread(
+                    target=flood,
+                    args=(srv.url, stop, counts[i], bodies[i::abusers], args.abuse_rate / abusers),
+                )
+                for i in range(abusers)
+            ]
+            for t in threads:
+                t.start()
+            try:
+                if args.warmup:
+                    run_mixed_load(srv.url, users, args.clients, args.warmup, mix, seed=args.seed + 1)
+                before = [dict(c) for c in counts]
+                results, elapsed = run_mixed_load(srv.url, users, args.clients, args.duration, mix, seed=args.seed)
+                after = [dict(c) for c in counts]
+            finally:
+                stop.set()
+                for t in threads:
+                    t.join()
+        summary = summarize_load(results, elapsed)
+        total = summary["total"]
+        writes = [latency for name in ("update-history", "update-clipboard") if name in results for latency in results[name][0]]
+        ok = sum(a.get(200, 0) - b.get(200, 0) for a, b in zip(after, before)) / elapsed
+        refused = sum(a.get(429, 0) - b.get(429, 0) for a, b in zip(after, before)) / elapsed
+        print(f"{label:<24} {total['rps']:8.1f} {total['p50'] * 1000:8.2f} {total['p95'] * 1000:8.2f} "
+              f"{total['p99'] * 1000:8.2f} {percentile(writes, 99) * 1000 if writes else 0:10.2f} {total['errors']:7d} "
+              f"{ok:12.1f} {refused:8.1f}")
+
+
+def bench_workers(args):
+    mix = parse_mix(args.mix)
+    users = [f"user{i}" for i in range(args.users)]
+    counts = [int(count) for count in args.worker_counts.split(",")]
+    print(f"{os.cpu_count()} CPUs, {len(users):,} users, {args.clients} clients, {args.duration:.0f} s per run")
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'speedup':>8}")
+    base_rps = None
+    for count in counts:
+        with ServeProcess(count) as srv, requests.Session() as session:
+            for user in users:
+                session.post(f"{srv.url}/login", json={"username": user, "password": "bench"}).raise_for_status()
+            if args.warmup:
+                run_mixed_load(srv.url, users, args.clients, args.warmup, mix, seed=args.seed + 1)
+            results, elapsed = run_mixed_load(srv.url, users, args.clients, args.duration, mix, seed=args.seed)
+        total = summarize_load(results, elapsed)["total"]
+        base_rps = base_rps or total["rps"]
+        print(f"{count:7d} {total['rps']:9.1f} {total['p50'] * 1000:9.2f} {total['p95'] * 1000:9.2f} "
+              f"{total['p99'] * 1000:9.2f} {total['errors']:7d} {total['rps'] / base_rps:7.2f}x")
+
+
+# Scenario: replication between three server instances chained A <-> B <-> C
+def replication_vectors(nodes):
+    return [requests.get(f"{node.url}/replication/status").json()["vector"] for node in nodes]
+
+
+def wait_converged(nodes, timeout=60):
+    """Wait until every node has recorded the same changes. Returns the seconds waited, or None."""
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        vectors = replication_vectors(nodes)
+        if all(vector == vectors[0] for vector in vectors):
+            return time.perf_counter() - start
+        time.sleep(0.05)
+    return None
+
+
+def list_contents(node, username):
+    return [
+        sorted(set(requests.get(f"{node.url}/fetch-{name}/{username}").json()["history"]))
+        for name in ("history", "copied-text")
+    ]
+
+
+def bench_replication(args):
+    ports = [free_port() for _ in range(3)]
+    urls = [f"http://127.0.0.1:{port}" for port in ports]
+    peers = [urls[1], f"{urls[0]},{urls[2]}", urls[1]]  # C only hears about A's changes through B
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        def node(i):
+            # Without write limits: one user's churn and catch-up backlog are the point here, not abuse
+            return ServeProcess(
+                1, db=os.path.join(tmp, f"node{i}.db"), port=ports[i], extra_args=("--peers", peers[i]), env=UNLIMITED,
+            )
+
+        a, b, c = nodes = [node(i).__enter__() for i in range(3)]
+        try:
+            for srv in nodes:
+                requests.post(f"{srv.url}/login", json={"username": "rep", "password": "pw"}).raise_for_status()
+                requests.post(f"{srv.url}/update-history-limit/rep", json={"limit": 10000}).raise_for_status()
+
+            # Latency: a copy on A until it is listed on C, two hops away
+            lags = []
+            with requests.Session() as session:
+                for i in range(args.changes):
+                    text = f"copied on A {i}"
+                    session.post(f"{a.url}/update-copied-text", json={"username": "rep", "text": text}).raise_for_status()
+                    start = time.perf_counter()
+                    while text not in session.get(f"{c.url}/fetch-copied-text/rep").json()["history"]:
+                        time.sleep(0.005)
+                    lags.append(time.perf_counter() - start)
+            print(f"A -> C (via B) over {len(lags)} copies: p50 {percentile(lags, 50) * 1000:.0f} ms, "
+                  f"p95 {percentile(lags, 95) * 1000:.0f} ms, max {max(lags) * 1000:.0f} ms")
+
+            # Conflicts: concurrent adds, deletes and clears of the same items on every node
+            def churn(srv, seed):
+                rng = random.Random(seed)
+                deadline = time.perf_counter() + args.duration
+                with requests.Session() as session:
+                    while time.perf_counter() < deadline:
+                        roll, text = rng.random(), f"item {rng.randrange(20)}"
+                        if roll < 0.6:
+                            session.post(f"{srv.url}/update-history/rep", json={"text": text})
+                        elif roll < 0.95:
+                            session.post(f"{srv.url}/delete-history/rep", json={"text": text})
+                        else:
+                            session.post(f"{srv.url}/clear-history/rep")
+
+            threads = [threading.Thread(target=churn, args=(srv, i)) for i, srv in enumerate(nodes)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            settle = wait_converged(nodes)
+            contents = [list_contents(srv, "rep") for srv in nodes]
+            same = all(content == contents[0] for content in contents)
+            print(f"concurrent churn on 3 nodes for {args.duration:.0f} s: logs converged in "
+                  f"{'-' if settle is None else f'{settle:.2f} s'}, every node holds the same items: {same}")
+            if settle is None:
+                failures.append("logs did not converge after concurrent churn")
+            if not same:
+                failures.append("nodes hold different items after concurrent churn")
+
+            # Catch-up: C is down while A takes writes, then resumes from its checkpoint
+            c.__exit__()
+            with requests.Session() as session:
+                for i in range(args.inserts):
+                    session.post(f"{a.url}/update-copied-text", json={"username": "rep", "text": f"while C was down {i}"})
+            c = nodes[2] = node(2).__enter__()
+            catch_up = wait_converged(nodes, timeout=120)
+            status = requests.get(f"{c.url}/replication/status").json()["peers"][0]
+            print(f"C restarted after missing {args.inserts} changes: caught up in "
+                  f"{'-' if catch_up is None else f'{catch_up:.2f} s'}, {status['received']} entries, "
+                  f"{status['bytes'] / 1e3:.0f} KB from B")
+            if catch_up is None:
+                failures.append("restarted node did not catch up")
+
+            # Bandwidth while idle
+            before = requests.get(f"{b.url}/replication/status").json()["peers"]
+            time.sleep(2)
+            after = requests.get(f"{b.url}/replication/status").json()["peers"]
+            idle = sum(x["bytes"] - y["bytes"] for x, y in zip(after, before)) / 2
+            print(f"idle: B receives {idle:.0f} bytes/s from its {len(after)} peers")
+        finally:
+            for srv in nodes:
+                srv.__exit__()
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+# Scenario: peak server memory while uploading, exporting and importing hundreds of MB
+class RssSampler:
+    """Tracks the peak RSS of a process from a background thread."""
+
+    def __init__(self, pid, interval=0.02):
+        from supervisor import read_proc_stats
+        self.read = lambda: (read_proc_stats(pid) or (0, 0))[1]
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self.read()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.read())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def upload_chunked(session, url, username, index, size, chunk_size=4 * 1024 * 1024):
+    """Send one distinct `size`-byte item through a resumable upload, chunk by chunk."""
+    upload_id = session.post(f"{url}/uploads/{username}").json()["upload_id"]
+    block = f"item {index:08d} ".encode() * (chunk_size // 14 + 1)
+    offset = 0
+    while offset < size:
+        chunk = block[:min(chunk_size, size - offset)]
+        response = session.put(f"{url}/uploads/{username}/{upload_id}?offset={offset}", data=chunk)
+        response.raise_for_status()
+        offset = response.json()["offset"]
+    session.post(f"{url}/uploads/{username}/{upload_id}/commit?target=copied").raise_for_status()
+
+
+def bench_export(args):
+    sizes = [int(size) * 1024 * 1024 for size in args.export_sizes.split(",")]
+    item_size = args.large_size
+    print(f"items of {item_size / 1e6:.1f} MB; peak RSS of the serving process per phase")
+    print(f"{'data':>8} {'idle':>9} {'upload':>9} {'export':>9} {'export MB/s':>12} {'import':>9} {'lines ok':>9}")
+    for total in sizes:
+        count = max(1, total // item_size)
+        with ServeProcess(1) as srv, requests.Session() as session:
+            for user in ("exporter", "importer"):
+                session.post(f"{srv.url}/login", json={"username": user, "password": "pw"}).raise_for_status()
+                session.post(f"{srv.url}/update-history-limit/{user}", json={"limit": count + 10}).raise_for_status()
+            idle = RssSampler(srv.process.pid).read()
+
+            with RssSampler(srv.process.pid) as upload:
+                for i in range(count):
+                    upload_chunked(session, srv.url, "exporter", i, item_size)
+
+            # Export, checking each line parses without keeping any of them
+            lines = nbytes = 0
+            with RssSampler(srv.process.pid) as export:
+                start = time.perf_counter()
+                with session.get(f"{srv.url}/history/exporter/export", stream=True) as response:
+                    response.raise_for_status()
+                    for line in response.iter_lines(chunk_size=1024 * 1024):
+                        if line:
+                            nbytes += len(line)
+                            lines += json.loads(line)["size"] == item_size
+                elapsed = time.perf_counter() - start
+
+            # Import: the export piped straight into another user's import
+            with RssSampler(srv.process.pid) as imported:
+                with session.get(f"{srv.url}/history/exporter/export", stream=True) as response:
+                    result = session.post(
+                        f"{srv.url}/history/importer/import", data=response.iter_content(1024 * 1024)
+                    ).json()
+            print(f"{total / 1e6:>6.0f}MB {idle / 1e6:>7.0f}MB {upload.peak / 1e6:>7.0f}MB {export.peak / 1e6:>7.0f}MB "
+                  f"{nbytes / 1e6 / elapsed:>12.0f} {imported.peak / 1e6:>7.0f}MB {lines:>5}/{count} "
+                  f"(imported {result.get('imported')})")
+
+
+# Scenario: capture agent delivery through server outages and an agent restart
+class FlakyApp:
+    """ASGI wrapper simulating outages: "down" answers 503 without reaching the app,
+    "lost" lets the app apply the request but replaces its response with a 502."""
+
+    def __init__(self, app):
+        self.app = app
+        self.mode = "up"
+        self.counts = {"up": 0, "down": 0, "lost": 0}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/health":
+            return await self.app(scope, receive, send)
+        mode = self.mode
+        self.counts[mode] += 1
+        if mode == "up":
+            return await self.app(scope, receive, send)
+        if mode == "lost":
+            async def discard(message):
+                pass
+            await self.app(scope, receive, discard)
+        await send({"type": "http.response.start", "status": 503 if mode == "down" else 502, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+def run_outages(flaky, stop, schedule=(("up", 1.0), ("down", 0.5), ("up", 0.5), ("lost", 0.5))):
+    while not stop.is_set():
+        for mode, seconds in schedule:
+            flaky.mode = mode
+            if stop.wait(seconds):
+                break
+    flaky.mode = "up"
+
+
+def count_delivered(username):
+    import storage
+
+    return storage.get_store().read(lambda conn: conn.execute(
+        "SELECT COUNT(*), COUNT(DISTINCT hash) FROM changes WHERE username = ? AND list = 'copied' AND op = 'add'",
+        (username,),
+    ).fetchone())
+
+
+def bench_agent(args):
+    from clipboard_monitor import CaptureAgent
+    from outbox import Outbox
+
+    flaky = None
+
+    def wrap(app):
+        nonlocal flaky
+        flaky = FlakyApp(app)
+        return flaky
+
+    interval = 1.0 / args.capture_rate
+    with InProcessServer(copy_delay=0, wrap=wrap) as srv, tempfile.TemporaryDirectory() as tmp:
+        # Before: one fire-and-forget POST per change, as the old monitor did
+        stop = threading.Event()
+        outages = threading.Thread(target=run_outages, args=(flaky, stop))
+        outages.start()
+        with requests.Session() as session:
+            for i in range(args.captures):
+                try:
+                    session.post(f"{srv.url}/update-copied-text", json={"username": "naive", "text": f"naive capture {i}"}, timeout=5)
+                except requests.RequestException:
+                    pass
+                time.sleep(interval)
+        stop.set()
+        outages.join()
+        naive, _ = count_delivered("naive")
+
+        # After: outbox + batched, retried uploads, with the agent restarted halfway through
+        outbox_path = os.path.join(tmp, "outbox.db")
+        options = dict(batch_size=args.batch_size, backoff_base=0.05, backoff_max=1.0)
+        outbox = Outbox(outbox_path)
+        agent = CaptureAgent(srv.url, "agent", outbox, **options)
+        agent.start()
+        stop = threading.Event()
+        outages = threading.Thread(target=run_outages, args=(flaky, stop))
+        outages.start()
+        start = time.perf_counter()
+        uploads = retries = 0
+        for i in range(args.captures):
+            if i == args.captures // 2:
+                agent.stop()
+                uploads, retries = agent.uploads, agent.retries
+                outbox.close()
+                outbox = Outbox(outbox_path)
+                agent = CaptureAgent(srv.url, "agent", outbox, **options)
+                agent.start()
+            agent.capture(f"agent capture {i}")
+            time.sleep(interval)
+        stop.set()
+        outages.join()
+        flushed = agent.flush(timeout=60)
+        elapsed = time.perf_counter() - start
+        agent.stop()
+        outbox.close()
+        delivered, distinct = count_delivered("agent")
+
+    print(f"{args.captures} captures at {args.capture_rate:.0f}/s, outage cycle up 1 s / down 0.5 s / up 0.5 s / lost response 0.5 s")
+    print(f"before (one POST per change): {naive}/{args.captures} delivered, {args.captures - naive} lost")
+    print(f"after (outbox + batched retries, restarted once): {delivered}/{args.captures} delivered, "
+          f"{delivered - distinct} duplicates, flushed={flushed} in {elapsed:.1f} s")
+    print(f"  {uploads + agent.uploads} upload requests ({args.captures / max(1, uploads + agent.uploads):.1f} captures each), "
+          f"{retries + agent.retries} retries")
+
+
+# Scenario: rendering and scrolling 10k-item lists in a headless browser
+DOM_PROBE = """
+() => new Promise(resolve => {
+  const list = document.getElementById('history-list');
+  const frames = [];
+  let last = performance.now();
+  const end = last + %d;
+  function step(now) {
+    frames.push(now - last);
+    last = now;
+    list.scrollTop = (list.scrollTop + 400) %% Math.max(1, list.scrollHeight - list.clientHeight);
+    if (now < end) {
+      requestAnimationFrame(step);
+    } else {
+      resolve({
+        frames,
+        nodes: document.getElementsByTagName('*').length,
+        heap: performance.memory ? performance.memory.usedJSHeapSize : null,
+      });
+    }
+  }
+  requestAnimationFrame(step);
+})
+"""
+
+COUNT_MUTATIONS = """
+() => new Promise(resolve => {
+  let count = 0;
+  const observer = new MutationObserver(records => { count += records.length; });
+  for (const id of ['history-list', 'copied-text-list']) {
+    observer.observe(document.getElementById(id), { childList: true, subtree: true, characterData: true });
+  }
+  loadHistory();
+  loadCopiedText();
+  setTimeout(() => { observer.disconnect(); resolve(count); }, 1000);
+})
+"""
+
+
+def bench_dom(args):
+    try:
+        from playwright.sync_api import sync_playwright
+    except ImportError:
+        print("dom: skipped, playwright is not installed (pip install playwright && playwright install chromium)")
+        return
+    import storage
+
+    old_script = None
+    if args.script_ref:
+        old_script = subprocess.run(
+            ["git", "show", f"{args.script_ref}:static/js/script.js"], cwd=REPO_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+
+    with InProcessServer(copy_delay=0) as srv:
+        store = storage.get_store()
+        store.write(storage.register_user, "domuser", "pw")
+        store.write(storage.set_history_limit, "domuser", args.items)
+        now = time.time()
+        for table in ("history", "copied_text_history"):
+            rows = [("domuser", f"{table} item {i} " + "lorem ipsum " * 8, now - i) for i in range(args.items)]
+            store.write(bulk_insert_history, table, rows)
+
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch(args=["--enable-precise-memory-info"])
+            versions = [("current", None)] + ([(args.script_ref, old_script)] if old_script else [])
+            for label, script in versions:
+                page = browser.new_page()
+                if script is not None:
+                    page.route("**/static/js/script.js", lambda route, body=script: route.fulfill(
+                        body=body, content_type="application/javascript"))
+                page.goto(srv.url)
+                start = time.perf_counter()
+                page.fill("#username-input", "domuser")
+                page.fill("#password-input", "pw")
+                page.click("#login-btn")
+                page.wait_for_selector("#history-list .history-item")
+                page.evaluate("() => new Promise(resolve => requestAnimationFrame(() => requestAnimationFrame(resolve)))")
+                loaded = time.perf_counter() - start
+                probe = page.evaluate(DOM_PROBE % int(args.duration * 1000))
+                mutations = page.evaluate(COUNT_MUTATIONS)
+                frames = sorted(probe["frames"][1:]) or [0.0]
+                heap = f"{probe['heap'] / 1e6:.1f} MB" if probe["heap"] else "n/a"
+                print(f"{label}: {args.items} items per list, login to first row {loaded * 1000:.0f} ms, "
+                      f"{probe['nodes']} DOM nodes, JS heap {heap}")
+                print(f"  scrolling: {len(frames)} frames, p50 {percentile(frames, 50):.1f} ms, "
+                      f"p95 {percentile(frames, 95):.1f} ms, max {frames[-1]:.1f} ms")
+                print(f"  reload with no changes: {mutations} DOM mutation records")
+                page.close()
+            browser.close()
+
+
+# Scenario: bytes on the wire and requests/s for the index, static files and a large fetch
+def legacy_static_app():
+    """The index and static serving as they were before assets.py: read per request, uncompressed."""
+    from fastapi import FastAPI
+    from fastapi.responses import HTMLResponse
+    from fastapi.staticfiles import StaticFiles
+
+    app = FastAPI()
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    @app.get("/")
+    async def serve_index():
+        with open("templates/index.html", "r") as file:
+            return HTMLResponse(content=file.read())
+
+    return app
+
+
+def measure_url(url, clients, duration, headers):
+    """(requests/s, bytes on the wire per response) for GETs of url."""
+    with requests.get(url, headers=headers, stream=True) as response:
+        response.raise_for_status()
+        wire = len(response.raw.read(decode_content=False))
+
+    def fetch(session):
+        session.get(url, headers=headers).content
+
+    return run_clients(clients, duration, fetch) / duration, wire
+
+
+def bench_assets(args):
+    import re
+
+    identity = {"Accept-Encoding": "identity"}
+    browser = {"Accept-Encoding": "gzip, deflate, br"}
+    paths = ("/", "/static/js/script.js", "/static/css/style.css")
+    results = {}
+    with InProcessServer(wrap=lambda app: legacy_static_app()) as srv:
+        for path in paths:
+            results[("before", path)] = measure_url(srv.url + path, args.clients, args.duration, browser)
+
+    with InProcessServer() as srv:
+        index = requests.get(srv.url).text
+        hashed = dict(zip(paths[1:], (re.search(rf'"(/static/{kind}/[^"]+)"', index)[1] for kind in ("js", "css"))))
+        for path in paths:
+            results[("after", path)] = measure_url(srv.url + hashed.get(path, path), args.clients, args.duration, browser)
+        response = requests.get(srv.url + hashed[paths[1]], headers=browser)
+        print(f"{hashed[paths[1]]}: Cache-Control {response.headers['Cache-Control']!r}, "
+              f"Content-Encoding {response.headers.get('Content-Encoding')!r}")
+
+        store_rows = [("assets", f"history item {i} " + "lorem ipsum dolor sit amet " * 40, time.time() - i) for i in range(100)]
+        requests.post(f"{srv.url}/login", json={"username": "assets", "password": "pw"})
+        store = srv.server_module.storage.get_store()
+        store.write(srv.server_module.storage.set_history_limit, "assets", 100)
+        store.write(bulk_insert_history, "history", store_rows)
+        fetch_url = f"{srv.url}/fetch-history/assets"
+        for label, headers in (("identity", identity), ("gzip", browser)):
+            results[(label, "/fetch-history")] = measure_url(fetch_url, args.clients, args.duration, headers)
+
+    print(f"{'':8} {'path':24} {'req/s':>8} {'bytes':>8}")
+    for (label, path), (rate, wire) in results.items():
+        print(f"{label:8} {path:24} {rate:8.0f} {wire:8}")
+
+
+# Scenario: cold-start time of server.py (to the first /health) and typer.py (to the first typed character)
+TYPER_DRIVER = """
+import os, sys, time
+start = float(sys.argv[1])
+import typer
+try:
+    typer.register_hotkeys()
+except ImportError:
+    print("no keyboard", flush=True)
+def write(chunk):
+    print(time.time() - start)
+    os._exit(0)
+typer.engine.write_fn = write
+typer.engine.load("x")
+typer.engine.step()
+"""
+
+
+def parse_importtime(stderr, top=8):
+    """Total and slowest top-level imports from `-X importtime` output, as (total_us, [(us, module)])."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # Top level: imported by the script itself
+            imports.append((int(cumulative), name.strip()))
+    return sum(us for us, _ in imports), sorted(imports, reverse=True)[:top]
+
+
+def time_server_start(tmp):
+    port = free_port()
+    env = dict(os.environ, CLIPBOARD_DB_PATH=os.path.join(tmp, f"users-{port}.db"), CLIPBOARD_PORT=str(port),
+               CLIPBOARD_LOG_LEVEL="WARNING")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "server.py"], cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        while process.poll() is None:
+            try:
+                if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                    break
+            except requests.RequestException:
+                time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        _, stderr = process.communicate()
+    if process.returncode not in (0, -15):
+        raise RuntimeError(f"server.py exited with {process.returncode}: {stderr[-500:]}")
+    return elapsed, stderr
+
+
+def time_typer_start():
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", TYPER_DRIVER, str(time.time())],
+                             cwd=REPO_DIR, capture_output=True, text=True)
+    if process.returncode != 0:
+        return None, process.stderr, False
+    lines = process.stdout.strip().splitlines()
+    return float(lines[-1]), process.stderr, "no keyboard" not in lines
+
+
+def report_startup(label, times, stderr, budget_ms):
+    total_us, slowest = parse_importtime(stderr)
+    p50 = percentile(times, 50) * 1000
+    print(f"{label}: p50 {p50:.0f} ms, min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms "
+          f"over {len(times)} runs; imports {total_us / 1000:.0f} ms")
+    for us, name in slowest:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+    if budget_ms and p50 > budget_ms:
+        return [f"{label}: p50 {p50:.0f} ms exceeds the {budget_ms:.0f} ms budget"]
+    return []
+
+
+def bench_startup(args):
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [time_server_start(tmp) for _ in range(args.runs)]
+    failures += report_startup("server.py to first /health", [t for t, _ in runs], runs[-1][1], args.health_budget)
+
+    runs = [time_typer_start() for _ in range(args.runs)]
+    if runs[0][0] is None:
+        print(f"typer.py to first character: skipped, typer.py could not start here ({runs[0][1].strip().splitlines()[-1]})")
+    else:
+        label = "typer.py to first character"
+        if not runs[0][2]:
+            label += " (keyboard not installed: hotkeys not registered)"
+        failures += report_startup(label, [t for t, _, _ in runs], runs[-1][1], args.type_budget)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+# Scenario: gui.py's log pipeline under a flood of child process output
+LOG_PRODUCER = """
+import sys, time
+rate, duration = float(sys.argv[1]), float(sys.argv[2])
+start, sent, out = time.perf_counter(), 0, sys.stdout
+while (elapsed := time.perf_counter() - start) < duration:
+    due = int(elapsed * rate)
+    if due > sent:
+        out.write("".join(f"2026-01-01 12:00:00,000 - server - INFO - [INFO] Fetching history for user: user{i % 100}\\n"
+                          for i in range(sent, due)))
+        sent = due
+    else:
+        time.sleep(0.001)
+out.flush()
+print(sent, file=sys.stderr)
+"""
+
+
+class MockTextInput:
+    """Stands in for Kivy's TextInput: setting text re-splits it into lines, as its re-layout does."""
+
+    def __init__(self):
+        self._text = ""
+        self.updates = 0
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self._lines = value.split("\n")
+        self.updates += 1
+
+
+def bench_log_pipeline(args):
+    from log_pipeline import LogPipeline
+
+    pipeline = LogPipeline()
+    widget = MockTextInput()
+    frame = 1 / 60
+    process = subprocess.Popen([sys.executable, "-c", LOG_PRODUCER, str(args.line_rate), str(args.duration)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    reader = pipeline.attach(process.stdout)
+    frame_times = []
+    start = time.perf_counter()
+    next_frame = start
+    while reader.is_alive() or pipeline._pending:
+        begin = time.perf_counter()
+        if pipeline.flush():  # What gui.py's per-frame Clock callback does
+            widget.text = pipeline.render()
+        frame_times.append(time.perf_counter() - begin)
+        next_frame += frame
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    sent = int(process.communicate()[1].strip())
+    print(f"pipeline: {sent:,} lines at {args.line_rate:,.0f}/s target -> {pipeline.flushed:,} shown "
+          f"({pipeline.flushed / elapsed:,.0f} lines/s), {pipeline.dropped:,} dropped, "
+          f"buffer {len(pipeline.lines):,} lines, {widget.updates} widget updates")
+    print(f"  UI work per frame: p50 {percentile(frame_times, 50) * 1000:.2f} ms, "
+          f"p99 {percentile(frame_times, 99) * 1000:.2f} ms, max {max(frame_times) * 1000:.2f} ms")
+
+    # Before: every line scheduled its own callback appending to the whole text
+    widget = MockTextInput()
+    lines = [f"2026-01-01 12:00:00,000 - server - INFO - [INFO] Fetching history for user: user{i % 100}"
+             for i in range(args.old_lines)]
+    begin = time.perf_counter()
+    for line in lines:
+        widget.text += f"{line}\n"
+    old = time.perf_counter() - begin
+    print(f"per-line append: {args.old_lines:,} lines took {old:.2f} s of UI time ({args.old_lines / old:,.0f} lines/s), "
+          f"{widget.updates:,} widget updates, text still growing ({len(widget.text) / 1e6:.1f} MB)")
+
+
+# Scenario: supervisor behaviour with dummy child processes
+HEALTHY_FOR = """
+import http.server, sys, time
+healthy_until = time.monotonic() + float(sys.argv[2])
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if time.monotonic() < healthy_until else 500)
+        self.end_headers()
+    def log_message(self, *args):
+        pass
+http.server.HTTPServer(("127.0.0.1", int(sys.argv[1])), Handler).serve_forever()
+"""
+
+
+def bench_supervisor(args):
+    from supervisor import Service
+
+    results = []
+
+    def check(name, ok, detail):
+        results.append(ok)
+        print(f"{'PASS' if ok else 'FAIL'}  {name}: {detail}")
+
+    lines = []
+    quiet = dict(output=lines.append, cwd=REPO_DIR)
+
+    # A child that crashes at once is restarted with growing delays, not in a tight loop
+    crasher = Service("crasher", [sys.executable, "-c", "import sys; sys.exit(3)"], backoff_base=0.1, backoff_max=0.8, **quiet)
+    cpu_before = os.times()
+    crasher.start()
+    time.sleep(3.0)
+    crasher.stop()
+    cpu = sum(os.times()[2:4]) - sum(cpu_before[2:4])  # Children's CPU time
+    check("crash loop backoff", 3 <= crasher.restarts <= 8,
+          f"{crasher.restarts} restarts in 3 s, children used {cpu:.2f} s CPU, last exit {crasher.last_exit}")
+    tight = 0
+    deadline = time.monotonic() + 3.0
+    while time.monotonic() < deadline:  # What run_typer's old loop did
+        subprocess.run([sys.executable, "-c", "import sys; sys.exit(3)"])
+        tight += 1
+    print(f"      (immediate restarts: {tight} in 3 s)")
+
+    # A child that stops answering /health is restarted
+    port = free_port()
+    sick = Service("sick", [sys.executable, "-c", HEALTHY_FOR, str(port), "1.0"], health_url=f"http://127.0.0.1:{port}/",
+                   probe_interval=0.2, startup_grace=0.5, max_probe_failures=3, backoff_base=0.1, **quiet)
+    sick.start()
+    states = set()
+    deadline = time.monotonic() + 4.0
+    while time.monotonic() < deadline:
+        states.add(sick.state)
+        time.sleep(0.05)
+    sick.stop()
+    check("health probe restart", sick.restarts >= 1 and {"running", "unhealthy"} <= states,
+          f"{sick.restarts} restarts in 4 s, states seen {sorted(states)}")
+
+    # A child that ignores SIGTERM is killed after kill_timeout
+    stubborn = Service("stubborn", [sys.executable, "-c",
+                                    "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print('ready', flush=True); time.sleep(60)"],
+                       kill_timeout=0.5, **quiet)
+    stubborn.start()
+    while not any("ready" in line for line in lines):
+        time.sleep(0.01)
+    begin = time.perf_counter()
+    stubborn.stop()
+    took = time.perf_counter() - begin
+    check("SIGTERM then SIGKILL", stubborn.process.returncode == -9 and 0.5 <= took < 2.0,
+          f"stopped in {took:.2f} s with return code {stubborn.process.returncode}")
+
+    # CPU and RSS sampling from /proc
+    busy = Service("busy", [sys.executable, "-c", "data = bytearray(64 * 1024 * 1024)\nwhile True: pass"], **quiet)
+    busy.start()
+    time.sleep(0.5)
+    busy.sample()
+    time.sleep(1.0)
+    sample = busy.sample()
+    busy.stop()
+    check("CPU and RSS sampling", sample is not None and sample["cpu"] is not None and sample["cpu"] > 20 and sample["rss"] > 64e6,
+          f"{sample}")
+
+    if not all(results):
+        sys.exit(1)
+
+
+def dir_size(path):
+    if not os.path.isdir(path):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(path))
+
+
+# Scenario: mixed small and multi-MB payloads, all stored inline vs. compressed/spilled
+def bench_tiers(args):
+    import storage
+
+    rng = random.Random(9)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9))) for _ in range(5000)]
+    corpus = " ".join(rng.choices(vocabulary, k=args.large_size // 5))
+    users = [f"user{i}" for i in range(10)]
+
+    def payload(i):
+        roll = rng.random()
+        if roll < args.large_share:
+            size = rng.randint(args.large_size // 4, args.large_size)
+        elif roll < args.large_share * 5:
+            size = rng.randint(32 * 1024, 512 * 1024)
+        else:
+            size = rng.randint(50, 2000)
+        start = rng.randrange(0, len(corpus) - size)
+        return f"payload {i} " + corpus[start:start + size]
+
+    payloads = [payload(i) for i in range(args.inserts)]
+    print(f"{args.inserts} payloads, {sum(map(len, payloads)) / 1e6:.1f} MB total, "
+          f"largest {max(map(len, payloads)) / 1e6:.1f} MB")
+    defaults = (storage.COMPRESS_THRESHOLD, storage.SPILL_THRESHOLD)
+    for label, thresholds in (("inline", (float("inf"), float("inf"))), ("tiered", defaults)):
+        storage.COMPRESS_THRESHOLD, storage.SPILL_THRESHOLD = thresholds
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "users.db")
+            store = storage.init_db(path)
+            for user in users:
+                store.write(storage.register_user, user, "pw")
+                store.write(storage.set_history_limit, user, args.inserts)
+            start = time.perf_counter()
+            for i, text in enumerate(payloads):
+                store.write(storage.add_history_item, "history", users[i % len(users)], text)
+            insert_time = (time.perf_counter() - start) / len(payloads)
+
+            fetches, body_sizes = [], []
+            for _ in range(args.searches):
+                user = rng.choice(users)
+                begin = time.perf_counter()
+                items = store.read(storage.get_history, "history", user)
+                fetches.append(time.perf_counter() - begin)
+                body_sizes.append(sum(len(item["text"]) for item in items))
+
+            largest = max(payloads, key=len)
+            digest = storage.content_hash(largest)
+            owner = users[payloads.index(largest) % len(users)]
+            begin = time.perf_counter()
+            assert store.read(storage.load_blob, owner, digest) == largest
+            full_read = time.perf_counter() - begin
+            store.close()
+            print(f"{label:<7} insert {insert_time * 1000:7.2f} ms   list p50 {percentile(fetches, 50) * 1000:7.2f} ms   "
+                  f"p95 {percentile(fetches, 95) * 1000:7.2f} ms   list text {sum(body_sizes) / len(body_sizes) / 1e3:8.1f} kB   "
+                  f"db {db_size(path) / 1e6:6.1f} MB   files {dir_size(os.path.join(tmpdir, 'blobs')) / 1e6:6.1f} MB   "
+                  f"full read {full_read * 1000:6.1f} ms")
+    storage.COMPRESS_THRESHOLD, storage.SPILL_THRESHOLD = defaults
+
+
+class MockKeyboard:
+    """Stand-in for keyboard.write that records output and costs `per_call` seconds per call."""
+
+    def __init__(self, per_call=0.0):
+        self.per_call = per_call
+        self.calls = 0
+        self.chunks = []
+
+    def write(self, text):
+        if self.per_call:
+            time.sleep(self.per_call)
+        self.calls += 1
+        self.chunks.append(text)
+
+    @property
+    def output(self):
+        return "".join(self.chunks)
+
+
+# Scenario: typing engine throughput and pause/resume accuracy against a mock keyboard
+def bench_typing(args):
+    from typing_engine import TypingEngine
+
+    rng = random.Random(3)
+    text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz     \n") for _ in range(args.chars))
+    print(f"{args.chars:,} characters; the old loop (one write + 0.3 s sleep per character) "
+          f"takes {args.chars * 0.3:,.0f} s")
+    for cps, chunk_size, jitter in ((40, 1, 0.0), (40, 4, 0.0), (200, 4, 0.0), (200, 4, 0.5), (1000, 8, 0.0), (0, 16, 0.0)):
+        mock = MockKeyboard(args.write_cost)
+        engine = TypingEngine(mock.write, cps=cps, chunk_size=chunk_size, jitter=jitter, rng=random.Random(1))
+        engine.load(text)
+        # Time at most --duration seconds of typing so slow settings don't dominate the run
+        start = time.perf_counter()
+        engine.start()
+        engine.wait_idle(args.duration)
+        engine.pause()
+        engine.wait_idle()
+        elapsed = time.perf_counter() - start
+        typed = len(mock.output)
+        rate = typed / elapsed
+        target = f"{cps:>5} cps" if cps else "unlimited"
+        print(f"target {target}  chunk {chunk_size:>2}  jitter {jitter:.1f}   achieved {rate:9.1f} cps   "
+              f"{mock.calls:>6} writes   full text in {len(text) / rate:7.1f} s")
+
+    # Pause at an arbitrary point, check the index matches what was written, then resume to the end
+    mock = MockKeyboard(args.write_cost)
+    engine = TypingEngine(mock.write, cps=2000, chunk_size=3)
+    engine.load(text)
+    mismatches = 0
+    for _ in range(20):
+        engine.start()
+        time.sleep(rng.uniform(0.001, 0.02))
+        engine.pause()
+        engine.wait_idle()
+        if engine.index != len(mock.output) or not text.startswith(mock.output):
+            mismatches += 1
+        if engine.index == 0:
+            break  # Finished
+    engine.start()
+    engine.wait_idle()
+    print(f"pause/resume: {mismatches} index mismatches over 20 pauses, output intact: {mock.output == text}")
+
+
+SCENARIOS = {
+    "fetch-under-writes": bench_fetch_under_writes,
+    "insert-scaling": bench_insert_scaling,
+    "watcher": bench_watcher,
+    "search": bench_search,
+    "maintenance": bench_maintenance,
+    "dedup": bench_dedup,
+    "batch": bench_batch,
+    "logging": bench_logging,
+    "load": bench_load,
+    "workers": bench_workers,
+    "admission": bench_admission,
+    "agent": bench_agent,
+    "replication": bench_replication,
+    "export": bench_export,
+    "startup": bench_startup,
+    "log-pipeline": bench_log_pipeline,
+    "supervisor": bench_supervisor,
+    "dom": bench_dom,
+    "assets": bench_assets,
+    "tiers": bench_tiers,
+    "typing": bench_typing,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the clipboard server")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per measurement")
+    parser.add_argument("--readers", type=int, default=8, help="Concurrent reader clients")
+    parser.add_argument("--writers", type=int, default=4, help="Concurrent writer clients")
+    parser.add_argument("--copy-delay", type=float, default=0.2, help="Simulated pyperclip.copy cost in seconds")
+    parser.add_argument("--rows", default="0,10000,100000,1000000,3000000", help="Table sizes for insert-scaling")
+    parser.add_argument("--changes", type=int, default=10, help="Clipboard changes timed by the watcher scenario")
+    parser.add_argument("--snippets", type=int, default=1000000, help="Stored snippets for the search scenario")
+    parser.add_argument("--users", type=int, default=1000, help="Distinct users for the search and load scenarios")
+    parser.add_argument("--searches", type=int, default=500, help="Timed searches per query type")
+    parser.add_argument("--distinct", type=int, default=20, help="Distinct snippets for the dedup scenario")
+    parser.add_argument("--snippet-size", type=int, default=64 * 1024, help="Snippet size in bytes for the dedup scenario")
+    parser.add_argument("--inserts", type=int, default=2000, help="Timed inserts per table size")
+    parser.add_argument("--large-size", type=int, default=8 * 1024 * 1024, help="Largest payload for the tiers scenario")
+    parser.add_argument("--large-share", type=float, default=0.02, help="Share of multi-MB payloads in the tiers scenario")
+    parser.add_argument("--batch-size", type=int, default=10, help="Operations per user action in the batch scenario; captures per upload in the agent scenario")
+    parser.add_argument("--chars", type=int, default=2000, help="Text length for the typing scenario")
+    parser.add_argument("--write-cost", type=float, default=0.0, help="Simulated keyboard.write cost per call in seconds")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent clients for the load scenario")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted request mix for the load scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Unmeasured seconds of load before measuring")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the load scenario")
+    parser.add_argument("--url", help="Load-test an already running server instead of an in-process one")
+    parser.add_argument("--captures", type=int, default=300, help="Clipboard captures in the agent scenario")
+    parser.add_argument("--capture-rate", type=float, default=50.0, help="Captures per second in the agent scenario")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per process in the startup scenario")
+    parser.add_argument("--health-budget", type=float, default=1500, help="Budget in ms for server.py to answer /health")
+    parser.add_argument("--type-budget", type=float, default=500, help="Budget in ms for typer.py to type a character")
+    parser.add_argument("--line-rate", type=float, default=100000, help="Lines per second in the log-pipeline scenario")
+    parser.add_argument("--old-lines", type=int, default=5000, help="Lines pushed through the old per-line log path")
+    parser.add_argument("--abusers", type=int, default=8, help="Threads of the abusive client in the admission scenario")
+    parser.add_argument("--abuse-rate", type=float, default=100.0, help="Requests a second the abusive client sends")
+    parser.add_argument("--worker-counts", default="1,2,4", help="serve.py worker counts for the workers scenario")
+    parser.add_argument("--items", type=int, default=10000, help="Items per list in the dom scenario")
+    parser.add_argument("--months", type=int, default=6, help="Simulated months of traffic in the maintenance scenario")
+    parser.add_argument("--daily-items", type=int, default=20, help="Items each user copies per simulated day (maintenance scenario)")
+    parser.add_argument("--retention-days", type=int, default=30, help="Age limit applied by the scheduled maintenance run")
+    parser.add_argument("--step-budget", type=float, default=0.5, help="Seconds one maintenance step may hold the writer")
+    parser.add_argument("--export-sizes", default="50,500", help="MB of data per run in the export scenario")
+    parser.add_argument("--script-ref", help="Also measure static/js/script.js as of this git revision (dom scenario)")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the load results to PATH as a baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="Fail (exit 1) if the load results regress from PATH")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression against --baseline")
+    args = parser.parse_args()
+    SCENARIOS[args.scenario](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import gzip
+import threading
+from collections import OrderedDict, defaultdict, namedtuple
+
+CacheEntry = namedtuple("CacheEntry", ["version", "etag", "body", "gzipped"])
+
+GZIP_MIN_SIZE = 1024  # Bodies at least this large also keep a gzip copy (None otherwise)
+GZIP_LEVEL = 6
+
+
+class ResponseCache:
+    """LRU cache of serialized fetch responses, keyed by (endpoint, username).
+
+    Entries are tagged with the user's data version. Writes call invalidate()
+    with the version they produced, which drops the user's entries and stops a
+    slower reader that saw an older version from caching its result.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._keys_by_user = defaultdict(set)
+        self._latest = {}  # username -> newest version seen from a write
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, name, username):
+        with self._lock:
+            entry = self._entries.get((name, username))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((name, username))
+            self.hits += 1
+            return entry
+
+    def put(self, name, username, version, body):
+        gzipped = gzip.compress(body, GZIP_LEVEL, mtime=0) if len(body) >= GZIP_MIN_SIZE else None
+        entry = CacheEntry(version, make_etag(name, version), body, gzipped)
+        with self._lock:
+            if version < self._latest.get(username, 0):
+                return entry  # A write landed while this response was being built
+            self._entries[(name, username)] = entry
+            self._entries.move_to_end((name, username))
+            self._keys_by_user[username].add(name)
+            while len(self._entries) > self.maxsize:
+                (old_name, old_user), _ = self._entries.popitem(last=False)
+                self._forget(old_name, old_user)
+        return entry
+
+    def invalidate(self, username, version):
+        with self._lock:
+            self._latest[username] = max(version, self._latest.get(username, 0))
+            for name in self._keys_by_user.pop(username, ()):
+                self._entries.pop((name, username), None)
+
+    def count_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def _forget(self, name, username):
+        names = self._keys_by_user.get(username)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._keys_by_user[username]
+
+
+def make_etag(name, version):
+    return f'W/"{name}-{version}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+def accepts_gzip(accept_encoding):
+    return "gzip" in (token.split(";")[0].strip() for token in (accept_encoding or "").lower().split(","))
@@ -0,0 +1,87 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import storage
+
+logger = logging.getLogger("change_feed")
+
+POLL_INTERVAL = 0.1  # Seconds between change log polls; bounds how stale another worker's view can be
+LOCAL_VERSIONS_KEPT = 4096  # Versions published locally that the follower has not seen yet
+
+
+class ChangeFollower:
+    """Tails the shared change log so one server worker sees writes committed by the others.
+
+    Each worker has its own response cache and SSE hub, and only hears about its own
+    writes directly. The follower polls the changes table by row id and calls
+    on_changes(rows) with the (id, username, event) rows other processes wrote.
+    Writes made in this process are reported through mark_local(), so their events
+    aren't published twice. (A row polled before its write is marked is passed on
+    anyway; clients ignore events for versions they already have.)
+    """
+
+    def __init__(self, on_changes, interval=POLL_INTERVAL):
+        self.on_changes = on_changes
+        self.interval = interval
+        self.last_id = 0
+        self.applied = 0  # Remote changes handed to on_changes
+        self._local = OrderedDict()  # (username, version) -> None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def mark_local(self, username, version):
+        if self._thread is None:
+            return  # Not following, so nothing to skip
+        with self._lock:
+            self._local[(username, version)] = None
+            while len(self._local) > LOCAL_VERSIONS_KEPT:
+                self._local.popitem(last=False)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.last_id = storage.get_store().read(storage.last_change_id)  # Only follow changes from now on
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-follower", daemon=True)
+        self._thread.start()
+        logger.info("Following the change log from row %s every %s s", self.last_id, self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """Hand new remote changes to on_changes. Returns the number of change log rows read."""
+        rows = storage.get_store().read(storage.changes_after, self.last_id)
+        if not rows:
+            return 0
+        self.last_id = rows[-1][0]
+        remote = []
+        with self._lock:
+            for row in rows:
+                key = (row[1], row[2]["version"])
+                if key in self._local:
+                    del self._local[key]
+                else:
+                    remote.append(row)
+        if remote:
+            self.applied += len(remote)
+            self.on_changes(remote)
+        return len(rows)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                # Drain a backlog without waiting between full batches
+                while self.poll() == storage.FEED_BATCH:
+                    pass
+            except Exception as e:
+                logger.error("Change log poll failed: %s", e)
@@ -1,46 +1,167 @@
-import pyperclip
+import argparse
+import os
+import random
 import requests
+import threading
 import time
 import logging
+from requests.adapters import HTTPAdapter
+from clipboard_watcher import ClipboardWatcher
+from logging_setup import Payload, configure_logging
+from outbox import Outbox
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("clipboard_monitor")
 
-# Server URL and username
-SERVER_URL = "http://127.0.0.1:8000"  # Update this if the server is running on a different host/port
-USERNAME = "testuser"  # Replace with the username of the logged-in user
+# Capture agent: watches this machine's clipboard and uploads each change to the server
+# as one user's copied text. Pairs with a server started by serve.py (or server.py).
+SERVER_URL = os.environ.get("CLIPBOARD_SERVER_URL", "http://127.0.0.1:8010")
+USERNAME = os.environ.get("CLIPBOARD_USERNAME", "testuser")
+OUTBOX_PATH = os.environ.get("CLIPBOARD_OUTBOX_PATH", "clipboard_outbox.db")
 
-def send_to_server(text):
-    try:
-        response = requests.post(
-            f"{SERVER_URL}/update-copied-text",
-            json={"username": USERNAME, "text": text},
-            headers={"Content-Type": "application/json"}
-        )
-        if response.status_code == 200:
-            logger.info(f"Successfully sent copied text to server: {text}")
-        else:
-            logger.error(f"Failed to send copied text to server: {response.status_code} - {response.text}")
-    except Exception as e:
-        logger.error(f"Error sending copied text to server: {e}")
+# Upload settings
+BATCH_SIZE = 50  # Captures per upload request
+LINGER = 0.2  # Seconds to wait for more captures before uploading a partial batch
+REQUEST_TIMEOUT = 10.0
+BACKOFF_BASE = 0.5  # First retry delay in seconds, doubled after each consecutive failure
+BACKOFF_MAX = 60.0
+
+
+class CaptureAgent:
+    """Uploads clipboard captures from a durable outbox to the server's ingest endpoint.
+
+    capture() only writes to the outbox; an uploader thread sends pending captures in
+    batches over one keep-alive connection and drops them once the server acknowledges
+    them. Failed uploads are retried with exponential backoff (with jitter, honouring
+    Retry-After), so captures made while the server is down or the agent is stopped are
+    delivered later. Retries are safe: the server skips outbox ids it already applied.
+    """
+
+    def __init__(self, server_url, username, outbox, batch_size=BATCH_SIZE, linger=LINGER,
+                 timeout=REQUEST_TIMEOUT, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, session=None):
+        self.url = f"{server_url.rstrip('/')}/history/{username}/ingest"
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.linger = linger
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.session = session or self._make_session()
+        self.failures = 0  # Consecutive failed uploads
+        self.uploads = 0
+        self.retries = 0
+        self.rejected = 0  # Captures the server refused outright (4xx) and that were dropped
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _make_session():
+        session = requests.Session()
+        # One pooled keep-alive connection; retries are handled here, not by urllib3
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0))
+        return session
+
+    def capture(self, text):
+        if text and self.outbox.put(text) is not None:
+            self._wake.set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="capture-uploader", daemon=True)
+        self._thread.start()
 
-def monitor_clipboard():
-    logger.info("Starting clipboard monitoring...")
-    last_clipboard_content = pyperclip.paste()  # Initial clipboard content
+    def stop(self):
+        """Stop uploading; pending captures stay in the outbox for the next run."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
 
-    while True:
+    def flush(self, timeout=None):
+        """Block until the outbox is empty. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(self.outbox):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            pending = len(self.outbox)
+            if not pending:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if pending < self.batch_size and self.linger:
+                self._stop.wait(self.linger)  # Let a burst of captures share one request
+            delay = self.upload_once()
+            if delay:
+                self._stop.wait(delay)
+
+    def upload_once(self):
+        """Upload the oldest pending batch. Returns how long to wait before the next attempt."""
+        batch = self.outbox.peek(self.batch_size)
+        if not batch:
+            return 0.0
+        body = {"agent": self.outbox.agent_id, "items": [{"id": item_id, "text": text} for item_id, text, _ in batch]}
         try:
-            current_clipboard_content = pyperclip.paste()
-            if current_clipboard_content != last_clipboard_content:
-                logger.info(f"Clipboard changed: {current_clipboard_content}")
-                last_clipboard_content = current_clipboard_content
-                if current_clipboard_content:  # Only send non-empty text
-                    send_to_server(current_clipboard_content)
-            time.sleep(0.5)  # Check every 0.5 seconds
-        except Exception as e:
-            logger.error(f"Error monitoring clipboard: {e}")
-            time.sleep(1)  # Wait before retrying
+            response = self.session.post(self.url, json=body, timeout=self.timeout)
+        except requests.RequestException as e:
+            return self._backoff(f"Upload failed: {e}")
+        if response.status_code == 200:
+            self.outbox.ack(response.json()["acked"])
+            self.uploads += 1
+            self.failures = 0
+            logger.info("Uploaded %s captures (newest %s)", len(batch), Payload(batch[-1][1]))
+            return 0.0
+        if response.status_code in (408, 429) or response.status_code >= 500:
+            return self._backoff(f"Upload failed: {response.status_code}", response.headers.get("Retry-After"))
+        # Anything else won't succeed on retry; drop the batch rather than block the outbox
+        logger.error("Server rejected %s captures: %s - %s", len(batch), response.status_code, response.text[:200])
+        self.outbox.ack(batch[-1][0])
+        self.rejected += len(batch)
+        return 0.0
+
+    def _backoff(self, reason, retry_after=None):
+        self.failures += 1
+        self.retries += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1)) * random.uniform(0.5, 1.0)
+        if retry_after is not None:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        logger.warning("%s; retrying in %.1f s (%s pending)", reason, delay, len(self.outbox))
+        return delay
+
+
+def monitor_clipboard(server_url, username, outbox_path):
+    outbox = Outbox(outbox_path)
+    agent = CaptureAgent(server_url, username, outbox)
+    logger.info("Starting clipboard monitoring for user %s, uploading to %s (%s pending)", username, server_url, len(outbox))
+    agent.start()
+    watcher = ClipboardWatcher()
+    watcher.subscribe(agent.capture)
+    watcher.start()
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+        agent.stop()
+        outbox.close()
 
 if __name__ == "__main__":
-    monitor_clipboard()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Upload this machine's clipboard changes to a clipboard server")
+    parser.add_argument("--server", default=SERVER_URL, help="Server URL")
+    parser.add_argument("--username", default=USERNAME, help="User the copied text is recorded for")
+    parser.add_argument("--outbox", default=OUTBOX_PATH, help="SQLite file holding captures not yet uploaded")
+    args = parser.parse_args()
+    configure_logging()
+    monitor_clipboard(args.server, args.username, args.outbox)
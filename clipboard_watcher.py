@@ -0,0 +1,279 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import select
+import shutil
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger("clipboard_watcher")
+
+
+def paste():
+    import pyperclip  # Imported on first use, keeping it out of startup time
+
+    return pyperclip.paste()
+
+
+# Backends. Each one blocks in run() until stop is set, calling emit(text)
+# whenever it sees that the clipboard may have changed.
+class PollingBackend:
+    """Fallback that polls pyperclip.paste(), backing off while the clipboard is idle."""
+
+    name = "poll"
+
+    def __init__(self, paste_fn=None, min_interval=0.1, max_interval=2.0, backoff=1.5):
+        self.paste_fn = paste_fn or paste
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.polls = 0
+        self.interval = min_interval  # Current poll interval, i.e. the worst-case detection delay
+
+    @staticmethod
+    def available():
+        return True
+
+    def read(self):
+        return self.paste_fn()
+
+    def run(self, emit, stop):
+        last = self.read()
+        interval = self.interval = self.min_interval
+        while not stop.wait(interval):
+            self.polls += 1
+            try:
+                text = self.read()
+            except Exception as e:
+                logger.error(f"Error reading clipboard: {e}")
+                interval = self.max_interval
+                continue
+            if text != last:
+                last = text
+                emit(text)
+                interval = self.min_interval  # Changes tend to come in bursts
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+            self.interval = interval
+
+
+class WaylandBackend:
+    """Uses `wl-paste --watch`, which runs a command each time the selection changes."""
+
+    name = "wayland"
+
+    def __init__(self, paste_fn=None):
+        self.paste_fn = paste_fn or paste
+        self._process = None
+
+    @staticmethod
+    def available():
+        return bool(os.environ.get("WAYLAND_DISPLAY")) and shutil.which("wl-paste") is not None
+
+    def read(self):
+        return self.paste_fn()
+
+    def run(self, emit, stop):
+        # `echo` prints one line per change; the text itself is read back through paste_fn
+        self._process = subprocess.Popen(
+            ["wl-paste", "--watch", "echo"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        stopper = threading.Thread(target=self._stop_on, args=(stop,), daemon=True)
+        stopper.start()
+        for _ in self._process.stdout:
+            if stop.is_set():
+                break
+            emit(self.read())
+        self._process.wait()
+        if not stop.is_set():
+            raise RuntimeError(f"wl-paste exited with status {self._process.returncode}")
+
+    def _stop_on(self, stop):
+        stop.wait()
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+
+
+class X11Backend:
+    """Subscribes to XFixes selection-owner notifications for the CLIPBOARD selection."""
+
+    name = "x11"
+    XFIXES_SET_SELECTION_OWNER_NOTIFY_MASK = 1
+    XFIXES_SELECTION_NOTIFY = 0
+    XEVENT_SIZE = 192  # sizeof(XEvent): a union padded to 24 longs
+
+    def __init__(self, paste_fn=None):
+        self.paste_fn = paste_fn or paste
+
+    @staticmethod
+    def available():
+        return (
+            bool(os.environ.get("DISPLAY"))
+            and ctypes.util.find_library("X11") is not None
+            and ctypes.util.find_library("Xfixes") is not None
+        )
+
+    def read(self):
+        return self.paste_fn()
+
+    def run(self, emit, stop):
+        xlib = ctypes.cdll.LoadLibrary(ctypes.util.find_library("X11"))
+        xfixes = ctypes.cdll.LoadLibrary(ctypes.util.find_library("Xfixes"))
+        xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+        xlib.XOpenDisplay.restype = ctypes.c_void_p
+        xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+        xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+        xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+        xlib.XInternAtom.restype = ctypes.c_ulong
+        xlib.XConnectionNumber.argtypes = [ctypes.c_void_p]
+        xlib.XPending.argtypes = [ctypes.c_void_p]
+        xlib.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        xlib.XFlush.argtypes = [ctypes.c_void_p]
+        xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+        xfixes.XFixesQueryExtension.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_int)]
+        xfixes.XFixesSelectSelectionInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_ulong]
+
+        display = xlib.XOpenDisplay(None)
+        if not display:
+            raise RuntimeError("Cannot open X display")
+        try:
+            event_base, error_base = ctypes.c_int(), ctypes.c_int()
+            if not xfixes.XFixesQueryExtension(display, ctypes.byref(event_base), ctypes.byref(error_base)):
+                raise RuntimeError("XFixes extension not available")
+            root = xlib.XDefaultRootWindow(display)
+            clipboard = xlib.XInternAtom(display, b"CLIPBOARD", 0)
+            xfixes.XFixesSelectSelectionInput(display, root, clipboard, self.XFIXES_SET_SELECTION_OWNER_NOTIFY_MASK)
+            xlib.XFlush(display)
+
+            fd = xlib.XConnectionNumber(display)
+            event = ctypes.create_string_buffer(self.XEVENT_SIZE)
+            notify_type = event_base.value + self.XFIXES_SELECTION_NOTIFY
+            while not stop.is_set():
+                # Wake up periodically so stop() is honoured without a pending event
+                select.select([fd], [], [], 0.5)
+                changed = False
+                while xlib.XPending(display):
+                    xlib.XNextEvent(display, event)
+                    if ctypes.c_int.from_buffer(event).value == notify_type:
+                        changed = True
+                if changed:
+                    emit(self.read())
+        finally:
+            xlib.XCloseDisplay(display)
+
+
+class FakeBackend:
+    """In-process backend for headless tests and benchmarks; call set_text() to simulate a copy."""
+
+    name = "fake"
+
+    def __init__(self, text=""):
+        self.text = text
+        self._changes = queue.Queue()
+
+    @staticmethod
+    def available():
+        return True
+
+    def read(self):
+        return self.text
+
+    def set_text(self, text):
+        self.text = text
+        self._changes.put(text)
+
+    def run(self, emit, stop):
+        while not stop.is_set():
+            try:
+                text = self._changes.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            emit(text)
+
+
+BACKENDS = {
+    "wayland": WaylandBackend,
+    "x11": X11Backend,
+    "poll": PollingBackend,
+}
+
+
+def default_backend():
+    """Pick a backend from CLIPBOARD_WATCH_BACKEND, or the best one available on this system."""
+    name = os.environ.get("CLIPBOARD_WATCH_BACKEND")
+    if name:
+        return BACKENDS[name]()
+    for backend in (WaylandBackend, X11Backend):
+        if backend.available():
+            return backend()
+    return PollingBackend()
+
+
+class ClipboardWatcher:
+    """Single clipboard-change source that publishes each new text to its subscribers."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or default_backend()
+        self.current = None
+        self.changes = 0
+        self.detected_at = None  # time.monotonic() of the latest change, for capture-lag metrics
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def polls(self):
+        return getattr(self.backend, "polls", 0)
+
+    def subscribe(self, callback):
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        try:
+            self.current = self.backend.read()  # Initial content is not reported as a change
+        except Exception as e:
+            logger.error(f"Error reading initial clipboard content: {e}")
+        self._thread = threading.Thread(target=self._run, name="clipboard-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _publish(self, text):
+        if text == self.current:
+            return  # Selection owner changed but the text did not
+        self.current = text
+        self.changes += 1
+        self.detected_at = time.monotonic()
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(text)
+            except Exception as e:
+                logger.error(f"Clipboard subscriber {callback!r} failed: {e}")
+
+    def _run(self):
+        logger.info(f"Watching clipboard with the {self.backend.name} backend")
+        try:
+            self.backend.run(self._publish, self._stop)
+        except Exception as e:
+            if self._stop.is_set():
+                return
+            logger.error(f"Clipboard backend {self.backend.name} failed ({e}); falling back to polling")
+            self.backend = PollingBackend()
+            self.backend.run(self._publish, self._stop)
@@ -0,0 +1,72 @@
+import logging
+import queue
+import threading
+
+from logging_setup import Payload
+from metrics import CLIPBOARD_COPY_ERRORS, CLIPBOARD_COPY_SECONDS
+
+logger = logging.getLogger("clipboard_worker")
+
+
+def copy(text):
+    import pyperclip  # Imported on first use, keeping it out of startup time
+
+    pyperclip.copy(text)
+
+
+class ClipboardWorker:
+    """Applies clipboard writes on a background thread through a bounded queue.
+
+    pyperclip.copy shells out to xclip/xsel/wl-copy, so it must never run on the
+    event loop. Only the latest text matters for a clipboard, so when the queue
+    is full the oldest pending write is dropped in favour of the new one.
+    """
+
+    def __init__(self, copy_fn=None, maxsize=16):
+        self.copy_fn = copy_fn or copy
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()  # Guards starting the thread and the dropped count
+        self.dropped = 0
+
+    def submit(self, text):
+        self._ensure_started()
+        while True:
+            try:
+                self._queue.put_nowait(text)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    with self._lock:
+                        self.dropped += 1  # Producers drop concurrently; += alone can lose counts
+                except queue.Empty:
+                    pass
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def join(self):
+        """Block until every queued write has been applied."""
+        self._queue.join()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="clipboard-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            text = self._queue.get()
+            try:
+                with CLIPBOARD_COPY_SECONDS.time():
+                    self.copy_fn(text)
+                logger.info("[INFO] Text copied to server's system clipboard: %s", Payload(text))
+            except Exception as e:
+                CLIPBOARD_COPY_ERRORS.inc()
+                logger.error("[ERROR] Failed to copy text to server's system clipboard: %s", e)
+            finally:
+                self._queue.task_done()
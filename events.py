@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger("events")
+
+QUEUE_SIZE = 256  # Pending events per subscriber before it is told to resync
+HEARTBEAT_INTERVAL = 15.0  # Seconds between keep-alive comments on an idle stream
+
+
+class EventHub:
+    """Fans out per-user change events to every connected stream.
+
+    publish() may be called from any thread (the clipboard watcher runs on its own);
+    each subscriber queue is only touched on the event loop that created it.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, username):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[username].add((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, username, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(username, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(username, None)
+
+    def subscriber_count(self, username=None):
+        with self._lock:
+            if username is not None:
+                return len(self._subscribers.get(username, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+    def publish(self, username, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(username, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._deliver, queue, event)
+            except RuntimeError:
+                pass  # Loop already closed; the stream is going away
+
+    @staticmethod
+    def _deliver(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client fell behind: drop what it missed and have it reload the lists
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"op": "resync"})
+
+
+def format_sse(event):
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def stream(hub, username, request):
+    """Server-Sent Events generator for one client connection."""
+    queue = hub.subscribe(username)
+    try:
+        yield "retry: 2000\n\n"
+        while not await request.is_disconnected():
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        hub.unsubscribe(username, queue)
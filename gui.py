@@ -1,25 +1,41 @@
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.button import Button
+from kivy.uix.label import Label
 from kivy.uix.textinput import TextInput
 from kivy.clock import Clock
 import threading
-import subprocess
+from log_pipeline import LogPipeline
+from supervisor import SERVER_URL, Supervisor, probe
 
 
 class SimpleTerminalApp(BoxLayout):
     def __init__(self, **kwargs):
         super().__init__(orientation="vertical", **kwargs)
 
+        # Child process output is queued here and shown at most once per frame (last MAX_LINES lines)
+        self.log = LogPipeline()
+
+        # Log filter: only lines containing this text are shown
+        self.log_filter = TextInput(hint_text="Filter log", multiline=False, size_hint=(1, 0.07))
+        self.log_filter.bind(text=self.on_filter_change)
+        self.add_widget(self.log_filter)
+
         # Log display area
         self.log_display = TextInput(
             readonly=True,
             background_color=(0, 0, 0, 1),
             foreground_color=(1, 1, 1, 1),
             font_name="RobotoMono-Regular",
-            size_hint=(1, 0.8),
+            size_hint=(1, 0.68),
         )
         self.add_widget(self.log_display)
+        Clock.schedule_interval(self.refresh_log, 0)  # Every frame
+
+        # State, CPU and memory of the child processes
+        self.status_label = Label(text="", size_hint=(1, 0.05))
+        self.add_widget(self.status_label)
+        Clock.schedule_interval(self.refresh_status, 1.0)
 
         # Buttons for server and typer
         button_layout = BoxLayout(size_hint=(1, 0.2))
@@ -35,115 +51,86 @@ class SimpleTerminalApp(BoxLayout):
         self.typer_button.bind(on_press=self.toggle_typer)
         button_layout.add_widget(self.typer_button)
 
-        # Variables to manage threads
-        self.server_thread = None
-        self.typer_thread = None
+        # server.py and typer.py run under a supervisor (restart backoff, health checks, SIGTERM/SIGKILL).
+        # The typer process is kept running (disabled) while the typer is stopped, so restarts are instant.
+        self.supervisor = Supervisor(output=self.log_message, attach=self.log.attach)
+        self.supervisor["typer"].on_spawn = self.restore_typer_state
         self.server_running = False
         self.typer_running = False
 
     def log_message(self, message):
-        """Log a message in the terminal display on the main thread."""
-        def update_log_display(dt):
-            self.log_display.text += f"{message}\n"
-            self.log_display.cursor = (0, len(self.log_display.text))  # Auto-scroll
+        """Log a message in the terminal display (safe from any thread)."""
+        self.log.log(message)
+
+    def refresh_log(self, dt):
+        """Show the lines that arrived since the last frame."""
+        if self.log.flush():
+            self.show_log()
+
+    def on_filter_change(self, _, text):
+        self.log.set_filter(text)
+        self.show_log()
 
-        Clock.schedule_once(update_log_display)
+    def show_log(self):
+        self.log_display.text = self.log.render()
+        self.log_display.cursor = (0, len(self.log_display.text))  # Auto-scroll
 
     def toggle_server(self, _):
         """Start or stop the server."""
+        server = self.supervisor["server"]
         if not self.server_running:
-            self.server_thread = threading.Thread(target=self.run_server, daemon=True)
-            self.server_thread.start()
             self.server_running = True
+            if not server.running and probe(f"{SERVER_URL}/health"):
+                self.log_message(f"[INFO] Reusing the server already running at {SERVER_URL}")
+            else:
+                self.log_message("[INFO] Starting server...")
+                server.start()
             self.server_button.text = "Stop Server"
             self.server_button.background_color = (1, 0, 0, 1)
         else:
             self.server_running = False
             self.log_message("[INFO] Stopping server...")
+            threading.Thread(target=server.stop, daemon=True).start()  # May wait up to KILL_TIMEOUT
             self.server_button.text = "Start Server"
             self.server_button.background_color = (0, 1, 0, 1)
 
-    def run_server(self):
-        """Run the FastAPI server."""
-        self.log_message("[INFO] Starting server...")
-        try:
-            process = subprocess.Popen(
-                ["python", "server.py"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-            )
-            while self.server_running:
-                line = process.stdout.readline()
-                if line:
-                    self.log_message(line.strip())
-                error_line = process.stderr.readline()
-                if error_line:
-                    self.log_message(f"[ERROR] {error_line.strip()}")
-            process.terminate()
-            self.log_message("[INFO] Server stopped.")
-        except Exception as e:
-            self.log_message(f"[ERROR] Exception while running server: {e}")
-
     def toggle_typer(self, _):
         """Start or stop the typer."""
+        typer = self.supervisor["typer"]
         if not self.typer_running:
-            self.typer_thread = threading.Thread(target=self.run_typer, daemon=True)
-            self.typer_thread.start()
             self.typer_running = True
+            if not typer.send("enable"):
+                self.log_message("[INFO] Starting typer...")
+                typer.start()
             self.typer_button.text = "Stop Typer"
             self.typer_button.background_color = (1, 0, 0, 1)
         else:
             self.typer_running = False
             self.log_message("[INFO] Stopping typer...")
+            typer.send("disable")  # The process stays warm for the next start
             self.typer_button.text = "Start Typer"
             self.typer_button.background_color = (0, 1, 0, 1)
 
-    def run_typer(self):
-        """Run the typer script continuously until stopped by the user."""
-        self.log_message("[INFO] Starting typer...")
-
-        while self.typer_running:
-            try:
-                # Start typer.py as a subprocess
-                process = subprocess.Popen(
-                    ["python", "typer.py"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    bufsize=1
-                )
-
-                # Use a separate thread to read stdout and stderr concurrently
-                def read_output(pipe, log_prefix):
-                    while True:
-                        line = pipe.readline()
-                        if line == "" and process.poll() is not None:
-                            break  # Exit loop if process ends
-                        if line.strip():
-                            self.log_message(f"{log_prefix} {line.strip()}")
-
-                stdout_thread = threading.Thread(target=read_output, args=(process.stdout, "[STDOUT]"), daemon=True)
-                stderr_thread = threading.Thread(target=read_output, args=(process.stderr, "[STDERR]"), daemon=True)
-                stdout_thread.start()
-                stderr_thread.start()
-
-                # Wait for the process to finish
-                process.wait()
-                stdout_thread.join()
-                stderr_thread.join()
-
-                # If typer_running is still True, it means typer.py crashed or stopped unexpectedly
-                if self.typer_running:
-                    self.log_message("[WARNING] Typer script stopped unexpectedly. Restarting...")
-
-            except Exception as e:
-                self.log_message(f"[ERROR] Exception in run_typer: {e}")
-                break
-
-        self.log_message("[INFO] Typer stopped.")
+    def restore_typer_state(self, typer):
+        """A restarted typer comes up enabled; disable it again if the typer is stopped."""
+        if not self.typer_running:
+            typer.send("disable")
+
+    def refresh_status(self, dt):
+        self.status_label.text = self.supervisor.status()
+
+    def shutdown(self):
+        """Stop the child processes when the app closes."""
+        self.supervisor.stop_all()
 
 
 class MainApp(App):
     def build(self):
-        return SimpleTerminalApp()
+        self.terminal = SimpleTerminalApp()
+        return self.terminal
+
+    def on_stop(self):
+        self.terminal.shutdown()
 
 
 if __name__ == "__main__":
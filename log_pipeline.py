@@ -0,0 +1,83 @@
+import collections
+import threading
+
+MAX_LINES = 2000  # Lines kept for display; older ones are discarded
+MAX_PENDING = 50000  # Lines queued between frames before the oldest are dropped
+
+
+def attach(pipe, emit, prefix="", on_close=None):
+    """Read `pipe` line by line on a daemon thread until EOF, passing each non-blank line to emit(), then call on_close()."""
+    thread = threading.Thread(target=_read, args=(pipe, emit, prefix, on_close), daemon=True)
+    thread.start()
+    return thread
+
+
+def _read(pipe, emit, prefix, on_close):
+    try:
+        for line in pipe:
+            line = line.rstrip()
+            if line:
+                emit(f"{prefix}{line}")
+    except (OSError, ValueError):
+        pass  # Pipe closed underneath us
+    finally:
+        if on_close is not None:
+            on_close()
+
+
+class LogPipeline:
+    """Collects output lines from child processes for a log view.
+
+    Reader threads (one per pipe, see attach()) and log() only append to a queue.
+    The UI calls flush() once per frame, which moves everything queued into a
+    ring buffer of the last max_lines lines, so each frame costs one update
+    however many lines arrived. If the UI stalls, the queue stops growing at
+    max_pending lines and the oldest are counted in `dropped`.
+
+    A filter (case-insensitive substring) selects which buffered lines render()
+    returns; it can be changed at any time without losing lines.
+    """
+
+    def __init__(self, max_lines=MAX_LINES, max_pending=MAX_PENDING):
+        self.lines = collections.deque(maxlen=max_lines)
+        self._pending = collections.deque(maxlen=max_pending)
+        self.dropped = 0  # Approximate when several threads log at once
+        self.flushed = 0  # Lines moved into the buffer so far
+        self.filter = ""
+        self._lock = threading.Lock()  # Guards flush() against itself, not the append path
+
+    def log(self, line):
+        # deque.append is atomic, so producers never take a lock
+        if len(self._pending) == self._pending.maxlen:
+            self.dropped += 1  # The append pushes out the oldest queued line
+        self._pending.append(line)
+
+    def attach(self, pipe, prefix="", on_close=None):
+        """Read `pipe` into the log on a daemon thread until EOF, then call on_close()."""
+        return attach(pipe, self.log, prefix, on_close)
+
+    def flush(self):
+        """Move queued lines into the buffer. Returns True if any arrived since the last flush."""
+        with self._lock:
+            count = len(self._pending)
+            if not count:
+                return False
+            batch = [self._pending.popleft() for _ in range(count)]
+            self.lines.extend(batch[-self.lines.maxlen:])
+            self.flushed += count
+            return True
+
+    def set_filter(self, text):
+        self.filter = text.strip().lower()
+
+    def visible(self):
+        if not self.filter:
+            return list(self.lines)
+        return [line for line in self.lines if self.filter in line.lower()]
+
+    def render(self):
+        return "\n".join(self.visible())
+
+    def clear(self):
+        with self._lock:
+            self.lines.clear()
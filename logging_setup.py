@@ -0,0 +1,122 @@
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+from storage import content_hash
+
+# Logging settings
+LOG_LEVEL = os.environ.get("CLIPBOARD_LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_PAYLOADS = os.environ.get("CLIPBOARD_LOG_PAYLOADS", "preview")  # "preview", "hash" or "full"
+PAYLOAD_PREVIEW_CHARS = 32
+
+# Log 1 in N calls per sampling key; CLIPBOARD_LOG_SAMPLE="fetch=100,health=10" overrides these
+DEFAULT_SAMPLE_RATES = {
+    "fetch": 50,  # Fetch endpoints, hit by every poll and cache revalidation
+    "health": 10,
+    "overloaded": 100,  # Refused writes, which arrive in floods
+}
+
+
+def parse_sample_rates(spec):
+    rates = dict(DEFAULT_SAMPLE_RATES)
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        key, _, rate = entry.partition("=")
+        rates[key.strip()] = max(1, int(rate))
+    return rates
+
+
+class Payload:
+    """Clipboard text for a log message, rendered only if the record is actually emitted.
+
+    Shows the length plus a short preview, or with CLIPBOARD_LOG_PAYLOADS=hash the content
+    hash the text is stored under (blobs.hash) instead. Never the whole text, unless
+    CLIPBOARD_LOG_PAYLOADS=full.
+    """
+
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        text = self.text
+        if text is None:
+            return "<none>"
+        if LOG_PAYLOADS == "full":
+            return text
+        if LOG_PAYLOADS == "hash":
+            return f"<{len(text)} chars #{content_hash(text)}>"
+        preview = text[:PAYLOAD_PREVIEW_CHARS]
+        return f"<{len(text)} chars {preview!r}{'...' if len(text) > PAYLOAD_PREVIEW_CHARS else ''}>"
+
+    __repr__ = __str__
+
+
+class Sampler:
+    """Lets through 1 in `rate` calls per key (the first call for each key always passes)."""
+
+    def __init__(self, rates=None):
+        self.rates = rates if rates is not None else {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, key):
+        rate = self.rates.get(key, 1)
+        if rate <= 1:
+            return True
+        counter = self._counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, itertools.count())
+        return next(counter) % rate == 0  # itertools.count is atomic under the GIL
+
+
+sampler = Sampler(parse_sample_rates(os.environ.get("CLIPBOARD_LOG_SAMPLE")))
+
+
+def log_sampled(logger, key, msg, *args, level=logging.INFO):
+    """Log a hot-path message for 1 in N calls of `key`; skipped calls never build a record."""
+    if logger.isEnabledFor(level) and sampler(key):
+        logger.log(level, msg, *args)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues records unformatted, so formatting happens on the listener thread.
+
+    The stock handler formats in prepare() on the calling thread. That is only needed when
+    records cross a process boundary; here the listener shares the process.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(level=LOG_LEVEL, stream=None, logger=None):
+    """Send `logger`'s records (the root logger by default) through a queue to a StreamHandler.
+
+    Request threads only enqueue; a QueueListener thread formats and writes. Returns the
+    listener, which is also stopped (flushing the queue) at interpreter exit.
+    """
+    logger = logger or logging.getLogger()
+    records = queue.SimpleQueue()
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(DeferredQueueHandler(records))
+    logger.setLevel(level)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener):
+    if listener._thread is not None:  # Not already stopped by the caller
+        listener.stop()
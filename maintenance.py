@@ -0,0 +1,221 @@
+"""Background maintenance of the database, run from a thread inside the server process.
+
+Each task runs on its own schedule:
+
+    retention   delete items older than each user's age limit (users.retention_days, by
+                default CLIPBOARD_RETENTION_DAYS) or past their history limit
+    vacuum      return free pages to the filesystem (incremental auto_vacuum)
+    optimize    refresh the query planner's statistics (sampled ANALYZE) and merge the
+                full-text index's segments
+    checkpoint  checkpoint the WAL, truncating it once it has grown past WAL_TRUNCATE_BYTES
+
+Work is split into small steps, each its own job on the store's writer, so other writes
+wait behind at most one step. vacuum-full (a one-off VACUUM that enables incremental
+auto_vacuum on databases created before it) is never scheduled; run it with run().
+
+With several worker processes on one database, the one holding the lease in the
+database runs the schedule; any of them runs a task on request.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+
+import storage
+
+logger = logging.getLogger("maintenance")
+
+# Seconds between runs of each task
+INTERVALS = {
+    "retention": float(os.environ.get("CLIPBOARD_RETENTION_INTERVAL", "3600")),
+    "vacuum": 600.0,
+    "optimize": 24 * 3600.0,
+    "checkpoint": 60.0,
+}
+TICK = 5.0  # Seconds between checks for due tasks
+LEASE_TTL = 60.0  # Seconds a worker's claim to the schedule lasts without renewal
+STEP_PAUSE = 0.05  # Seconds between the steps of one task, leaving the writer to other writes
+VACUUM_PAGES = 256  # Pages freed per vacuum step
+VACUUM_MIN_PAGES = 64  # Free pages below which a vacuum run does nothing
+VACUUM_MAX_PAGES = 256 * 1024  # Pages freed per vacuum run at most (1 GB of 4 KB pages)
+FTS_MERGE_STEPS = 100  # Index merge steps per optimize run at most
+WAL_TRUNCATE_BYTES = 64 * 1024 * 1024  # WAL size past which a checkpoint also truncates it
+
+
+class Task:
+    """Schedule and last outcome of one maintenance task."""
+
+    def __init__(self, name, interval, fn):
+        self.name = name
+        self.interval = interval  # None: only run on request
+        self.fn = fn
+        self.due = time.monotonic() + interval if interval else None
+        self.runs = 0
+        self.errors = 0
+        self.last_run = None  # time.time() the last run finished
+        self.last_seconds = None
+        self.last_result = None
+        self.last_error = None
+
+    def status(self):
+        return {
+            "interval": self.interval, "runs": self.runs, "errors": self.errors, "last_run": self.last_run,
+            "last_seconds": self.last_seconds, "last_result": self.last_result, "last_error": self.last_error,
+        }
+
+
+class MaintenanceScheduler:
+    """Runs the maintenance tasks on a background thread (see the module docstring).
+
+    on_deleted(username, version) is called after retention deleted some of a user's
+    items. clock() is the time retention ages items against; a simulation can pass
+    its own, and call run() instead of start().
+    """
+
+    def __init__(self, on_deleted=None, clock=time.time, intervals=None, pause=STEP_PAUSE, holder=None):
+        intervals = {**INTERVALS, **(intervals or {})}
+        self.on_deleted = on_deleted
+        self.clock = clock
+        self.pause = pause
+        self.holder = holder or f"{socket.gethostname()}:{os.getpid()}"
+        self.leader = False
+        self.max_step_seconds = 0.0  # Longest single step, i.e. the longest other writes waited on maintenance
+        self.tasks = {
+            "retention": Task("retention", intervals["retention"], self._retention),
+            "vacuum": Task("vacuum", intervals["vacuum"], self._vacuum),
+            "optimize": Task("optimize", intervals["optimize"], self._optimize),
+            "checkpoint": Task("checkpoint", intervals["checkpoint"], self._checkpoint),
+            "vacuum-full": Task("vacuum-full", None, self._vacuum_full),
+        }
+        self._lease_due = 0.0
+        self._run_lock = threading.Lock()  # One task at a time, scheduled or requested
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run(self, name):
+        """Run a task now and return its result. Raises KeyError for an unknown task."""
+        task = self.tasks[name]
+        with self._run_lock:
+            start = time.perf_counter()
+            try:
+                result = task.fn()
+            except Exception as e:
+                task.errors += 1
+                task.last_error = str(e)
+                raise
+            finally:
+                task.runs += 1
+                task.last_run = time.time()
+                task.last_seconds = time.perf_counter() - start
+                if task.interval:
+                    task.due = time.monotonic() + task.interval
+            task.last_result = result
+            task.last_error = None
+            return result
+
+    def status(self):
+        return {
+            "leader": self.leader,
+            "max_step_seconds": self.max_step_seconds,
+            "tasks": {name: task.status() for name, task in self.tasks.items()},
+        }
+
+    def _run(self):
+        while not self._stop.wait(TICK):
+            try:
+                self._claim()
+            except Exception as e:
+                logger.warning("Could not claim the maintenance lease: %s", e)
+                continue
+            if not self.leader:
+                continue
+            for task in self.tasks.values():
+                if self._stop.is_set():
+                    break
+                if task.due is not None and time.monotonic() >= task.due:
+                    try:
+                        result = self.run(task.name)
+                        logger.info("Maintenance task %s: %s", task.name, result)
+                    except Exception as e:
+                        logger.error("Maintenance task %s failed: %s", task.name, e)
+
+    def _claim(self):
+        # Renewed well before it expires, so the leader keeps it while it is alive
+        if time.monotonic() >= self._lease_due:
+            self.leader = storage.get_store().write(storage.claim_maintenance, self.holder, time.time(), LEASE_TTL)
+            self._lease_due = time.monotonic() + LEASE_TTL / 3
+
+    def _step(self, fn, *args):
+        start = time.perf_counter()
+        result = storage.get_store().write(fn, *args)
+        self.max_step_seconds = max(self.max_step_seconds, time.perf_counter() - start)
+        return result
+
+    def _retention(self):
+        store = storage.get_store()
+        deleted = users = 0
+        for username, cutoff, limit in store.read(storage.retention_candidates, self.clock()):
+            users += 1
+            while not self._stop.is_set():
+                count, version = self._step(storage.apply_retention, username, cutoff, limit)
+                deleted += count
+                if version is not None and self.on_deleted is not None:
+                    self.on_deleted(username, version)
+                if count < storage.RETENTION_BATCH:
+                    break
+                self._stop.wait(self.pause)
+        return {"deleted": deleted, "users": users}
+
+    def _vacuum(self):
+        stats = storage.get_store().read(storage.database_stats)
+        if stats["auto_vacuum"] != "incremental":
+            return {"freed_pages": 0, "skipped": "incremental auto_vacuum is off; run vacuum-full once to enable it"}
+        freed = 0
+        if stats["free_pages"] >= VACUUM_MIN_PAGES:
+            while freed < VACUUM_MAX_PAGES and not self._stop.is_set():
+                step = self._step(storage.vacuum_step, VACUUM_PAGES)
+                freed += step
+                if step < VACUUM_PAGES:
+                    break
+                self._stop.wait(self.pause)
+        return {"freed_pages": freed, "freed_bytes": freed * stats["page_size"]}
+
+    def _optimize(self):
+        self._step(storage.analyze)
+        merges = 0
+        while merges < FTS_MERGE_STEPS and not self._stop.is_set():
+            merges += 1
+            if not self._step(storage.merge_search_index):
+                break
+            self._stop.wait(self.pause)
+        return {"analyzed": True, "index_merges": merges}
+
+    def _checkpoint(self):
+        wal_bytes = storage.get_store().read(storage.database_stats)["wal_bytes"]
+        mode = "TRUNCATE" if wal_bytes > WAL_TRUNCATE_BYTES else "PASSIVE"
+        busy, wal_pages, done = self._step(storage.checkpoint, mode)
+        return {"mode": mode, "busy": bool(busy), "wal_pages": wal_pages, "checkpointed": done, "wal_bytes": wal_bytes}
+
+    def _vacuum_full(self):
+        before = storage.get_store().read(storage.database_stats)
+        self._step(storage.convert_to_incremental)
+        after = storage.get_store().read(storage.database_stats)
+        return {"file_bytes_before": before["file_bytes"], "file_bytes": after["file_bytes"], "auto_vacuum": after["auto_vacuum"]}
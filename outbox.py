@@ -0,0 +1,71 @@
+import sqlite3
+import threading
+import time
+import uuid
+
+MAX_OUTBOX_ITEMS = 10000  # Captures kept while the server is unreachable; the oldest are dropped past this
+
+
+class Outbox:
+    """Durable FIFO of clipboard captures waiting to be uploaded by the capture agent.
+
+    Backed by its own SQLite file, so captures survive agent restarts and server outages.
+    Ids come from AUTOINCREMENT and are never reused, even once the outbox empties: the
+    server skips ids it has already applied for this outbox's agent_id, which is stored
+    in the same file.
+    """
+
+    def __init__(self, path, max_items=MAX_OUTBOX_ITEMS):
+        self.path = path
+        self.max_items = max_items
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, captured_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('agent_id', ?)", (uuid.uuid4().hex,))
+        self.agent_id = self._conn.execute("SELECT value FROM meta WHERE key = 'agent_id'").fetchone()[0]
+
+    def put(self, text, captured_at=None):
+        """Queue a capture. Returns its id, or None if it repeats the newest pending capture."""
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM outbox ORDER BY id DESC LIMIT 1").fetchone()
+            if row is not None and row[0] == text:
+                return None
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                item_id = self._conn.execute(
+                    "INSERT INTO outbox (text, captured_at) VALUES (?, ?)", (text, captured_at or time.time())
+                ).lastrowid
+                overflow = self._conn.execute(
+                    "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id DESC LIMIT -1 OFFSET ?)",
+                    (self.max_items,),
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.dropped += overflow
+            return item_id
+
+    def peek(self, limit):
+        """The oldest `limit` pending captures as (id, text, captured_at), without removing them."""
+        with self._lock:
+            return self._conn.execute("SELECT id, text, captured_at FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def ack(self, up_to_id):
+        """Drop every capture up to and including `up_to_id` (the server has applied them)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE id <= ?", (up_to_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
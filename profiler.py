@@ -0,0 +1,39 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+MAX_DURATION = 60.0  # Seconds one profile request may sample for
+DEFAULT_INTERVAL = 0.005
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(duration, interval=DEFAULT_INTERVAL):
+    """Sample every thread's Python stack for `duration` seconds.
+
+    Returns the samples in collapsed-stack format ("thread;outer;...;inner count" per line),
+    which flamegraph.pl, speedscope and inferno read directly. Runs on the calling thread,
+    which is left out of the samples.
+    """
+    duration = min(max(duration, interval), MAX_DURATION)
+    me = threading.get_ident()
+    counts = collections.Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
@@ -0,0 +1,126 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+
+import storage
+
+logger = logging.getLogger("replication")
+
+PULL_INTERVAL = 0.2  # Seconds between pulls from each peer; bounds cross-machine latency when idle
+PULL_TIMEOUT = 10.0
+BACKOFF_BASE = 0.5  # First retry delay for an unreachable peer, doubled after each consecutive failure
+BACKOFF_MAX = 30.0
+KEY_HEADER = "X-Replication-Key"
+
+
+class Peer:
+    """Pull progress and health of one peer, for /replication/status."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.node = None  # The peer's node id, learned from its first response
+        self.pulls = 0
+        self.received = 0  # Entries received (applied or not)
+        self.applied = 0  # Local change events the entries produced
+        self.bytes = 0  # Response bytes on the wire
+        self.failures = 0  # Consecutive failed pulls
+        self.gaps = 0  # Pulls where the peer's log no longer reached back to our checkpoint
+        self.last_ok = None  # time.time() of the last successful pull
+        self.retry_at = 0.0  # time.monotonic() before which the peer is skipped
+
+    def status(self):
+        return {
+            "url": self.url, "node": self.node, "pulls": self.pulls, "received": self.received,
+            "applied": self.applied, "bytes": self.bytes, "failures": self.failures, "gaps": self.gaps,
+            "last_ok": self.last_ok,
+        }
+
+
+class Replicator:
+    """Keeps this server's history in step with peer servers by pulling their replication logs.
+
+    Each poll sends the local version vector (the highest seq recorded from every node) as
+    a checkpoint; the peer answers with the entries after it, which are applied in one
+    transaction (storage.apply_replicated). A peer that was offline or a node that joins
+    late catches up from its checkpoint, not by a full resync. Entries are passed on from
+    any origin, so peers need not all know each other. on_applied([(username, event)])
+    is called with the changes that altered local data.
+
+    Conflicts resolve per item by last writer wins, so peers agree on which items each
+    list holds. Repeated copies of the same text collapse to one on peers, and items
+    added within the same second may be listed in a different order.
+    """
+
+    def __init__(self, peers, on_applied, interval=PULL_INTERVAL, key=None, session=None):
+        self.peers = [Peer(url) for url in peers]
+        self.on_applied = on_applied
+        self.interval = interval
+        self.key = key
+        self.session = session or requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None or not self.peers:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="replicator", daemon=True)
+        self._thread.start()
+        logger.info("Replicating from %s every %s s", ", ".join(peer.url for peer in self.peers), self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pull(self, peer):
+        """Pull and apply one batch from a peer. Returns True if the peer has more to send."""
+        store = storage.get_store()
+        since = store.read(storage.replication_vector)
+        headers = {KEY_HEADER: self.key} if self.key else {}
+        response = self.session.post(
+            f"{peer.url}/replication/pull", json={"since": since}, headers=headers, timeout=PULL_TIMEOUT
+        )
+        response.raise_for_status()
+        peer.bytes += int(response.headers.get("Content-Length", len(response.content)))  # Compressed size if gzipped
+        data = response.json()
+        peer.node = data["node"]
+        peer.pulls += 1
+        peer.last_ok = time.time()
+        if data["gaps"]:
+            peer.gaps += 1
+            logger.warning("%s no longer has every change after our checkpoint for nodes %s", peer.url, data["gaps"])
+        entries = data["entries"]
+        if entries:
+            events = store.write(storage.apply_replicated, entries)
+            peer.received += len(entries)
+            peer.applied += len(events)
+            if events:
+                self.on_applied(events)
+        return data["more"]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            for peer in self.peers:
+                if self._stop.is_set() or time.monotonic() < peer.retry_at:
+                    continue
+                try:
+                    while self.pull(peer) and not self._stop.is_set():
+                        pass  # Drain a backlog without waiting between full batches
+                    peer.failures = 0
+                except Exception as e:
+                    peer.failures += 1
+                    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (peer.failures - 1)) * random.uniform(0.5, 1.0)
+                    peer.retry_at = time.monotonic() + delay
+                    logger.warning("Pull from %s failed: %s; retrying in %.1f s", peer.url, e, delay)
+
+    def status(self):
+        return [peer.status() for peer in self.peers]
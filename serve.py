@@ -0,0 +1,79 @@
+"""Multi-worker, multi-user deployment of server.py.
+
+    python serve.py --host 0.0.0.0 --port 8010 --db /var/lib/clipboard/users.db --workers 4
+
+Runs N uvicorn worker processes against one SQLite database (WAL mode; each worker
+has its own read pool and writer, and SQLite serializes their commits). Workers see
+each other's writes by tailing the change log (change_feed.py), which keeps their
+response caches and /events streams current.
+
+The server does not watch a clipboard in this mode. Run the capture agent on each
+user's machine instead; it pushes to /update-copied-text:
+
+    python clipboard_monitor.py --server http://server:8010 --username alice
+
+To keep instances on several machines in step, give each the others as peers:
+
+    python serve.py --db a.db --port 8010 --peers http://machine-b:8010
+    python serve.py --db b.db --port 8010 --peers http://machine-a:8010
+
+Servers record their changes for peers only when they have peers; one that is only
+pulled from (listed in others' --peers but with none of its own) needs CLIPBOARD_REPLICATE=1.
+
+One worker also deletes expired items, reclaims free pages and checkpoints the WAL in
+the background (maintenance.py); CLIPBOARD_RETENTION_DAYS gives items a default age
+limit, and /admin/maintenance reports what each task last did. Set CLIPBOARD_ADMIN_KEY
+to reach /admin from other machines; without it, only local clients may.
+
+Every option can also come from the environment (CLIPBOARD_HOST, CLIPBOARD_PORT,
+CLIPBOARD_DB_PATH, CLIPBOARD_WORKERS, CLIPBOARD_PEERS), which is also how to configure gunicorn:
+
+    CLIPBOARD_WORKERS=4 CLIPBOARD_SERVER_COPY=0 gunicorn -k uvicorn.workers.UvicornWorker -w 4 server:app
+"""
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the clipboard server with several worker processes")
+    parser.add_argument("--host", default=os.environ.get("CLIPBOARD_HOST", "127.0.0.1"), help="Bind address")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("CLIPBOARD_PORT", "8010")))
+    parser.add_argument("--db", default=os.environ.get("CLIPBOARD_DB_PATH", "users.db"), help="SQLite database path")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("CLIPBOARD_WORKERS", str(os.cpu_count() or 1))),
+        help="Worker processes (default: CPU count)",
+    )
+    parser.add_argument(
+        "--server-copy", action="store_true",
+        help="Also copy /update-clipboard text to this host's clipboard (off for shared servers)",
+    )
+    parser.add_argument(
+        "--peers", default=os.environ.get("CLIPBOARD_PEERS", ""),
+        help="Comma-separated URLs of servers to replicate history from (see replication.py)",
+    )
+    parser.add_argument("--log-level", default="warning", help="uvicorn's own log level")
+    args = parser.parse_args()
+
+    # Workers are fresh processes that configure themselves from the environment on import
+    os.environ.update(
+        CLIPBOARD_HOST=args.host,
+        CLIPBOARD_PORT=str(args.port),
+        CLIPBOARD_DB_PATH=os.path.abspath(args.db),
+        CLIPBOARD_WORKERS=str(args.workers),
+        CLIPBOARD_SERVER_COPY="1" if args.server_copy else "0",
+        CLIPBOARD_PEERS=args.peers,
+        CLIPBOARD_ASSET_RELOAD="0",  # Static files are read once per worker
+    )
+
+    import uvicorn
+    import storage
+
+    # Create or migrate the schema once, before the workers start
+    storage.init_db(os.environ["CLIPBOARD_DB_PATH"])
+    storage.close_db()  # With one worker, uvicorn runs the app in this process; it reopens the store
+
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,46 @@
-from fastapi import FastAPI, Request, HTTPException
+from fastapi import FastAPI, Request, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+import asyncio
+import ipaddress
+import json
 import logging
-import sqlite3
+import os
 from pydantic import BaseModel
-import time
-import pyperclip
-import threading
+import sqlite3
 import sys
+import time
+from typing import Dict, List, Optional
+import storage
+import profiler
+from metrics import HttpMetricsMiddleware, registry
+from logging_setup import Payload, configure_logging, log_sampled
+from clipboard_worker import ClipboardWorker
+from clipboard_watcher import ClipboardWatcher
+from events import EventHub, stream
+from change_feed import ChangeFollower
+from replication import KEY_HEADER, Replicator
+from maintenance import MaintenanceScheduler
+from admission import AdmissionController, AdmissionMiddleware, Overloaded, overloaded_response
+from cache import ResponseCache, accepts_gzip, etag_matches
+from assets import AssetStore
+import transfer
+from transfer import OffsetMismatch, UploadManager, UploadNotFound, UploadTooLarge
 
 # Initialize FastAPI app
 app = FastAPI()
 
-# Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Setup logging: records go through a queue and are formatted and written on a listener thread.
+# Use lazy %-style arguments, Payload(text) for clipboard text and log_sampled() on fetch paths.
+configure_logging()
 logger = logging.getLogger("server")
 
+# Per-user write rate limits, a bound on queued writes and clipboard coalescing (see admission.py).
+# The middleware turns away writes that would be refused before their bodies are read.
+admission = AdmissionController()
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -26,21 +50,119 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# SQLite Database Setup
+# Compress large JSON responses (history pages, search results). Cached fetches and
+# static assets arrive already compressed and pass through untouched; so does /events.
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=6)
+
+# Per-route latency histograms and request/error counts, served from /metrics
+app.add_middleware(HttpMetricsMiddleware)
+
+# Sampling profiler at /debug/profile (off unless CLIPBOARD_PROFILING=1)
+PROFILING_ENABLED = os.environ.get("CLIPBOARD_PROFILING") == "1"
+
+# Deployment settings. serve.py sets these for multi-worker runs; `python server.py` is the
+# single-process desktop mode with the clipboard watcher built in.
+HOST = os.environ.get("CLIPBOARD_HOST", "127.0.0.1")
+PORT = int(os.environ.get("CLIPBOARD_PORT", "8010"))
+WORKERS = int(os.environ.get("CLIPBOARD_WORKERS", "1"))  # Processes sharing the database
+SERVER_CLIPBOARD = os.environ.get("CLIPBOARD_SERVER_COPY", "1") == "1"  # Copy /update-clipboard text to this host's clipboard
+PEERS = [url for url in os.environ.get("CLIPBOARD_PEERS", "").split(",") if url.strip()]  # Servers to replicate from
+REPLICATION_KEY = os.environ.get("CLIPBOARD_REPLICATION_KEY")  # Shared secret peers must send, if set
+ASSET_RELOAD = os.environ.get("CLIPBOARD_ASSET_RELOAD", "1") == "1"  # Pick up edited static files without a restart
+MAINTENANCE = os.environ.get("CLIPBOARD_MAINTENANCE", "1") == "1"  # Run retention, vacuum and checkpoints in the background
+ADMIN_KEY = os.environ.get("CLIPBOARD_ADMIN_KEY")  # Secret /admin endpoints require in X-Admin-Key; unset, loopback clients only
+
+# SQLite Database Setup (pooled, WAL-mode store shared by every endpoint). Opened lazily:
+# not at import, but in the background once the server is up, or by the first request.
 def init_db():
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, clipboard TEXT)''')
-        c.execute('''CREATE TABLE IF NOT EXISTS history (username TEXT, text TEXT, timestamp INTEGER)''')
-        c.execute('''CREATE TABLE IF NOT EXISTS copied_text_history (username TEXT, text TEXT, timestamp INTEGER)''')
-        conn.commit()
-        conn.close()
-        logger.info("[INFO] Database initialized successfully")
+        storage.get_store()
     except Exception as e:
-        logger.error(f"[ERROR] Failed to initialize database: {e}")
+        logger.error("[ERROR] Failed to initialize database: %s", e)
+
+store_opening = None  # Future of the startup hook's background open, until it has finished
+
+class StoreGate:
+    """ASGI middleware holding requests other than /health until the startup open of the store has
+    finished. They await it, so the event loop never blocks in get_store() on the first open."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        opening = store_opening
+        if opening is not None and not opening.done() and scope["type"] == "http" and scope["path"] != "/health":
+            await asyncio.shield(opening)
+        await self.app(scope, receive, send)
+
+app.add_middleware(StoreGate)
 
-init_db()
+# Background clipboard writer so pyperclip's subprocess never runs on the event loop.
+# One pending write at most: a newer text replaces it, since only the latest is worth copying.
+clipboard_worker = ClipboardWorker(maxsize=1)
+
+# Streamed and resumable uploads, received into files next to the spilled blobs (see transfer.py)
+uploads = UploadManager(os.path.join(storage.blob_dir(storage.DB_PATH), "uploads"))
+
+# Per-user change events pushed to browsers over /events/{username}
+event_hub = EventHub()
+
+# LRU cache of serialized fetch responses, invalidated by each user's data version
+response_cache = ResponseCache()
+
+# Event-driven clipboard change source (XFixes / wl-paste --watch / adaptive polling)
+clipboard_watcher = ClipboardWatcher()
+
+# With several workers, each one tails the change log for the others' writes (started at startup)
+change_follower = ChangeFollower(lambda rows: apply_remote_changes(rows))
+
+# Pulls history and clipboard changes from other server instances (CLIPBOARD_PEERS)
+replicator = Replicator(PEERS, lambda events: apply_replicated_changes(events), key=REPLICATION_KEY)
+last_replicated_copy = None  # Text put on this host's clipboard by replication, not to be recorded again
+
+# Retention, vacuum, statistics and WAL checkpoints on a schedule (see maintenance.py)
+maintenance = MaintenanceScheduler(on_deleted=lambda username, version: notify_change(username, version, {"op": "resync"}))
+
+# Metrics for the pieces above (storage and clipboard worker timers live in metrics.py)
+SERIALIZE_SECONDS = registry.histogram(
+    "clipboard_response_serialize_seconds", "JSON encoding time of cached fetch responses", ("name",)
+)
+CAPTURE_LAG_SECONDS = registry.histogram(
+    "clipboard_capture_lag_seconds", "Time from a detected clipboard change to its history row being committed"
+)
+registry.gauge("clipboard_watcher_info", "Clipboard watcher backend in use", lambda: {(clipboard_watcher.backend.name,): 1}, ("backend",))
+registry.gauge("clipboard_watcher_polls_total", "Clipboard reads by the polling backend", lambda: clipboard_watcher.polls, kind="counter")
+registry.gauge("clipboard_watcher_changes_total", "Clipboard changes detected", lambda: clipboard_watcher.changes, kind="counter")
+registry.gauge(
+    "clipboard_watcher_poll_interval_seconds", "Current poll interval (worst-case detection delay) of the polling backend",
+    lambda: getattr(clipboard_watcher.backend, "interval", None),
+)
+registry.gauge("clipboard_worker_pending", "Clipboard writes waiting for pyperclip.copy", lambda: clipboard_worker.pending)
+registry.gauge("clipboard_worker_dropped_total", "Clipboard writes superseded before being applied", lambda: clipboard_worker.dropped, kind="counter")
+registry.gauge(
+    "clipboard_remote_changes_total", "Changes committed by other workers and applied from the change log",
+    lambda: change_follower.applied, kind="counter",
+)
+registry.gauge(
+    "clipboard_replication_applied_total", "Change events applied from peer servers, by peer",
+    lambda: {(peer.url,): peer.applied for peer in replicator.peers}, ("peer",), kind="counter",
+)
+registry.gauge(
+    "clipboard_replication_bytes_total", "Replication response bytes received, by peer",
+    lambda: {(peer.url,): peer.bytes for peer in replicator.peers}, ("peer",), kind="counter",
+)
+registry.gauge("clipboard_writes_pending", "Admitted writes not yet committed", lambda: admission.pending)
+registry.gauge("clipboard_writes_coalesced_total", "Clipboard updates folded into one still queued", lambda: admission.coalesced, kind="counter")
+registry.gauge(
+    "clipboard_writes_rejected_total", "Writes refused with 429, by reason ('rate': the user's bucket, 'queue': the shared bound)",
+    lambda: {(reason,): count for reason, count in admission.rejected.items()}, ("reason",), kind="counter",
+)
+registry.gauge("clipboard_sse_subscribers", "Open /events streams", lambda: event_hub.subscriber_count())
+registry.gauge(
+    "clipboard_response_cache_total", "Response cache lookups by result",
+    lambda: {(result,): response_cache.stats()[result] for result in ("hits", "misses", "not_modified")},
+    ("result",), kind="counter",
+)
 
 # Pydantic models
 class UserLogin(BaseModel):
@@ -48,90 +170,231 @@ class UserLogin(BaseModel):
     password: str
 
 class HistoryItem(BaseModel):
+    text: Optional[str] = None
+    hash: Optional[str] = None  # Identifies items whose text was truncated to a preview
+
+class CopiedText(BaseModel):
+    username: str
+    text: str
+
+class HistoryLimit(BaseModel):
+    limit: int
+
+class RetentionPolicy(BaseModel):
+    days: int  # Age in days after which list items are deleted; 0 keeps them forever
+
+class BatchOp(BaseModel):
+    op: str  # "add", "delete", "clear" or "clipboard"
+    list: Optional[str] = None  # "history" or "copied"; not used by "clipboard"
+    text: Optional[str] = None
+    hash: Optional[str] = None
+
+class Batch(BaseModel):
+    ops: List[BatchOp]
+
+class ReplicationPull(BaseModel):
+    since: Dict[str, int] = {}  # The puller's version vector: highest seq it has from each node
+    limit: int = storage.REPLICATION_BATCH
+
+class IngestItem(BaseModel):
+    id: int  # Outbox id, increasing per agent
     text: str
 
-# Get username from command-line argument, or use a default username
-if len(sys.argv) == 2:
-    USERNAME = sys.argv[1]
-else:
-    USERNAME = "testuser"  # Default username if none provided
-    logger.warning("No username provided in command-line. Using default username: testuser")
+class Ingest(BaseModel):
+    agent: str  # Stable id of the capture agent's outbox
+    items: List[IngestItem]
+
+# User whose clipboard the built-in watcher records (set from the command line in __main__)
+USERNAME = os.environ.get("CLIPBOARD_USERNAME", "testuser")
+
+# Record a committed write: drop the user's cached responses and push the changes to browsers.
+# Events carry the version so a reconnecting client can catch up through /history/{username}/sync.
+def notify_change(username, version, *events):
+    response_cache.invalidate(username, version)
+    change_follower.mark_local(username, version)
+    for event in events:
+        event = {"version": version, **event}
+        if event["version"] != version:
+            change_follower.mark_local(username, event["version"])  # Batch ops carry their own versions
+        event_hub.publish(username, event)
+
+# Apply change log rows written by other workers: invalidate first, so a browser reacting
+# to the event refetches fresh data
+def apply_remote_changes(rows):
+    latest = {}
+    for _, username, event in rows:
+        latest[username] = max(event["version"], latest.get(username, 0))
+    for username, version in latest.items():
+        response_cache.invalidate(username, version)
+    for _, username, event in rows:
+        event_hub.publish(username, event)
+
+# Apply changes pulled from peer servers: notify like local writes, and put the newest
+# copy or clipboard change of this host's user on the clipboard
+def apply_replicated_changes(events):
+    global last_replicated_copy
+    by_user = {}
+    for username, event in events:
+        by_user.setdefault(username, []).append(event)
+    for username, user_events in by_user.items():
+        notify_change(username, user_events[-1]["version"], *user_events)
+    if not SERVER_CLIPBOARD:
+        return
+    pastes = [
+        event for username, event in events
+        if username == USERNAME and (event["op"] == "clipboard" or (event["op"] == "add" and event.get("list") == "copied"))
+    ]
+    if pastes:
+        event = pastes[-1]
+        text = event["text"]
+        if event.get("truncated"):
+            text = storage.get_store().read(storage.load_blob, USERNAME, event["hash"]) or text
+        last_replicated_copy = text
+        clipboard_worker.submit(text)
+
+@app.on_event("startup")
+async def open_store():
+    # Don't hold up the first /health response; other requests wait for the open in StoreGate
+    global store_opening
+    store_opening = asyncio.get_running_loop().run_in_executor(None, init_db)
+
+@app.on_event("startup")
+async def load_assets():
+    # Read and compress the index and static files once, off the event loop
+    asyncio.get_running_loop().run_in_executor(None, assets.load)
+
+@app.on_event("startup")
+def start_change_follower():
+    if WORKERS > 1:
+        change_follower.start()
+
+@app.on_event("shutdown")
+def stop_change_follower():
+    change_follower.stop()
+
+@app.on_event("startup")
+def start_replicator():
+    replicator.start()
+
+@app.on_event("shutdown")
+def stop_replicator():
+    replicator.stop()
+
+@app.on_event("startup")
+def start_maintenance():
+    if MAINTENANCE:
+        maintenance.start()
+
+@app.on_event("shutdown")
+def stop_maintenance():
+    maintenance.stop()
+
+# Serve a fetch endpoint from the response cache, answering If-None-Match with 304.
+# build(conn, username) produces the payload from the same snapshot as the version.
+async def cached_response(request, name, username, build):
+    entry = response_cache.get(name, username)
+    if entry is None:
+        version, payload = await storage.get_store().aread(storage.read_versioned, username, build, username)
+        with SERIALIZE_SECONDS.time(name):
+            body = json.dumps({**payload, "version": version}).encode()
+        entry = response_cache.put(name, username, version, body)
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        response_cache.count_not_modified()
+        return Response(status_code=304, headers={"ETag": entry.etag})
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if entry.gzipped is not None and accepts_gzip(request.headers.get("accept-encoding")):
+        # Compressed once per version when cached, not on every request
+        headers["Content-Encoding"] = "gzip"
+        return Response(entry.gzipped, media_type="application/json", headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
 
 # Clipboard Monitoring Logic (Merged from clipboard_monitor.py)
 def update_copied_text(username, text):
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        # Insert new copied text into history
-        c.execute("INSERT INTO copied_text_history (username, text, timestamp) VALUES (?, ?, ?)", (username, text, int(time.time())))
-        conn.commit()
-
-        # Enforce max 10 copied text history items
-        c.execute("SELECT text FROM copied_text_history WHERE username = ? ORDER BY timestamp DESC", (username,))
-        history_items = c.fetchall()
-        if len(history_items) > 10:
-            items_to_delete = len(history_items) - 10
-            c.execute("DELETE FROM copied_text_history WHERE username = ? AND text IN (SELECT text FROM copied_text_history WHERE username = ? ORDER BY timestamp ASC LIMIT ?)", (username, username, items_to_delete))
-            conn.commit()
-
-        conn.close()
-        logger.info(f"[INFO] Copied text history updated for user {username}: {text}")
+        # Insert new copied text into history and enforce the history limit
+        version = admission.write_sync(username, storage.add_history_item, "copied", username, text)
+        notify_change(username, version, {"list": "copied", "op": "add", **storage.summarize(text)})
+        logger.info("[INFO] Copied text history updated for user %s: %s", username, Payload(text))
+        return True
+    except Overloaded as e:
+        logger.warning("[WARNING] Dropped a copy for user %s: %s", username, e)  # A runaway copy loop
+        return False
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while updating copied text history: {e}")
+        logger.error("[ERROR] Exception occurred while updating copied text history: %s", e)
+        return False
+
+def on_clipboard_change(text):
+    global last_replicated_copy
+    detected_at = clipboard_watcher.detected_at
+    logger.info("Clipboard changed: %s", Payload(text))
+    if text == last_replicated_copy:
+        last_replicated_copy = None
+        return  # Copied here by replication; already recorded on the node it came from
+    if text:  # Only record non-empty text
+        if update_copied_text(USERNAME, text) and detected_at is not None:
+            CAPTURE_LAG_SECONDS.observe(time.monotonic() - detected_at)
 
 def monitor_clipboard():
     logger.info("Starting clipboard monitoring...")
-    last_clipboard_content = pyperclip.paste()  # Initial clipboard content
-
-    while True:
-        try:
-            current_clipboard_content = pyperclip.paste()
-            if current_clipboard_content != last_clipboard_content:
-                logger.info(f"Clipboard changed: {current_clipboard_content}")
-                last_clipboard_content = current_clipboard_content
-                if current_clipboard_content:  # Only send non-empty text
-                    update_copied_text(USERNAME, current_clipboard_content)
-            time.sleep(0.5)  # Check every 0.5 seconds
-        except Exception as e:
-            logger.error(f"Error monitoring clipboard: {e}")
-            time.sleep(1)  # Wait before retrying
+    clipboard_watcher.subscribe(on_clipboard_change)
+    clipboard_watcher.start()
+
+# Index page and static files, held in memory and precompressed (see assets.py)
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+assets = AssetStore(os.path.join(APP_DIR, "static"), os.path.join(APP_DIR, "templates", "index.html"), reload=ASSET_RELOAD)
+
+def asset_response(request, asset, cache_control):
+    headers = {"ETag": asset.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), asset.etag):
+        return Response(status_code=304, headers=headers)
+    body, encoding = asset.negotiate(request.headers.get("accept-encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=asset.content_type, headers=headers)
 
 # Serve static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
-
-# Serve the index.html file
+@app.get("/static/{path:path}")
+async def serve_static(path: str, request: Request):
+    found = assets.get(f"/static/{path}")
+    if found is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return asset_response(request, *found)
+
+# Serve the index.html file (revalidated on every load, so it always links to current assets)
 @app.get("/", response_class=HTMLResponse)
-async def serve_index():
-    logger.info("[INFO] Serving index.html")
+async def serve_index(request: Request):
+    log_sampled(logger, "index", "[INFO] Serving index.html")
     try:
-        with open("templates/index.html", "r") as file:
-            content = file.read()
-        return HTMLResponse(content=content)
+        index = assets.get_index()
     except FileNotFoundError:
         logger.error("[ERROR] index.html not found in templates folder")
         return HTMLResponse(content="<h1>index.html not found in templates folder</h1>", status_code=404)
+    return asset_response(request, index, "no-cache")
 
 # API endpoint to login
 @app.post("/login")
 async def login(user: UserLogin):
-    logger.info(f"[INFO] Login attempt for user: {user.username}")
+    logger.info("[INFO] Login attempt for user: %s", user.username)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username = ? AND password = ?", (user.username, user.password))
-        result = c.fetchone()
-        if result:
-            logger.info(f"[INFO] User {user.username} logged in successfully")
-            conn.close()
+        db = storage.get_store()
+        if await db.aread(storage.authenticate, user.username, user.password):
+            logger.info("[INFO] User %s logged in successfully", user.username)
             return {"status": "success", "message": "Login successful"}
-        else:
-            c.execute("INSERT INTO users (username, password, clipboard) VALUES (?, ?, ?)", (user.username, user.password, ""))
-            conn.commit()
-            logger.info(f"[INFO] New user {user.username} registered")
-            conn.close()
-            return {"status": "success", "message": "User registered and logged in"}
+        # A user first seen through replication exists without a password until they log in here
+        if await admission.write(user.username, storage.claim_user, user.username, user.password):
+            logger.info("[INFO] Replicated user %s logged in and set a password", user.username)
+            return {"status": "success", "message": "Login successful"}
+        try:
+            await admission.write(user.username, storage.register_user, user.username, user.password)
+        except sqlite3.IntegrityError:
+            logger.warning("[WARNING] Wrong password for user %s", user.username)
+            raise HTTPException(status_code=401, detail="Invalid username or password")
+        logger.info("[INFO] New user %s registered", user.username)
+        return {"status": "success", "message": "User registered and logged in"}
+    except (HTTPException, Overloaded):
+        raise
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred during login: {e}")
+        logger.error("[ERROR] Exception occurred during login: %s", e)
         raise HTTPException(status_code=500, detail="Failed to process login")
 
 # API endpoint to update clipboard (Clipboard Manager)
@@ -139,7 +402,7 @@ async def login(user: UserLogin):
 async def update_clipboard(request: Request):
     logger.info("[INFO] Received request to update clipboard")
     try:
-        data = await request.json()
+        data = json.loads(await transfer.read_capped(request))
         username = data.get("username")
         text = data.get("text", "")
 
@@ -147,186 +410,572 @@ async def update_clipboard(request: Request):
             logger.warning("[WARNING] Username or text missing in request")
             raise HTTPException(status_code=400, detail="Username and text are required")
 
-        # Update the database
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("UPDATE users SET clipboard = ? WHERE username = ?", (text, username))
-        conn.commit()
-        conn.close()
+        # Update the database (returns once the write has committed). An update still queued
+        # for the user takes this text instead, and only the request that queued it notifies.
+        version, text, coalesced = await admission.set_clipboard(username, text)
+        if version is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        if not coalesced:
+            notify_change(username, version)
 
-        # Copy the text to the server's system clipboard
-        try:
-            pyperclip.copy(text)
-            logger.info(f"[INFO] Text copied to server's system clipboard: {text}")
-        except Exception as e:
-            logger.error(f"[ERROR] Failed to copy text to server's system clipboard: {e}")
+            # Queue the copy to the server's system clipboard
+            if SERVER_CLIPBOARD:
+                clipboard_worker.submit(text)
 
-        logger.info(f"[INFO] Clipboard updated for user {username}: {text}")
+        logger.info("[INFO] Clipboard updated for user %s: %s", username, Payload(text))
         return {"status": "success", "message": "Clipboard updated"}
 
+    except (HTTPException, Overloaded):
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except ValueError:
         logger.error("[ERROR] Invalid JSON payload received")
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while updating clipboard: {e}")
+        logger.error("[ERROR] Exception occurred while updating clipboard: %s", e)
         raise HTTPException(status_code=500, detail="Failed to update clipboard")
 
+# Refused writes: 429 with the seconds until the user's bucket or the write queue has room
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, e: Overloaded):
+    log_sampled(logger, "overloaded", "[WARNING] Refused %s %s: %s", request.method, request.url.path, e, level=logging.WARNING)
+    return overloaded_response(e)
+
+# Payload builders for the cached fetch endpoints (run only on a cache miss).
+# Large payloads come back as previews; "items" says which ones, and /fetch-content serves them whole.
+def clipboard_payload(conn, username):
+    clipboard = storage.get_clipboard(conn, username)
+    if clipboard:
+        log_sampled(logger, "fetch", "[INFO] Clipboard content fetched for user %s (%s chars)", username, clipboard['size'])
+        return {"status": "success", **clipboard}
+    logger.warning("[WARNING] No clipboard content found for user %s", username)
+    return {"status": "error", "message": "No clipboard content found"}
+
+def list_payload(entries):
+    return {
+        "history": [entry["text"] for entry in entries],
+        "items": [{"hash": entry["hash"], "size": entry["size"], "truncated": entry["truncated"]} for entry in entries],
+    }
+
+def copied_text_payload(conn, username):
+    history_items = storage.get_history(conn, "copied", username)
+    log_sampled(logger, "fetch", "[INFO] Copied text history fetched for user %s: %s items", username, len(history_items))
+    return {"status": "success", **list_payload(history_items)}
+
+def history_payload(conn, username):
+    history_items = storage.get_history(conn, "history", username)
+    limit = storage.get_history_limit(conn, username)
+    log_sampled(logger, "fetch", "[INFO] History fetched for user %s: %s items", username, len(history_items))
+    return {"status": "success", **list_payload(history_items), "limit": limit}
+
 # API endpoint to fetch clipboard (Clipboard Manager)
 @app.get("/fetch-clipboard/{username}")
-async def fetch_clipboard(username: str):
-    logger.info(f"[INFO] Fetching clipboard for user: {username}")
+async def fetch_clipboard(username: str, request: Request):
+    log_sampled(logger, "fetch", "[INFO] Fetching clipboard for user: %s", username)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT clipboard FROM users WHERE username = ?", (username,))
-        result = c.fetchone()
-        conn.close()
-
-        if result and result[0]:
-            logger.info(f"[INFO] Clipboard content fetched for user {username}: {result[0]}")
-            return {"status": "success", "text": result[0]}
-        else:
-            logger.warning(f"[WARNING] No clipboard content found for user {username}")
-            return {"status": "error", "message": "No clipboard content found"}
-
+        return await cached_response(request, "clipboard", username, clipboard_payload)
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while fetching clipboard: {e}")
+        logger.error("[ERROR] Exception occurred while fetching clipboard: %s", e)
         return {"status": "error", "message": "Failed to fetch clipboard"}
 
 # API endpoint to fetch copied text history (System-wide Ctrl+C)
 @app.get("/fetch-copied-text/{username}")
-async def fetch_copied_text(username: str):
-    logger.info(f"[INFO] Fetching copied text history for user: {username}")
+async def fetch_copied_text(username: str, request: Request):
+    log_sampled(logger, "fetch", "[INFO] Fetching copied text history for user: %s", username)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT text FROM copied_text_history WHERE username = ? ORDER BY timestamp DESC", (username,))
-        history_items = [row[0] for row in c.fetchall()]
-        conn.close()
-        logger.info(f"[INFO] Copied text history fetched for user {username}: {history_items}")
-        return {"status": "success", "history": history_items}
+        return await cached_response(request, "copied", username, copied_text_payload)
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while fetching copied text history: {e}")
+        logger.error("[ERROR] Exception occurred while fetching copied text history: %s", e)
         return {"status": "error", "message": "Failed to fetch copied text history"}
 
+# API endpoint to serve the full text of a (possibly truncated) item by its hash
+@app.get("/fetch-content/{username}/{digest}")
+async def fetch_content(username: str, digest: str):
+    logger.info("[INFO] Fetching full content %s for user: %s", digest, username)
+    chunks = await storage.get_store().aread(storage.open_blob, username, digest)
+    if chunks is None:
+        raise HTTPException(status_code=404, detail="Content not found")
+    return StreamingResponse(chunks, media_type="text/plain; charset=utf-8")
+
+# Hash of the item a delete request refers to (truncated items are deleted by hash)
+def item_hash(item):
+    if item.hash:
+        return item.hash
+    if item.text is None:
+        raise HTTPException(status_code=400, detail="Text or hash is required")
+    return storage.content_hash(item.text)
+
 # API endpoint to delete copied text history item
 @app.post("/delete-copied-text/{username}")
 async def delete_copied_text(username: str, item: HistoryItem):
-    logger.info(f"[INFO] Deleting copied text history item for user: {username}")
+    logger.info("[INFO] Deleting copied text history item for user: %s", username)
+    digest = item_hash(item)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("DELETE FROM copied_text_history WHERE username = ? AND text = ?", (username, item.text))
-        conn.commit()
-        conn.close()
-        logger.info(f"[INFO] Copied text history item deleted for user {username}: {item.text}")
+        version = await admission.write(username, storage.delete_history_item, "copied", username, None, digest)
+        notify_change(username, version, {"list": "copied", "op": "delete", "hash": digest, "text": item.text})
+        logger.info("[INFO] Copied text history item deleted for user %s: %s", username, digest)
         return {"status": "success", "message": "Copied text history item deleted"}
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while deleting copied text history: {e}")
+        logger.error("[ERROR] Exception occurred while deleting copied text history: %s", e)
         return {"status": "error", "message": "Failed to delete copied text history"}
 
 # API endpoint to clear copied text history
 @app.post("/clear-copied-text/{username}")
 async def clear_copied_text(username: str):
-    logger.info(f"[INFO] Clearing copied text history for user: {username}")
+    logger.info("[INFO] Clearing copied text history for user: %s", username)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("DELETE FROM copied_text_history WHERE username = ?", (username,))
-        conn.commit()
-        conn.close()
-        logger.info(f"[INFO] Copied text history cleared for user {username}")
+        version = await admission.write(username, storage.clear_history, "copied", username)
+        notify_change(username, version, {"list": "copied", "op": "clear"})
+        logger.info("[INFO] Copied text history cleared for user %s", username)
         return {"status": "success", "message": "Copied text history cleared"}
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while clearing copied text history: {e}")
+        logger.error("[ERROR] Exception occurred while clearing copied text history: %s", e)
         return {"status": "error", "message": "Failed to clear copied text history"}
 
+# API endpoint for capture agents (clipboard_monitor.py) pushing text copied on a user's machine
+@app.post("/update-copied-text")
+async def push_copied_text(item: CopiedText):
+    logger.info("[INFO] Received copied text for user %s: %s", item.username, Payload(item.text))
+    if not item.text:
+        raise HTTPException(status_code=400, detail="Text is required")
+    try:
+        version = await admission.write(item.username, storage.add_history_item, "copied", item.username, item.text)
+        notify_change(item.username, version, {"list": "copied", "op": "add", **storage.summarize(item.text)})
+        return {"status": "success", "message": "Copied text recorded", "version": version}
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error("[ERROR] Exception occurred while recording copied text: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to record copied text")
+
 # API endpoint to update history (Clipboard Manager)
 @app.post("/update-history/{username}")
 async def update_history(username: str, item: HistoryItem):
-    logger.info(f"[INFO] Updating history for user: {username}")
+    logger.info("[INFO] Updating history for user %s: %s", username, Payload(item.text))
+    if item.text is None:
+        raise HTTPException(status_code=400, detail="Text is required")
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("INSERT INTO history (username, text, timestamp) VALUES (?, ?, ?)", (username, item.text, int(time.time())))
-        conn.commit()
-
-        # Enforce max 10 history items
-        c.execute("SELECT text FROM history WHERE username = ? ORDER BY timestamp DESC", (username,))
-        history_items = c.fetchall()
-        if len(history_items) > 10:
-            items_to_delete = len(history_items) - 10
-            c.execute("DELETE FROM history WHERE username = ? AND text IN (SELECT text FROM history WHERE username = ? ORDER BY timestamp ASC LIMIT ?)", (username, username, items_to_delete))
-            conn.commit()
-
-        conn.close()
-        logger.info(f"[INFO] History updated for user {username}")
+        # Insert the item and enforce max history items in one transaction
+        version = await admission.write(username, storage.add_history_item, "history", username, item.text)
+        notify_change(username, version, {"list": "history", "op": "add", **storage.summarize(item.text)})
+        logger.info("[INFO] History updated for user %s", username)
         return {"status": "success", "message": "History updated"}
 
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while updating history: {e}")
+        logger.error("[ERROR] Exception occurred while updating history: %s", e)
         raise HTTPException(status_code=500, detail="Failed to update history")
 
 # API endpoint to fetch history (Clipboard Manager)
 @app.get("/fetch-history/{username}")
-async def fetch_history(username: str):
-    logger.info(f"[INFO] Fetching history for user: {username}")
+async def fetch_history(username: str, request: Request):
+    log_sampled(logger, "fetch", "[INFO] Fetching history for user: %s", username)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT text FROM history WHERE username = ? ORDER BY timestamp DESC", (username,))
-        history_items = [row[0] for row in c.fetchall()]
-        conn.close()
-        logger.info(f"[INFO] History fetched for user {username}: {history_items}")
-        return {"status": "success", "history": history_items}
+        return await cached_response(request, "history", username, history_payload)
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while fetching history: {e}")
+        logger.error("[ERROR] Exception occurred while fetching history: %s", e)
         return {"status": "error", "message": "Failed to fetch history"}
 
+# Cursor-paginated history fetch; pass next_cursor back as ?cursor= to get the following page
+async def history_page(kind, username, cursor, limit):
+    try:
+        items, next_cursor = await storage.get_store().aread(storage.get_history_page, kind, username, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "items": items, "next_cursor": next_cursor}
+
+# API endpoint to fetch one page of history (Clipboard Manager)
+@app.get("/fetch-history-page/{username}")
+async def fetch_history_page(username: str, cursor: Optional[str] = None, limit: int = storage.PAGE_SIZE):
+    log_sampled(logger, "fetch", "[INFO] Fetching history page for user: %s", username)
+    return await history_page("history", username, cursor, limit)
+
+# API endpoint to fetch one page of copied text history
+@app.get("/fetch-copied-text-page/{username}")
+async def fetch_copied_text_page(username: str, cursor: Optional[str] = None, limit: int = storage.PAGE_SIZE):
+    log_sampled(logger, "fetch", "[INFO] Fetching copied text history page for user: %s", username)
+    return await history_page("copied", username, cursor, limit)
+
+# API endpoint to full-text search a history list ("history" or "copied")
+@app.get("/search-history/{username}")
+async def search_history(username: str, q: str, kind: str = Query("history", alias="list"), limit: int = storage.PAGE_SIZE):
+    logger.info("[INFO] Searching %s for user: %s", kind, username)
+    try:
+        items = await storage.get_store().aread(storage.search_history, kind, username, q, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "items": items}
+
+# API endpoint to change how many items a user's history lists keep
+@app.post("/update-history-limit/{username}")
+async def update_history_limit(username: str, item: HistoryLimit):
+    logger.info("[INFO] Updating history limit for user %s: %s", username, item.limit)
+    if item.limit < 1:
+        raise HTTPException(status_code=400, detail="History limit must be at least 1")
+    try:
+        version = await admission.write(username, storage.set_history_limit, username, item.limit)
+        notify_change(username, version, {"op": "resync"})  # Both lists may have been trimmed
+        return {"status": "success", "message": "History limit updated"}
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error("[ERROR] Exception occurred while updating history limit: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to update history limit")
+
+# API endpoint to set how long a user's list items are kept (applied by the next retention run)
+@app.post("/update-retention/{username}")
+async def update_retention(username: str, policy: RetentionPolicy):
+    logger.info("[INFO] Updating retention for user %s: %s days", username, policy.days)
+    if policy.days < 0:
+        raise HTTPException(status_code=400, detail="Retention must be 0 (keep forever) or more days")
+    try:
+        await admission.write(username, storage.set_retention_days, username, policy.days)
+        return {"status": "success", "message": "Retention updated"}
+    except Overloaded:
+        raise
+    except Exception as e:
+        logger.error("[ERROR] Exception occurred while updating retention: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to update retention")
+
 # API endpoint to delete history item (Clipboard Manager)
 @app.post("/delete-history/{username}")
 async def delete_history(username: str, item: HistoryItem):
-    logger.info(f"[INFO] Deleting history item for user: {username}")
+    logger.info("[INFO] Deleting history item for user: %s", username)
+    digest = item_hash(item)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("DELETE FROM history WHERE username = ? AND text = ?", (username, item.text))
-        conn.commit()
-        conn.close()
-        logger.info(f"[INFO] History item deleted for user {username}: {item.text}")
+        version = await admission.write(username, storage.delete_history_item, "history", username, None, digest)
+        notify_change(username, version, {"list": "history", "op": "delete", "hash": digest, "text": item.text})
+        logger.info("[INFO] History item deleted for user %s: %s", username, digest)
         return {"status": "success", "message": "History item deleted"}
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while deleting history: {e}")
+        logger.error("[ERROR] Exception occurred while deleting history: %s", e)
         return {"status": "error", "message": "Failed to delete history"}
 
 # API endpoint to clear history (Clipboard Manager)
 @app.post("/clear-history/{username}")
 async def clear_history(username: str):
-    logger.info(f"[INFO] Clearing history for user: {username}")
+    logger.info("[INFO] Clearing history for user: %s", username)
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("DELETE FROM history WHERE username = ?", (username,))
-        conn.commit()
-        conn.close()
-        logger.info(f"[INFO] History cleared for user {username}")
+        version = await admission.write(username, storage.clear_history, "history", username)
+        notify_change(username, version, {"list": "history", "op": "clear"})
+        logger.info("[INFO] History cleared for user %s", username)
         return {"status": "success", "message": "History cleared"}
+    except Overloaded:
+        raise
     except Exception as e:
-        logger.error(f"[ERROR] Exception occurred while clearing history: {e}")
+        logger.error("[ERROR] Exception occurred while clearing history: %s", e)
         return {"status": "error", "message": "Failed to clear history"}
 
+# API endpoint to apply several list/clipboard operations in one transaction (one commit, one version)
+@app.post("/history/{username}/batch")
+async def history_batch(username: str, batch: Batch):
+    logger.info("[INFO] Applying batch of %s operations for user: %s", len(batch.ops), username)
+    ops = [{"op": op.op, "list": op.list, "text": op.text, "hash": op.hash} for op in batch.ops]
+    try:
+        version, events = await admission.write(username, storage.apply_batch, username, ops)
+    except Overloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("[ERROR] Exception occurred while applying batch: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to apply batch")
+    notify_change(username, version, *events)
+    clipboard_texts = [op["text"] for op in ops if op["op"] == "clipboard"]
+    if clipboard_texts and SERVER_CLIPBOARD:
+        clipboard_worker.submit(clipboard_texts[-1])  # Only the final clipboard content matters
+    return {"status": "success", "version": version, "applied": len(events)}
+
+# API endpoint for capture agents uploading batches from their outbox. Idempotent: items the
+# agent already got applied are skipped, and "acked" tells it what it can drop.
+@app.post("/history/{username}/ingest")
+async def history_ingest(username: str, upload: Ingest):
+    logger.info("[INFO] Ingesting %s items from agent %s for user: %s", len(upload.items), upload.agent, username)
+    items = [{"id": item.id, "text": item.text} for item in upload.items]
+    try:
+        acked, events = await admission.write(username, storage.ingest_copied_text, username, upload.agent, items)
+    except Overloaded:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("[ERROR] Exception occurred while ingesting copied text: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to ingest copied text")
+    if events:
+        notify_change(username, events[-1]["version"], *events)
+    return {"status": "success", "acked": acked, "applied": len(events)}
+
+# Large payloads: streamed into a file as they arrive and stored without being loaded whole.
+# POST /upload/{username} takes the raw body in one request; for unreliable links, create an
+# upload at /uploads/{username}, PUT its chunks at the offsets it reports, then commit it.
+UPLOAD_TARGETS = ("clipboard", "history", "copied")
+
+def upload_target(target):
+    if target not in UPLOAD_TARGETS:
+        raise HTTPException(status_code=400, detail=f"target must be one of {', '.join(UPLOAD_TARGETS)}")
+    return target
+
+# Store a received file as the clipboard or a list item, and notify like the JSON endpoints
+async def store_upload(username, target, path):
+    loop = asyncio.get_running_loop()
+    try:
+        payload = await loop.run_in_executor(None, storage.read_upload, path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        if target == "clipboard":
+            version = await admission.write(username, storage.set_clipboard, username, payload)
+            if version is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            notify_change(username, version)
+            if SERVER_CLIPBOARD and isinstance(payload, str):
+                clipboard_worker.submit(payload)  # Spilled payloads are too large for the system clipboard
+        else:
+            version = await admission.write(username, storage.add_history_item, target, username, payload)
+            notify_change(username, version, {"list": target, "op": "add", **storage.summarize(payload)})
+    except Exception as e:
+        if isinstance(payload, storage.Upload) and os.path.exists(payload.path):
+            os.remove(payload.path)  # Not moved into the blob directory
+        if isinstance(e, (HTTPException, Overloaded)):
+            raise
+        logger.error("[ERROR] Exception occurred while storing upload: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to store upload")
+    size = payload.size if isinstance(payload, storage.Upload) else len(payload)
+    logger.info("[INFO] Stored %s-char upload as %s for user %s", size, target, username)
+    return {"status": "success", "version": version, "size": size}
+
+# API endpoint storing a request body (raw UTF-8 text) as the clipboard or a list item
+@app.post("/upload/{username}")
+async def upload(username: str, request: Request, target: str = "clipboard"):
+    upload_target(target)
+    try:
+        path = await uploads.receive(request.stream())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await store_upload(username, target, path)
+
+# API endpoints for resumable uploads
+@app.post("/uploads/{username}")
+async def create_upload(username: str):
+    upload_id = await asyncio.get_running_loop().run_in_executor(None, uploads.create, username)
+    logger.info("[INFO] Created upload %s for user: %s", upload_id, username)
+    return {"status": "success", "upload_id": upload_id, "offset": 0, "max_bytes": uploads.max_bytes}
+
+@app.get("/uploads/{username}/{upload_id}")
+async def upload_offset(username: str, upload_id: str):
+    try:
+        return {"status": "success", "upload_id": upload_id, "offset": uploads.offset(upload_id, username)}
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+# Append a chunk at ?offset=, which must be the upload's current offset (409 with the right one if not)
+@app.put("/uploads/{username}/{upload_id}")
+async def upload_chunk(username: str, upload_id: str, offset: int, request: Request):
+    try:
+        offset = await uploads.append(upload_id, username, offset, request.stream())
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except OffsetMismatch as e:
+        return JSONResponse(status_code=409, content={"status": "error", "detail": str(e), "offset": e.offset})
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return {"status": "success", "upload_id": upload_id, "offset": offset}
+
+@app.post("/uploads/{username}/{upload_id}/commit")
+async def commit_upload(username: str, upload_id: str, target: str = "clipboard"):
+    upload_target(target)
+    try:
+        path = uploads.finish(upload_id, username)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return await store_upload(username, target, path)
+
+@app.delete("/uploads/{username}/{upload_id}")
+async def discard_upload(username: str, upload_id: str):
+    try:
+        uploads.discard(upload_id, username)
+    except UploadNotFound:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"status": "success"}
+
+# API endpoint streaming a user's lists as NDJSON, oldest item first. Every line carries a
+# cursor; after an interrupted download, pass the last one received as ?cursor= to resume.
+@app.get("/history/{username}/export")
+async def export_history(username: str, kind: str = Query("all", alias="list"), cursor: Optional[str] = None):
+    kinds = list(storage.HISTORY_TABLES) if kind == "all" else [kind]
+    if any(k not in storage.HISTORY_TABLES for k in kinds):
+        raise HTTPException(status_code=400, detail="list must be history, copied or all")
+    if cursor:
+        try:
+            transfer.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    logger.info("[INFO] Exporting %s for user: %s", kind, username)
+    return StreamingResponse(
+        transfer.export_lines(username, kinds, cursor),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{username}-{kind}.ndjson"'},
+    )
+
+# API endpoint importing an export (NDJSON lines with list, text and timestamp), applied in
+# batches as it streams in. Items already present are skipped, so a failed import can be re-sent.
+@app.post("/history/{username}/import")
+async def import_history(username: str, request: Request):
+    batch, batch_bytes, imported, version = [], 0, 0, None
+
+    async def flush():
+        nonlocal batch, batch_bytes, imported, version
+        if batch:
+            # Each batch is admitted on its own, so an import counts against the user's rate like other writes
+            version, count = await admission.write(username, storage.import_items, username, batch)
+            imported += count
+            batch, batch_bytes = [], 0
+
+    try:
+        async for item in transfer.iter_ndjson(request.stream()):
+            if not isinstance(item, dict):
+                raise ValueError("Each line must be a JSON object")
+            batch.append(item)
+            batch_bytes += len(item.get("text") or "")
+            if len(batch) >= storage.MAX_IMPORT_ITEMS or batch_bytes >= transfer.IMPORT_BATCH_BYTES:
+                await flush()
+        await flush()
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{e} (imported {imported} items before it)")
+    except Overloaded as e:
+        raise Overloaded(f"{e.reason} (imported {imported} items before it)", e.retry_after)
+    finally:
+        if version is not None:
+            notify_change(username, version, {"op": "resync"})
+    logger.info("[INFO] Imported %s items for user: %s", imported, username)
+    return {"status": "success", "imported": imported, "version": version}
+
+# API endpoint returning every change after a client's version (from a fetch response or event)
+@app.get("/history/{username}/sync")
+async def history_sync(username: str, since: int = 0):
+    log_sampled(logger, "fetch", "[INFO] Syncing changes since version %s for user: %s", since, username)
+    result = await storage.get_store().aread(storage.get_changes, username, since)
+    return {"status": "success", **result}
+
+# Server-Sent Events stream of history changes (replaces polling the fetch endpoints)
+@app.get("/events/{username}")
+async def events(username: str, request: Request):
+    logger.info("[INFO] Opening event stream for user: %s", username)
+    return StreamingResponse(
+        stream(event_hub, username, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Response cache counters
+@app.get("/cache-stats")
+async def cache_stats():
+    return {"status": "success", "cache": response_cache.stats()}
+
+# Admission control counters
+@app.get("/admission-stats")
+async def admission_stats():
+    return {"status": "success", "admission": admission.stats()}
+
+# Prometheus metrics
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Sample all thread stacks for `seconds` and return them in collapsed (flamegraph-ready) format
+@app.get("/debug/profile")
+async def debug_profile(seconds: float = 5.0, interval_ms: float = 5.0):
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiling is disabled; set CLIPBOARD_PROFILING=1")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+    logger.info("[INFO] Profiling for %s s", seconds)
+    loop = asyncio.get_running_loop()
+    stacks = await loop.run_in_executor(None, profiler.sample_stacks, seconds, interval_ms / 1000)
+    return PlainTextResponse(stacks)
+
+# Replication between server instances (see replication.py)
+@app.post("/replication/pull")
+async def replication_pull(pull: ReplicationPull, request: Request):
+    if REPLICATION_KEY and request.headers.get(KEY_HEADER) != REPLICATION_KEY:
+        raise HTTPException(status_code=403, detail="Invalid replication key")
+    return await storage.get_store().aread(storage.replication_entries, pull.since, pull.limit)
+
+@app.get("/replication/status")
+async def replication_status():
+    db = storage.get_store()
+    return {
+        "status": "success",
+        "node": await db.aread(storage.node_id),
+        "vector": await db.aread(storage.replication_vector),
+        "peers": replicator.status(),
+    }
+
+# Database maintenance: what each task last did, and running one on demand
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+# Without a key, only clients on this machine may run tasks like vacuum-full, which blocks every write
+def check_admin_key(request):
+    if ADMIN_KEY:
+        if request.headers.get("X-Admin-Key") != ADMIN_KEY:
+            raise HTTPException(status_code=403, detail="Invalid admin key")
+    elif request.client is None or not is_loopback(request.client.host):
+        raise HTTPException(status_code=403, detail="Admin endpoints need CLIPBOARD_ADMIN_KEY for remote clients")
+
+@app.get("/admin/maintenance")
+async def maintenance_status(request: Request):
+    check_admin_key(request)
+    return {
+        "status": "success",
+        "enabled": maintenance.running,
+        "database": await storage.get_store().aread(storage.database_stats),
+        **maintenance.status(),
+    }
+
+@app.post("/admin/maintenance/{task}")
+async def run_maintenance(task: str, request: Request):
+    check_admin_key(request)
+    if task not in maintenance.tasks:
+        raise HTTPException(status_code=404, detail=f"Unknown task; choose from {', '.join(maintenance.tasks)}")
+    logger.info("[INFO] Running maintenance task %s on request", task)
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(None, maintenance.run, task)
+    except Exception as e:
+        logger.error("[ERROR] Maintenance task %s failed: %s", task, e)
+        raise HTTPException(status_code=500, detail=f"Maintenance task {task} failed")
+    return {"status": "success", "task": task, "result": result}
+
 # API endpoint to test server health
 @app.get("/health")
 async def health_check():
-    logger.info("[INFO] Health check requested")
+    log_sampled(logger, "health", "[INFO] Health check requested")
     return {"status": "success", "message": "Server is running"}
 
 # Main execution
+# Single process with the clipboard watcher built in; see serve.py for multi-worker deployments
 if __name__ == "__main__":
     import uvicorn
-    # Start the clipboard monitoring in a separate thread
-    clipboard_thread = threading.Thread(target=monitor_clipboard, daemon=True)
-    clipboard_thread.start()
+    # Get username from command-line argument, or use a default username
+    if len(sys.argv) == 2:
+        USERNAME = sys.argv[1]
+    else:
+        logger.warning("No username provided in command-line. Using default username: %s", USERNAME)
+    # Start the clipboard monitoring (runs on the watcher's own thread)
+    monitor_clipboard()
     # Start the FastAPI server
     logger.info("[INFO] Starting server...")
-    uvicorn.run(app, host="127.0.0.1", port=8010)
\ No newline at end of file
+    uvicorn.run(app, host=HOST, port=PORT)
\ No newline at end of file
@@ -19,7 +19,177 @@ const clipboardManagerBtn = document.getElementById('clipboard-manager-btn');
 const copiedTextBtn = document.getElementById('copied-text-btn');
 
 let currentUsername = null;
-let pollingInterval = null; // For polling the copied text history
+let historyLimit = 10; // Per-user history capacity, reported by the server
+let eventSource = null; // Server-Sent Events stream of history changes
+let streamInterrupted = false; // Set when the stream drops, so we resync on reconnect
+const listVersions = { history: 0, copied: 0 }; // Server version each list reflects
+
+// List rendering settings
+const ROW_OVERSCAN = 5; // Rows kept rendered beyond each edge of the visible area
+const DEFAULT_ROW_PITCH = 199; // Row height (5cm) plus the gap between rows, until measured
+const LIST_MAX_HEIGHT = 500; // Viewport height assumed while a list is hidden
+
+// Keyed, virtualized rendering of one history list.
+// `items` (newest first) is the model. Only the rows in view, plus ROW_OVERSCAN on each side,
+// exist in the DOM, between two spacers that stand in for the rest. Rows are kept by key
+// across renders, so an update only touches rows that were added or removed, and renders
+// are batched to one per animation frame. Copy and delete clicks go through one delegated
+// listener per list instead of closures on every button.
+class KeyedList {
+  constructor(element, itemClass, { onDelete, emptyText = null }) {
+    this.element = element;
+    this.itemClass = itemClass;
+    this.onDelete = onDelete;
+    this.items = [];
+    this.rows = new Map(); // key -> rendered <li>
+    this.rowPitch = 0; // Measured distance between consecutive rows
+    this.renderPending = false;
+    this.topSpacer = this.createSpacer();
+    this.bottomSpacer = this.createSpacer();
+    this.placeholder = null;
+    element.replaceChildren(this.topSpacer, this.bottomSpacer);
+    if (emptyText) {
+      this.placeholder = document.createElement('li');
+      this.placeholder.className = 'empty-item';
+      this.placeholder.textContent = emptyText;
+      element.appendChild(this.placeholder);
+    }
+    element.addEventListener('scroll', () => this.scheduleRender(), { passive: true });
+    element.addEventListener('click', event => this.handleClick(event));
+  }
+
+  createSpacer() {
+    const spacer = document.createElement('li');
+    spacer.className = 'list-spacer';
+    spacer.setAttribute('aria-hidden', 'true');
+    return spacer;
+  }
+
+  // Replace every item; entries are {text, meta}, newest first
+  setItems(entries) {
+    this.update(entries);
+  }
+
+  add(text, meta = {}) {
+    // Drop the oldest items past the history limit. The server trims its own copy
+    // in the same transaction as the insert, so nothing needs to be sent back.
+    this.update([{ text, meta }, ...this.items].slice(0, historyLimit));
+  }
+
+  // Remove every item matching a delete event (by hash when both sides know it, else by text)
+  remove(event) {
+    this.update(this.items.filter(item => !(item.meta.hash && event.hash
+      ? item.meta.hash === event.hash
+      : item.text === event.text)));
+  }
+
+  clear() {
+    this.update([]);
+  }
+
+  // Key each item by its hash (or text), numbered when the same content appears more than once
+  update(entries) {
+    const seen = new Map();
+    this.items = entries.map(({ text, meta = {} }) => {
+      const base = meta.hash || `text:${text}`;
+      const count = seen.get(base) || 0;
+      seen.set(base, count + 1);
+      return { key: `${base}#${count}`, text, meta };
+    });
+    this.scheduleRender();
+  }
+
+  scheduleRender() {
+    if (!this.renderPending) {
+      this.renderPending = true;
+      requestAnimationFrame(() => {
+        this.renderPending = false;
+        this.render();
+      });
+    }
+  }
+
+  render() {
+    const pitch = this.rowPitch || DEFAULT_ROW_PITCH;
+    const viewport = this.element.clientHeight || LIST_MAX_HEIGHT;
+    const scrollTop = this.element.scrollTop;
+    const first = Math.max(0, Math.floor(scrollTop / pitch) - ROW_OVERSCAN);
+    const last = Math.min(this.items.length, Math.ceil((scrollTop + viewport) / pitch) + ROW_OVERSCAN);
+    const visible = this.items.slice(first, last);
+
+    const wanted = new Set(visible.map(item => item.key));
+    this.rows.forEach((row, key) => {
+      if (!wanted.has(key)) {
+        row.remove();
+        this.rows.delete(key);
+      }
+    });
+    // Walk the rows in order, creating missing ones and moving only those out of place
+    let cursor = this.topSpacer.nextSibling;
+    visible.forEach(item => {
+      let row = this.rows.get(item.key);
+      if (!row) {
+        row = this.createRow(item);
+        this.rows.set(item.key, row);
+      }
+      if (row === cursor) {
+        cursor = cursor.nextSibling;
+      } else {
+        this.element.insertBefore(row, cursor);
+      }
+    });
+    this.topSpacer.style.height = `${first * pitch}px`;
+    this.bottomSpacer.style.height = `${(this.items.length - last) * pitch}px`;
+    if (this.placeholder) {
+      this.placeholder.style.display = this.items.length ? 'none' : '';
+    }
+    this.measure(visible);
+  }
+
+  // Learn the real row pitch from two rendered rows, once the list is visible
+  measure(visible) {
+    if (this.rowPitch || visible.length < 2 || this.element.offsetParent === null) {
+      return;
+    }
+    const pitch = this.rows.get(visible[1].key).offsetTop - this.rows.get(visible[0].key).offsetTop;
+    if (pitch > 0) {
+      this.rowPitch = pitch;
+      this.scheduleRender();
+    }
+  }
+
+  createRow(item) {
+    const row = document.createElement('li');
+    row.className = this.itemClass;
+    row.dataset.key = item.key;
+    createItemText(row, item.text, item.meta);
+    row.append(createButton('copy-btn', 'Copy'), createButton('delete-btn', '✕'));
+    return row;
+  }
+
+  handleClick(event) {
+    const button = event.target.closest('button');
+    const row = button && button.closest('li');
+    const item = row && this.items.find(candidate => candidate.key === row.dataset.key);
+    if (!item) {
+      return;
+    }
+    if (button.classList.contains('copy-btn')) {
+      copyItem(item.text, item.meta);
+    } else if (button.classList.contains('delete-btn')) {
+      this.update(this.items.filter(candidate => candidate !== item));
+      this.onDelete(item);
+    }
+  }
+}
+
+const historyView = new KeyedList(historyList, 'history-item', {
+  onDelete: item => deleteHistoryFromServer(item.text, item.meta.hash),
+});
+const copiedTextView = new KeyedList(copiedTextList, 'copied-text-item', {
+  onDelete: item => deleteCopiedTextFromServer(item.text, item.meta.hash),
+  emptyText: 'No copied text yet...',
+});
 
 // Login Logic
 loginBtn.addEventListener('click', () => {
@@ -44,6 +214,8 @@ loginBtn.addEventListener('click', () => {
         mainContent.style.display = 'block';
         loggedInUser.textContent = `Logged in as: ${username}`;
         loadHistory(); // Load history after login
+        loadCopiedText();
+        connectEvents(); // Keep both lists up to date from server pushes
         showClipboardManager(); // Show Clipboard Manager by default
       } else {
         loginError.textContent = 'Invalid credentials. Please try again.';
@@ -61,11 +233,7 @@ function showClipboardManager() {
   copiedTextSection.style.display = 'none';
   clipboardManagerBtn.classList.add('active');
   copiedTextBtn.classList.remove('active');
-  // Stop polling when leaving the Copied Text Viewer
-  if (pollingInterval) {
-    clearInterval(pollingInterval);
-    pollingInterval = null;
-  }
+  historyView.scheduleRender(); // Its viewport may have changed while hidden
 }
 
 function showCopiedText() {
@@ -73,16 +241,81 @@ function showCopiedText() {
   copiedTextSection.style.display = 'block';
   clipboardManagerBtn.classList.remove('active');
   copiedTextBtn.classList.add('active');
-  loadCopiedText(); // Load copied text history when showing the section
-  // Start polling to refresh the copied text history every 2 seconds
-  if (!pollingInterval) {
-    pollingInterval = setInterval(loadCopiedText, 2000);
-  }
+  copiedTextView.scheduleRender();
 }
 
 clipboardManagerBtn.addEventListener('click', showClipboardManager);
 copiedTextBtn.addEventListener('click', showCopiedText);
 
+// Subscribe to history changes pushed by the server
+function connectEvents() {
+  if (eventSource) {
+    eventSource.close();
+  }
+  eventSource = new EventSource(`/events/${currentUsername}`);
+  eventSource.onmessage = message => applyEvent(JSON.parse(message.data));
+  eventSource.onopen = () => {
+    if (streamInterrupted) {
+      // We may have missed changes while disconnected
+      streamInterrupted = false;
+      syncChanges();
+    }
+  };
+  eventSource.onerror = () => {
+    streamInterrupted = true; // EventSource reconnects on its own
+  };
+}
+
+function isStreamOpen() {
+  return eventSource !== null && eventSource.readyState === EventSource.OPEN;
+}
+
+// Fetch the changes missed since the lists were last up to date and apply them
+function syncChanges() {
+  const since = Math.min(listVersions.history, listVersions.copied);
+  fetch(`/history/${currentUsername}/sync?since=${since}`)
+    .then(response => response.json())
+    .then(data => {
+      if (data.status !== 'success' || data.resync) {
+        loadHistory();
+        loadCopiedText();
+        return;
+      }
+      data.changes.forEach(change => applyEvent(change));
+    })
+    .catch(error => console.error('Error syncing changes:', error));
+}
+
+// Apply one pushed or synced change to the matching list
+function applyEvent(event) {
+  if (event.op === 'resync') {
+    loadHistory();
+    loadCopiedText();
+    return;
+  }
+  if (!event.list || event.version <= listVersions[event.list]) {
+    return; // Clipboard change, or already reflected in the list
+  }
+  listVersions[event.list] = event.version;
+  if (event.op === 'add' && event.text === undefined) {
+    return; // Synced add whose item has since been removed
+  }
+  const view = event.list === 'history' ? historyView : copiedTextView;
+  if (event.op === 'add') {
+    view.add(event.text, event);
+  } else if (event.op === 'delete') {
+    view.remove(event);
+  } else if (event.op === 'clear') {
+    view.clear();
+  }
+}
+
+// Pair each text of a fetch response with its metadata, newest first
+function listEntries(data) {
+  const items = data.items || [];
+  return data.history.map((text, i) => ({ text, meta: items[i] || {} }));
+}
+
 // Load history from server (Clipboard Manager)
 function loadHistory() {
   fetch(`/fetch-history/${currentUsername}`)
@@ -90,7 +323,11 @@ function loadHistory() {
     .then(data => {
       if (data.status === 'success') {
         console.log('Clipboard Manager history loaded:', data.history);
-        data.history.forEach(item => addToHistory(item));
+        if (data.limit) {
+          historyLimit = data.limit;
+        }
+        listVersions.history = data.version || 0;
+        historyView.setItems(listEntries(data)); // Unchanged items keep their rows
       } else {
         console.error('Failed to load Clipboard Manager history:', data.message);
       }
@@ -105,15 +342,11 @@ function loadCopiedText() {
     .then(data => {
       if (data.status === 'success') {
         console.log('Copied text history loaded:', data.history);
-        copiedTextList.innerHTML = ''; // Clear existing items
+        listVersions.copied = data.version || 0;
         if (data.history.length === 0) {
           console.log('No copied text history found.');
-          const emptyItem = document.createElement('li');
-          emptyItem.textContent = 'No copied text yet...';
-          copiedTextList.appendChild(emptyItem);
-        } else {
-          data.history.forEach(item => addToCopiedText(item));
         }
+        copiedTextView.setItems(listEntries(data));
       } else {
         console.error('Failed to load copied text history:', data.message);
       }
@@ -121,78 +354,47 @@ function loadCopiedText() {
     .catch(error => console.error('Error loading copied text history:', error));
 }
 
-// Add to Clipboard Manager History
-function addToHistory(text) {
-  const listItem = document.createElement('li');
-  listItem.className = 'history-item';
-
+// Text span for a list item. Large items arrive as a preview (meta.truncated); their
+// hash (kept in the list's model) lets the full text be fetched or the item deleted later.
+function createItemText(listItem, text, meta = {}) {
   const textSpan = document.createElement('span');
   textSpan.textContent = text;
+  if (meta.truncated) {
+    textSpan.className = 'truncated';
+    textSpan.title = `Preview of ${meta.size} characters`;
+  }
   listItem.appendChild(textSpan);
-
-  const copyBtn = document.createElement('button');
-  copyBtn.className = 'copy-btn';
-  copyBtn.textContent = 'Copy';
-  copyBtn.addEventListener('click', () => {
-    navigator.clipboard.writeText(text).then(() => {
-      alert('Text copied to clipboard!');
-    });
-  });
-  listItem.appendChild(copyBtn);
-
-  const deleteBtn = document.createElement('button');
-  deleteBtn.className = 'delete-btn';
-  deleteBtn.textContent = '✕';
-  deleteBtn.addEventListener('click', () => {
-    listItem.remove();
-    deleteHistoryFromServer(text);
-  });
-  listItem.appendChild(deleteBtn);
-
-  historyList.insertBefore(listItem, historyList.firstChild); // Add to top (LIFO)
-  enforceHistoryLimit();
 }
 
-// Add to Copied Text History
-function addToCopiedText(text) {
-  const listItem = document.createElement('li');
-  listItem.className = 'copied-text-item';
-
-  const textSpan = document.createElement('span');
-  textSpan.textContent = text;
-  listItem.appendChild(textSpan);
+// Copy or delete button; clicks are handled by the list's delegated listener
+function createButton(className, label) {
+  const button = document.createElement('button');
+  button.className = className;
+  button.textContent = label;
+  return button;
+}
 
-  const copyBtn = document.createElement('button');
-  copyBtn.className = 'copy-btn';
-  copyBtn.textContent = 'Copy';
-  copyBtn.addEventListener('click', () => {
-    navigator.clipboard.writeText(text).then(() => {
+// Copy an item, fetching its full text first if only a preview is shown
+function copyItem(text, meta = {}) {
+  const content = meta.truncated
+    ? fetch(`/fetch-content/${currentUsername}/${meta.hash}`).then(response => response.text())
+    : Promise.resolve(text);
+  content
+    .then(fullText => navigator.clipboard.writeText(fullText))
+    .then(() => {
       alert('Text copied to clipboard!');
-    });
-  });
-  listItem.appendChild(copyBtn);
-
-  const deleteBtn = document.createElement('button');
-  deleteBtn.className = 'delete-btn';
-  deleteBtn.textContent = '✕';
-  deleteBtn.addEventListener('click', () => {
-    listItem.remove();
-    deleteCopiedTextFromServer(text);
-  });
-  listItem.appendChild(deleteBtn);
-
-  copiedTextList.insertBefore(listItem, copiedTextList.firstChild); // Add to top (LIFO)
+    })
+    .catch(error => console.error('Error copying text:', error));
 }
 
-// Enforce max 10 history items (Clipboard Manager)
-function enforceHistoryLimit() {
-  const items = historyList.getElementsByTagName('li');
-  while (items.length > 10) {
-    const lastItem = items[items.length - 1];
-    const text = lastItem.querySelector('span').textContent;
-    deleteHistoryFromServer(text);
-    lastItem.remove();
-  }
+// Add to Clipboard Manager History
+function addToHistory(text, meta = {}) {
+  historyView.add(text, meta);
+}
+
+// Add to Copied Text History
+function addToCopiedText(text, meta = {}) {
+  copiedTextView.add(text, meta);
 }
 
 // Save history to server (Clipboard Manager)
@@ -205,26 +407,26 @@ function saveHistoryToServer(text) {
 }
 
 // Delete history item from server (Clipboard Manager)
-function deleteHistoryFromServer(text) {
+function deleteHistoryFromServer(text, hash) {
   fetch(`/delete-history/${currentUsername}`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ text }),
+    body: JSON.stringify({ text, hash }),
   }).catch(error => console.error('Error deleting history:', error));
 }
 
 // Delete copied text item from server
-function deleteCopiedTextFromServer(text) {
+function deleteCopiedTextFromServer(text, hash) {
   fetch(`/delete-copied-text/${currentUsername}`, {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ text }),
+    body: JSON.stringify({ text, hash }),
   }).catch(error => console.error('Error deleting copied text:', error));
 }
 
 // Clear History (Clipboard Manager)
 clearHistoryBtn.addEventListener('click', () => {
-  historyList.innerHTML = '';
+  historyView.clear();
   fetch(`/clear-history/${currentUsername}`, {
     method: 'POST',
   }).catch(error => console.error('Error clearing history:', error));
@@ -232,7 +434,7 @@ clearHistoryBtn.addEventListener('click', () => {
 
 // Clear Copied Text History
 clearCopiedTextBtn.addEventListener('click', () => {
-  copiedTextList.innerHTML = '';
+  copiedTextView.clear();
   fetch(`/clear-copied-text/${currentUsername}`, {
     method: 'POST',
   }).catch(error => console.error('Error clearing copied text history:', error));
@@ -248,7 +450,33 @@ submitBtn.addEventListener('click', () => {
     return;
   }
 
-  if (mode === 'copy' || mode === 'both') {
+  if (mode === 'both') {
+    // One request and one transaction for both the clipboard and the history entry
+    if (!isStreamOpen()) {
+      addToHistory(text); // Otherwise the server's "add" event renders it
+    }
+    fetch(`/history/${currentUsername}/batch`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        ops: [
+          { op: 'clipboard', text },
+          { op: 'add', list: 'history', text },
+        ],
+      }),
+    })
+      .then(response => response.json())
+      .then(data => {
+        if (data.status === 'success') {
+          alert('Text copied to server clipboard!');
+        } else {
+          alert('Failed to copy text to server clipboard.');
+        }
+      })
+      .catch(error => console.error('Error applying batch on server:', error));
+  }
+
+  if (mode === 'copy') {
     // Send the text to the server to copy it to the server's system clipboard
     fetch("/update-clipboard", {
       method: "POST",
@@ -266,8 +494,10 @@ submitBtn.addEventListener('click', () => {
       .catch(error => console.error("Error updating clipboard on server:", error));
   }
 
-  if (mode === 'history' || mode === 'both') {
-    addToHistory(text);
+  if (mode === 'history') {
+    if (!isStreamOpen()) {
+      addToHistory(text); // Otherwise the server's "add" event renders it
+    }
     saveHistoryToServer(text);
   }
 
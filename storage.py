@@ -0,0 +1,1440 @@
+import asyncio
+import codecs
+import hashlib
+import logging
+import mmap
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import DB_CONNECT_SECONDS, DB_OPERATION_SECONDS, DB_WRITE_WAIT_SECONDS
+
+logger = logging.getLogger("storage")
+
+# Storage settings
+DB_PATH = os.environ.get("CLIPBOARD_DB_PATH", "users.db")
+POOL_SIZE = int(os.environ.get("CLIPBOARD_DB_POOL_SIZE", "4"))
+BUSY_TIMEOUT = 5.0  # Seconds to wait on a locked database before failing
+STATEMENT_CACHE_SIZE = 128  # Prepared statements kept per connection
+MAX_HISTORY_ITEMS = int(os.environ.get("CLIPBOARD_HISTORY_LIMIT", "10"))  # Default per-user capacity
+PAGE_SIZE = 20  # Default items per page for paginated fetches and searches
+MAX_PAGE_SIZE = 100
+MAX_BATCH_OPS = 500  # Operations accepted by one apply_batch() call
+CHANGE_LOG_VERSIONS = 1000  # Versions of each user's change log kept for get_changes()
+FEED_BATCH = 500  # Change log rows returned by one changes_after() call
+
+# Replication between server instances (see replication.py). Local changes are recorded for peers
+# to pull only with CLIPBOARD_REPLICATE, on by default when the server has CLIPBOARD_PEERS; a server
+# that is only pulled from needs it set too.
+REPLICATE = os.environ.get("CLIPBOARD_REPLICATE", "1" if os.environ.get("CLIPBOARD_PEERS", "").strip() else "0") == "1"
+REPLICATION_LOG_ROWS = 100000  # Entries of each origin node's replication log kept for peers to catch up from
+REPLICATION_BATCH = 500  # Entries returned by one replication_entries() call
+REPLICATION_BATCH_BYTES = 1024 * 1024  # Payload bytes per call (exceeded only by a single large entry)
+REPLICATION_TRIM_EVERY = 1000  # Appends between trims of the replication log
+REPLICATED_OPS = ("add", "delete", "clear", "clipboard")
+
+# Size tiers for clipboard payloads (sizes in UTF-8 bytes). Small payloads are stored
+# inline, larger ones zlib-compressed, and very large ones in a file under BLOB_DIR.
+# Compressed and spilled blobs keep only a PREVIEW_CHARS preview in blobs.text.
+COMPRESS_THRESHOLD = int(os.environ.get("CLIPBOARD_COMPRESS_THRESHOLD", str(16 * 1024)))
+SPILL_THRESHOLD = int(os.environ.get("CLIPBOARD_SPILL_THRESHOLD", str(1024 * 1024)))
+COMPRESSION_LEVEL = 6
+PREVIEW_CHARS = 1024
+BLOB_DIR = os.environ.get("CLIPBOARD_BLOB_DIR")  # Defaults to a blobs/ directory next to the database
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Bulk export and import (see transfer.py)
+EXPORT_BATCH = 100  # Items read per export query; each query is its own short read transaction
+MAX_IMPORT_ITEMS = 1000  # Items accepted by one import_items() call
+
+# Background maintenance (see maintenance.py)
+RETENTION_DAYS = int(os.environ.get("CLIPBOARD_RETENTION_DAYS", "0"))  # Default age limit for items; 0 keeps them forever
+RETENTION_BATCH = 100  # Rows deleted by one apply_retention() call (each also drops its search index entries)
+ANALYZE_LIMIT = 1000  # Rows ANALYZE samples per index (PRAGMA analysis_limit)
+FTS_MERGE_PAGES = 256  # Search index pages merged by one merge_search_index() call
+
+# History lists and the table backing each of them
+HISTORY_TABLES = {
+    "history": "history",
+    "copied": "copied_text_history",
+}
+
+
+class StoreConnection(sqlite3.Connection):
+    """Connection that knows where spilled blobs live and can defer work until after COMMIT."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.blob_dir = None
+        self.after_commit = []  # Callables the writer runs once the transaction has committed
+        self.origin = None  # (node, seq, stamp) of the replicated change being applied, if any
+
+
+def _connect(path):
+    start = time.perf_counter()
+    conn = sqlite3.connect(
+        path,
+        factory=StoreConnection,
+        timeout=BUSY_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        isolation_level=None,  # Transactions are managed explicitly by the writer
+    )
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # Takes effect for new databases; see convert_to_incremental()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.create_function("content_hash", 1, content_hash, deterministic=True)
+    conn.blob_dir = blob_dir(path)
+    DB_CONNECT_SECONDS.observe(time.perf_counter() - start)
+    return conn
+
+
+def blob_dir(path):
+    """Directory of the spilled blobs of the database at `path`."""
+    return BLOB_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), "blobs")
+
+
+def autocommit(fn):
+    """Mark a write operation the writer runs outside a transaction (VACUUM, WAL checkpoints)."""
+    fn.autocommit = True
+    return fn
+
+
+def _op_name(fn, args):
+    # Label reads made through read_versioned() by the operation they wrap
+    if fn is read_versioned and len(args) > 1:
+        fn = args[1]
+    return getattr(fn, "__name__", "unknown")
+
+
+def content_hash(text):
+    """Key under which a clipboard payload is stored in the blobs table."""
+    if text is None:
+        return None
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived read connections."""
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._all = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = _connect(self.path)
+                with self._lock:
+                    self._all.append(conn)
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            for conn in self._all:
+                conn.close()
+            self._all.clear()
+
+
+class WriteQueue:
+    """Single writer thread that applies every write in its own transaction."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        future = Future()
+        self._queue.put((fn, args, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        conn = _connect(self.path)
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            fn, args, future, submitted = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            DB_WRITE_WAIT_SECONDS.observe(start - submitted)
+            transactional = not getattr(fn, "autocommit", False)
+            try:
+                if transactional:
+                    conn.execute("BEGIN IMMEDIATE")
+                result = fn(conn, *args)
+                if transactional:
+                    conn.execute("COMMIT")
+            except BaseException as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                conn.after_commit.clear()
+                future.set_exception(e)
+            else:
+                DB_OPERATION_SECONDS.observe(time.perf_counter() - start, "write", _op_name(fn, args))
+                self._run_after_commit(conn)
+                future.set_result(result)
+        conn.close()
+
+    @staticmethod
+    def _run_after_commit(conn):
+        callbacks, conn.after_commit = conn.after_commit, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"[ERROR] Post-commit action failed: {e}")
+
+
+class Store:
+    def __init__(self, path=DB_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.blob_dir = blob_dir(path)
+        self.pool = ConnectionPool(path, pool_size)
+        self.writer = WriteQueue(path)
+        # One executor thread per pooled connection, so async reads never wait on the pool
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite-reader")
+
+    def read(self, fn, *args):
+        with self.pool.connection() as conn, DB_OPERATION_SECONDS.time("read", _op_name(fn, args)):
+            return fn(conn, *args)
+
+    def write(self, fn, *args):
+        return self.writer.submit(fn, *args).result()
+
+    async def aread(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.read, fn, *args)
+
+    async def awrite(self, fn, *args):
+        # The writer thread resolves the future once the transaction has committed
+        return await asyncio.wrap_future(self.writer.submit(fn, *args))
+
+    def close(self):
+        self.writer.close()
+        self.executor.shutdown()
+        self.pool.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+_open_lock = threading.Lock()  # Serializes get_store()'s first open
+
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have run.
+def _migrate_indexed_history(conn):
+    # Give both history tables an integer primary key and a (username, timestamp) index,
+    # carrying over rows from the original unindexed tables in insertion order
+    conn.execute("ALTER TABLE users ADD COLUMN history_limit INTEGER")
+    for table in HISTORY_TABLES.values():
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+        legacy = bool(columns) and "id" not in columns
+        if legacy:
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, username TEXT, text TEXT, timestamp INTEGER)")
+        if legacy:
+            conn.execute(
+                f"INSERT INTO {table} (username, text, timestamp) "
+                f"SELECT username, text, timestamp FROM {table}_legacy ORDER BY timestamp, rowid"
+            )
+            conn.execute(f"DROP TABLE {table}_legacy")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_time ON {table} (username, timestamp)")
+
+
+def _migrate_user_versions(conn):
+    # Per-user change counter, bumped by every write that changes what the fetch endpoints return
+    conn.execute("CREATE TABLE IF NOT EXISTS versions (username TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+
+
+def _migrate_full_text_search(conn):
+    # FTS5 index over each history table, kept in sync by triggers. Username is indexed
+    # too so a search only walks the posting lists of the requesting user's rows.
+    for table in HISTORY_TABLES.values():
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts "
+            f"USING fts5(username, text, content='{table}', content_rowid='id')"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {table}_fts (rowid, username, text) VALUES (new.id, new.username, new.text); END"
+        )
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {table}_fts ({table}_fts, rowid, username, text) VALUES ('delete', old.id, old.username, old.text); END"
+        )
+        conn.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+
+def _migrate_content_addressed(conn):
+    # Store each distinct payload once in blobs, keyed by content_hash(). History rows and
+    # users.clipboard_hash reference it; triggers keep blobs.refcount in step and
+    # _collect_garbage() removes blobs nothing references any more.
+    conn.execute(
+        "CREATE TABLE blobs (id INTEGER PRIMARY KEY, hash TEXT NOT NULL UNIQUE, text TEXT, "
+        "refcount INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute("CREATE INDEX idx_blobs_unreferenced ON blobs (refcount) WHERE refcount <= 0")
+    # Full-text index moves to blobs, so a payload is tokenized once however often it is copied
+    conn.execute("CREATE VIRTUAL TABLE blobs_fts USING fts5(text, content='blobs', content_rowid='id')")
+    conn.execute("CREATE TRIGGER blobs_fts_insert AFTER INSERT ON blobs BEGIN "
+                 "INSERT INTO blobs_fts (rowid, text) VALUES (new.id, new.text); END")
+    conn.execute("CREATE TRIGGER blobs_fts_delete AFTER DELETE ON blobs BEGIN "
+                 "INSERT INTO blobs_fts (blobs_fts, rowid, text) VALUES ('delete', old.id, old.text); END")
+
+    conn.execute(
+        "CREATE TABLE users_new (username TEXT PRIMARY KEY, password TEXT, clipboard_hash TEXT, history_limit INTEGER)"
+    )
+    conn.execute("CREATE TRIGGER users_blob_insert AFTER INSERT ON users_new WHEN new.clipboard_hash IS NOT NULL BEGIN "
+                 "UPDATE blobs SET refcount = refcount + 1 WHERE hash = new.clipboard_hash; END")
+    conn.execute("CREATE TRIGGER users_blob_update AFTER UPDATE OF clipboard_hash ON users_new BEGIN "
+                 "UPDATE blobs SET refcount = refcount - 1 WHERE hash = old.clipboard_hash; "
+                 "UPDATE blobs SET refcount = refcount + 1 WHERE hash = new.clipboard_hash; END")
+    conn.execute("CREATE TRIGGER users_blob_delete AFTER DELETE ON users_new BEGIN "
+                 "UPDATE blobs SET refcount = refcount - 1 WHERE hash = old.clipboard_hash; END")
+    conn.execute("INSERT OR IGNORE INTO blobs (hash, text) SELECT content_hash(clipboard), clipboard FROM users WHERE clipboard != ''")
+    conn.execute(
+        "INSERT INTO users_new (username, password, clipboard_hash, history_limit) "
+        "SELECT username, password, CASE WHEN clipboard != '' THEN content_hash(clipboard) END, history_limit FROM users"
+    )
+    conn.execute("DROP TABLE users")
+    conn.execute("ALTER TABLE users_new RENAME TO users")
+
+    for table in HISTORY_TABLES.values():
+        conn.execute(f"DROP TRIGGER {table}_fts_insert")
+        conn.execute(f"DROP TRIGGER {table}_fts_delete")
+        conn.execute(f"DROP TABLE {table}_fts")
+        conn.execute(f"CREATE TABLE {table}_new (id INTEGER PRIMARY KEY, username TEXT, hash TEXT NOT NULL, timestamp INTEGER)")
+        conn.execute(f"CREATE TRIGGER {table}_blob_insert AFTER INSERT ON {table}_new BEGIN "
+                     f"UPDATE blobs SET refcount = refcount + 1 WHERE hash = new.hash; END")
+        conn.execute(f"CREATE TRIGGER {table}_blob_delete AFTER DELETE ON {table}_new BEGIN "
+                     f"UPDATE blobs SET refcount = refcount - 1 WHERE hash = old.hash; END")
+        conn.execute(f"INSERT OR IGNORE INTO blobs (hash, text) SELECT content_hash(text), text FROM {table}")
+        conn.execute(
+            f"INSERT INTO {table}_new (id, username, hash, timestamp) "
+            f"SELECT id, username, content_hash(text), timestamp FROM {table} ORDER BY id"
+        )
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        conn.execute(f"CREATE INDEX idx_{table}_user_time ON {table} (username, timestamp)")
+        conn.execute(f"CREATE INDEX idx_{table}_user_hash ON {table} (username, hash)")
+
+
+def _migrate_size_tiers(conn):
+    # blobs.text becomes the searchable inline text: the full payload for small blobs and a
+    # preview for compressed ("zlib") or spilled ("file") ones. size is the full length in characters.
+    conn.execute("ALTER TABLE blobs ADD COLUMN encoding TEXT NOT NULL DEFAULT 'text'")
+    conn.execute("ALTER TABLE blobs ADD COLUMN data BLOB")
+    conn.execute("ALTER TABLE blobs ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE blobs SET size = length(text)")
+    large = conn.execute(
+        "SELECT id, hash, text FROM blobs WHERE length(CAST(text AS BLOB)) >= ?", (COMPRESS_THRESHOLD,)
+    ).fetchall()
+    for blob_id, digest, text in large:
+        encoding, inline, data = _encode_blob(conn, digest, text)
+        # External-content FTS: remove the old tokens before the indexed column changes
+        conn.execute("INSERT INTO blobs_fts (blobs_fts, rowid, text) VALUES ('delete', ?, ?)", (blob_id, text))
+        conn.execute("UPDATE blobs SET encoding = ?, text = ?, data = ? WHERE id = ?", (encoding, inline, data, blob_id))
+        conn.execute("INSERT INTO blobs_fts (rowid, text) VALUES (?, ?)", (blob_id, inline))
+
+
+def _migrate_change_log(conn):
+    # Per-user log of list and clipboard changes, tagged with the version they produced,
+    # so clients can catch up with get_changes() instead of reloading whole lists.
+    # versions.log_start is the version logging began at; older versions can't be replayed.
+    conn.execute(
+        "CREATE TABLE changes (id INTEGER PRIMARY KEY, username TEXT NOT NULL, version INTEGER NOT NULL, "
+        "list TEXT, op TEXT NOT NULL, hash TEXT)"
+    )
+    conn.execute("CREATE INDEX idx_changes_user_version ON changes (username, version)")
+    conn.execute("ALTER TABLE versions ADD COLUMN log_start INTEGER NOT NULL DEFAULT 0")
+    conn.execute("UPDATE versions SET log_start = version")
+
+
+def _migrate_ingest_agents(conn):
+    # Highest outbox id applied from each capture agent, so a retried upload is not applied twice
+    conn.execute("CREATE TABLE agents (agent TEXT PRIMARY KEY, username TEXT NOT NULL, last_id INTEGER NOT NULL)")
+
+
+def _migrate_replication(conn):
+    # Replication between server instances. Every add/delete/clear/clipboard change is appended
+    # to replication_log under its origin node's next seq; replication_state holds the highest seq
+    # recorded from each node (a version vector, and a peer's checkpoint when pulling).
+    # replication_registers keep the (stamp, node) of the last change applied to each item
+    # ("<list>:<hash>"), list clear ("<list>:*") and clipboard, for last-writer-wins.
+    conn.execute("CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+    node = os.environ.get("CLIPBOARD_NODE_ID") or uuid.uuid4().hex[:12]
+    conn.execute("INSERT INTO settings (key, value) VALUES ('node_id', ?), ('clock', '0')", (node,))
+    conn.execute(
+        "CREATE TABLE replication_log (node TEXT NOT NULL, seq INTEGER NOT NULL, stamp REAL NOT NULL, "
+        "username TEXT NOT NULL, op TEXT NOT NULL, list TEXT, hash TEXT, PRIMARY KEY (node, seq)) WITHOUT ROWID"
+    )
+    conn.execute("CREATE TABLE replication_state (node TEXT PRIMARY KEY, seq INTEGER NOT NULL)")
+    conn.execute(
+        "CREATE TABLE replication_registers (username TEXT NOT NULL, key TEXT NOT NULL, stamp REAL NOT NULL, "
+        "node TEXT NOT NULL, PRIMARY KEY (username, key)) WITHOUT ROWID"
+    )
+    # Existing data becomes this node's first entries, oldest first, so peers receive it too
+    _seed_replication_log(conn)
+
+
+def _seed_replication_log(conn, keep_times=True):
+    """Record the current lists and clipboards as this node's changes, oldest first, so peers receive them.
+
+    With keep_times each entry is stamped with its item's timestamp; otherwise it is
+    stamped now, as when recording resumes after data was written without it.
+    """
+    rows = [
+        (row[0], "add", kind, row[1], row[2])
+        for kind, table in HISTORY_TABLES.items()
+        for row in conn.execute(f"SELECT username, hash, timestamp FROM {table} ORDER BY timestamp, id")
+    ]
+    rows.sort(key=lambda row: row[4])
+    rows += conn.execute(
+        "SELECT username, 'clipboard', NULL, clipboard_hash, 0 FROM users WHERE clipboard_hash IS NOT NULL"
+    ).fetchall()
+    for username, op, kind, digest, stamp in rows:
+        _record(conn, username, op, kind, digest, stamp if keep_times else None)
+
+
+def _migrate_retention(conn):
+    # Per-user age limit for list items in days (NULL: RETENTION_DAYS), applied by maintenance.py
+    conn.execute("ALTER TABLE users ADD COLUMN retention_days INTEGER")
+
+
+MIGRATIONS = [
+    _migrate_indexed_history,
+    _migrate_user_versions,
+    _migrate_full_text_search,
+    _migrate_content_addressed,
+    _migrate_size_tiers,
+    _migrate_change_log,
+    _migrate_ingest_agents,
+    _migrate_replication,
+    _migrate_retention,
+]
+
+
+def _create_schema(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, clipboard TEXT)")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if version < number:
+            logger.info(f"[INFO] Applying schema migration {number}: {migration.__name__}")
+            migration(conn)
+    conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    _sync_replication_log(conn)
+
+
+def _sync_replication_log(conn):
+    # Without REPLICATE, local writes skip the replication log, which is marked paused. When
+    # recording resumes, the log is re-seeded from the current data, so peers receive what was
+    # written in between (deletes made meanwhile are not sent).
+    paused = conn.execute("SELECT 1 FROM settings WHERE key = 'replication_log' AND value = 'paused'").fetchone()
+    if not REPLICATE and not paused:
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('replication_log', 'paused')")
+    elif REPLICATE and paused:
+        logger.info("[INFO] Replication recording resumed; re-seeding the replication log")
+        _seed_replication_log(conn, keep_times=False)
+        conn.execute("DELETE FROM settings WHERE key = 'replication_log'")
+
+
+# Open the store (replacing any previously opened one) and make sure the schema exists.
+# The store is only published once its migrations have run, so get_store() never returns it early.
+def init_db(path=None):
+    global _store
+    store = Store(path or DB_PATH)
+    try:
+        store.write(_create_schema)
+    except BaseException:
+        store.close()
+        raise
+    with _store_lock:
+        previous, _store = _store, store
+    if previous is not None:
+        previous.close()
+    logger.info(f"[INFO] Database initialized successfully at {store.path}")
+    return store
+
+
+def close_db():
+    """Close the open store, if any; the next get_store() opens a fresh one."""
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+
+def get_store():
+    # Opened on first use, so importing a module that uses the store doesn't touch the database.
+    # The first open blocks its caller; server.py does it off the event loop (see StoreGate).
+    if _store is None:
+        with _open_lock:
+            if _store is None:
+                return init_db()
+    return _store
+
+
+def _table(kind):
+    try:
+        return HISTORY_TABLES[kind]
+    except KeyError:
+        raise ValueError(f"Unknown history list: {kind}")
+
+
+# Storage operations. Each takes a connection as its first argument and is run
+# through Store.read/Store.write (or their async variants aread/awrite).
+# Write operations that change a user's data return the user's new version.
+# The underscore-prefixed building blocks log their change but leave garbage collection
+# and the version bump to the caller, so apply_batch() can run several in one transaction.
+
+# Versions
+def _bump_version(conn, username):
+    conn.execute(
+        "INSERT INTO versions (username, version) VALUES (?, 1) "
+        "ON CONFLICT(username) DO UPDATE SET version = version + 1",
+        (username,),
+    )
+    version = get_version(conn, username)
+    conn.execute(
+        "DELETE FROM changes WHERE username = ? AND version <= ?", (username, version - CHANGE_LOG_VERSIONS)
+    )
+    return version
+
+
+def get_version(conn, username):
+    row = conn.execute("SELECT version FROM versions WHERE username = ?", (username,)).fetchone()
+    return row[0] if row else 0
+
+
+def read_versioned(conn, username, fn, *args):
+    """Run a read operation and fetch the user's version from the same snapshot."""
+    conn.execute("BEGIN")
+    try:
+        return get_version(conn, username), fn(conn, *args)
+    finally:
+        conn.execute("COMMIT")
+
+
+# Change log
+def _log_change(conn, username, kind, op, digest=None, **event):
+    """Record a change under the version the enclosing write will bump to, and return it as an event."""
+    conn.execute(
+        "INSERT INTO changes (username, version, list, op, hash) VALUES (?, ?, ?, ?, ?)",
+        (username, get_version(conn, username) + 1, kind, op, digest),
+    )
+    if kind is not None:
+        event["list"] = kind
+    if digest is not None:
+        event["hash"] = digest
+    return {"op": op, **event}
+
+
+def _changes_since(conn, username, since):
+    row = conn.execute("SELECT version, log_start FROM versions WHERE username = ?", (username,)).fetchone()
+    version, log_start = row if row else (0, 0)
+    if since > version or since < max(log_start, version - CHANGE_LOG_VERSIONS):
+        return None  # Unknown version, or older than the log reaches back
+    rows = conn.execute(
+        "SELECT c.version, c.list, c.op, c.hash, b.text, b.size FROM changes c LEFT JOIN blobs b ON b.hash = c.hash "
+        "WHERE c.username = ? AND c.version > ? ORDER BY c.id",
+        (username, since),
+    )
+    return [_change_event(*row) for row in rows]
+
+
+def _change_event(version, kind, op, digest, text, size):
+    change = {"version": version, "op": op}
+    if kind is not None:
+        change["list"] = kind
+    if digest is not None:
+        change["hash"] = digest
+    if op in ("add", "clipboard") and text is not None:
+        change.update(_summary((digest, text, size)))
+    return change
+
+
+def get_changes(conn, username, since):
+    """Changes after version `since`, oldest first, as {version, resync, changes}.
+
+    resync is set (and changes left empty) when the log no longer reaches back to
+    `since`; the client should then reload its lists. Added items whose payload has
+    since been deleted come back without text.
+    """
+    version, changes = read_versioned(conn, username, _changes_since, username, since)
+    return {"version": version, "resync": changes is None, "changes": changes or []}
+
+
+def last_change_id(conn):
+    return conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+
+
+def changes_after(conn, after_id, limit=FEED_BATCH):
+    """Every user's change log rows after row id `after_id`, oldest first, as (id, username, event).
+
+    Lets a process follow writes committed by other processes sharing the database.
+    """
+    rows = conn.execute(
+        "SELECT c.id, c.username, c.version, c.list, c.op, c.hash, b.text, b.size "
+        "FROM changes c LEFT JOIN blobs b ON b.hash = c.hash WHERE c.id > ? ORDER BY c.id LIMIT ?",
+        (after_id, limit),
+    )
+    return [(row[0], row[1], _change_event(*row[2:])) for row in rows]
+
+
+# Blobs
+def preview(text):
+    return text[:PREVIEW_CHARS]
+
+
+def summarize(text):
+    """Listing entry for a payload, in the shape get_history() returns, without reading the database."""
+    if isinstance(text, Upload):
+        return _summary((text.digest, text.preview, text.size))
+    inline = preview(text) if len(text.encode("utf-8")) >= COMPRESS_THRESHOLD else text
+    return _summary((content_hash(text), inline, len(text)))
+
+
+def _blob_path(conn, digest):
+    return os.path.join(conn.blob_dir, digest)
+
+
+def _write_blob_file(conn, digest, raw):
+    path = _blob_path(conn, digest)
+    if os.path.exists(path):
+        return  # Left behind by a rolled-back write; the content is the same
+    os.makedirs(conn.blob_dir, exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(raw)
+    os.replace(tmp_path, path)
+
+
+def _remove_blob_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _encode_blob(conn, digest, text):
+    """Pick a size tier for a payload: (encoding, inline text, compressed data)."""
+    raw = text.encode("utf-8")
+    if len(raw) >= SPILL_THRESHOLD:
+        _write_blob_file(conn, digest, raw)
+        return "file", preview(text), None
+    if len(raw) >= COMPRESS_THRESHOLD:
+        return "zlib", preview(text), zlib.compress(raw, COMPRESSION_LEVEL)
+    return "text", text, None
+
+
+def _put_blob(conn, text):
+    digest = content_hash(text)
+    if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+        return digest
+    encoding, inline, data = _encode_blob(conn, digest, text)
+    conn.execute(
+        "INSERT INTO blobs (hash, text, encoding, data, size) VALUES (?, ?, ?, ?, ?)",
+        (digest, inline, encoding, data, len(text)),
+    )
+    return digest
+
+
+# Payloads received into a file (see read_upload()), stored as spilled blobs without loading them whole
+Upload = namedtuple("Upload", ["path", "digest", "size", "preview"])
+
+
+def read_upload(path):
+    """The payload in an uploaded file: its text if small, else an Upload to store as it is.
+
+    Files at least SPILL_THRESHOLD bytes are read once, in chunks, for their hash, length
+    in characters and preview; the file itself becomes the blob. Smaller ones are read
+    and the file removed. Raises ValueError if the file is empty or isn't valid UTF-8.
+    """
+    nbytes = os.path.getsize(path)
+    if nbytes == 0:
+        _remove_blob_file(path)
+        raise ValueError("Upload is empty")
+    if nbytes < SPILL_THRESHOLD:
+        try:
+            with open(path, "rb") as f:
+                return f.read().decode("utf-8")
+        finally:
+            _remove_blob_file(path)
+    digest = hashlib.blake2b(digest_size=16)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    size, head = 0, []
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            text = decoder.decode(chunk)
+            if size < PREVIEW_CHARS:
+                head.append(text[:PREVIEW_CHARS - size])
+            size += len(text)
+    size += len(decoder.decode(b"", final=True))
+    return Upload(path, digest.hexdigest(), size, "".join(head))
+
+
+def _put_upload(conn, upload):
+    if conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (upload.digest,)).fetchone():
+        conn.after_commit.append(lambda: _remove_blob_file(upload.path))  # Already stored
+        return upload.digest
+    os.makedirs(conn.blob_dir, exist_ok=True)
+    os.replace(upload.path, _blob_path(conn, upload.digest))  # Left in place if the write rolls back
+    conn.execute(
+        "INSERT INTO blobs (hash, text, encoding, data, size) VALUES (?, ?, 'file', NULL, ?)",
+        (upload.digest, upload.preview, upload.size),
+    )
+    return upload.digest
+
+
+def _put_payload(conn, payload):
+    return _put_upload(conn, payload) if isinstance(payload, Upload) else _put_blob(conn, payload)
+
+
+def _collect_garbage(conn):
+    # Drop payloads no history row or clipboard references any more (uses the partial index).
+    # Spilled files are removed only once the delete has committed.
+    spilled = conn.execute("SELECT hash FROM blobs WHERE refcount <= 0 AND encoding = 'file'").fetchall()
+    removed = conn.execute("DELETE FROM blobs WHERE refcount <= 0").rowcount
+    for (digest,) in spilled:
+        conn.after_commit.append(lambda path=_blob_path(conn, digest): _remove_blob_file(path))
+    return removed
+
+
+def _references_blob(conn, username, digest):
+    if conn.execute("SELECT 1 FROM users WHERE username = ? AND clipboard_hash = ?", (username, digest)).fetchone():
+        return True
+    return any(
+        conn.execute(f"SELECT 1 FROM {table} WHERE username = ? AND hash = ?", (username, digest)).fetchone()
+        for table in HISTORY_TABLES.values()
+    )
+
+
+def open_blob(conn, username, digest):
+    """Full content of a payload the user references, as an iterator of UTF-8 chunks (None if not found).
+
+    Spilled payloads are memory-mapped and streamed, so they are never held in memory whole.
+    """
+    if not _references_blob(conn, username, digest):
+        return None
+    return _open_blob(conn, digest)
+
+
+def _open_blob(conn, digest):
+    row = conn.execute("SELECT encoding, text, data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+    if row is None:
+        return None
+    encoding, text, data = row
+    if encoding == "zlib":
+        return iter([zlib.decompress(data)])
+    if encoding == "file":
+        # Opened now, while the blob is known to exist; later garbage collection only unlinks it
+        f = open(_blob_path(conn, digest), "rb")
+        return _stream_file(f)
+    return iter([text.encode("utf-8")])
+
+
+def _stream_file(f):
+    try:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            for offset in range(0, len(view), STREAM_CHUNK_SIZE):
+                yield view[offset:offset + STREAM_CHUNK_SIZE]
+    finally:
+        f.close()
+
+
+def load_blob(conn, username, digest):
+    """Full text of a payload the user references, or None."""
+    chunks = open_blob(conn, username, digest)
+    return None if chunks is None else b"".join(chunks).decode("utf-8")
+
+
+# Users
+def authenticate(conn, username, password):
+    row = conn.execute("SELECT 1 FROM users WHERE username = ? AND password = ?", (username, password)).fetchone()
+    return row is not None
+
+
+def register_user(conn, username, password):
+    conn.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+
+
+def claim_user(conn, username, password):
+    """Set the password of a user first seen through replication, who exists without one. Returns True if set."""
+    cursor = conn.execute("UPDATE users SET password = ? WHERE username = ? AND password IS NULL", (password, username))
+    return cursor.rowcount == 1
+
+
+# Clipboard
+def _set_clipboard(conn, username, text):
+    """Returns the change event, or None for an unknown user (the payload is left for garbage collection)."""
+    digest = _put_payload(conn, text)
+    if not conn.execute("UPDATE users SET clipboard_hash = ? WHERE username = ?", (digest, username)).rowcount:
+        return None
+    _record(conn, username, "clipboard", None, digest)
+    return _log_change(conn, username, None, "clipboard", digest, **summarize(text))
+
+
+def set_clipboard(conn, username, text):
+    """Returns the user's new version, or None (changing nothing) if there is no such user."""
+    changed = _set_clipboard(conn, username, text) is not None
+    _collect_garbage(conn)
+    return _bump_version(conn, username) if changed else None
+
+
+def get_clipboard(conn, username):
+    """Preview entry for the user's clipboard; fetch the full text with load_blob() when truncated."""
+    row = conn.execute(
+        "SELECT b.hash, b.text, b.size FROM users u JOIN blobs b ON b.hash = u.clipboard_hash WHERE u.username = ?",
+        (username,),
+    ).fetchone()
+    return _summary(row) if row else None
+
+
+def get_history_limit(conn, username):
+    row = conn.execute("SELECT history_limit FROM users WHERE username = ?", (username,)).fetchone()
+    return row[0] if row and row[0] is not None else MAX_HISTORY_ITEMS
+
+
+def set_history_limit(conn, username, limit):
+    conn.execute("UPDATE users SET history_limit = ? WHERE username = ?", (limit, username))
+    for table in HISTORY_TABLES.values():
+        _trim(conn, table, username)
+    _log_change(conn, username, None, "resync")  # Both lists may have been trimmed
+    _collect_garbage(conn)
+    return _bump_version(conn, username)
+
+
+# History lists ("history" for the Clipboard Manager, "copied" for system-wide copies)
+def _trim(conn, table, username):
+    # Ring-buffer trim: walk the (username, timestamp) index newest-first and drop
+    # everything past the user's capacity. Cost depends only on this user's rows.
+    conn.execute(
+        f"DELETE FROM {table} WHERE id IN ("
+        f"SELECT id FROM {table} WHERE username = ? ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET "
+        f"(SELECT COALESCE((SELECT history_limit FROM users WHERE username = ?), ?)))",
+        (username, username, MAX_HISTORY_ITEMS),
+    )
+
+
+def _add_history_item(conn, kind, username, text, timestamp=None):
+    # Trimmed items are not logged (or replicated): clients and peers apply their own history limit
+    table = _table(kind)
+    digest = _put_payload(conn, text)
+    conn.execute(
+        f"INSERT INTO {table} (username, hash, timestamp) VALUES (?, ?, ?)",
+        (username, digest, int(timestamp or time.time())),
+    )
+    _trim(conn, table, username)
+    _record(conn, username, "add", kind, digest)
+    return _log_change(conn, username, kind, "add", digest, **summarize(text))
+
+
+def add_history_item(conn, kind, username, text):
+    _add_history_item(conn, kind, username, text)
+    _collect_garbage(conn)
+    return _bump_version(conn, username)
+
+
+def get_history(conn, kind, username):
+    """Newest-first preview entries ({hash, text, size, truncated}) for a whole history list."""
+    table = _table(kind)
+    rows = conn.execute(
+        f"SELECT b.hash, b.text, b.size FROM {table} h JOIN blobs b ON b.hash = h.hash "
+        f"WHERE h.username = ? ORDER BY h.timestamp DESC, h.id DESC",
+        (username,),
+    )
+    return [_summary(row) for row in rows]
+
+
+def encode_cursor(timestamp, item_id):
+    return f"{timestamp}:{item_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, item_id = cursor.split(":")
+        return int(timestamp), int(item_id)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def _page_size(limit):
+    return max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+
+
+def _summary(row):
+    digest, text, size = row
+    return {"hash": digest, "text": text, "size": size, "truncated": size > len(text)}
+
+
+def _item(row):
+    return {"id": row[0], "timestamp": row[3], **_summary((row[1], row[2], row[4]))}
+
+
+def get_history_page(conn, kind, username, cursor=None, limit=PAGE_SIZE):
+    """Newest-first page of a history list; pass back next_cursor to continue after its last item."""
+    table = _table(kind)
+    limit = _page_size(limit)
+    select = f"SELECT h.id, h.hash, b.text, h.timestamp, b.size FROM {table} h JOIN blobs b ON b.hash = h.hash "
+    if cursor:
+        timestamp, item_id = decode_cursor(cursor)
+        rows = conn.execute(
+            select + "WHERE h.username = ? AND (h.timestamp, h.id) < (?, ?) ORDER BY h.timestamp DESC, h.id DESC LIMIT ?",
+            (username, timestamp, item_id, limit + 1),
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            select + "WHERE h.username = ? ORDER BY h.timestamp DESC, h.id DESC LIMIT ?",
+            (username, limit + 1),
+        ).fetchall()
+    items = [_item(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+    return items, next_cursor
+
+
+def _fts_query(query):
+    # Quote every term so user input can't inject FTS5 syntax; the last term matches as a prefix
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    if not terms:
+        raise ValueError("Search query is empty")
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def search_history(conn, kind, username, query, limit=PAGE_SIZE):
+    table = _table(kind)
+    rows = conn.execute(
+        # Match distinct payloads first, then probe the (username, hash) index for this
+        # user's rows. CROSS JOIN keeps that order; otherwise SQLite may walk the user's
+        # rows and re-run the MATCH for each one.
+        f"SELECT h.id, h.hash, b.text, h.timestamp, b.size FROM blobs_fts f CROSS JOIN blobs b ON b.id = f.rowid "
+        f"CROSS JOIN {table} h ON h.username = ? AND h.hash = b.hash "
+        f"WHERE blobs_fts MATCH ? ORDER BY h.timestamp DESC, h.id DESC LIMIT ?",
+        (username, _fts_query(query), _page_size(limit)),
+    )
+    return [_item(row) for row in rows]
+
+
+def _delete_history_item(conn, kind, username, text=None, digest=None):
+    table = _table(kind)
+    digest = digest or content_hash(text)
+    conn.execute(f"DELETE FROM {table} WHERE username = ? AND hash = ?", (username, digest))
+    _record(conn, username, "delete", kind, digest)
+    event = {"text": text} if text is not None else {}
+    return _log_change(conn, username, kind, "delete", digest, **event)
+
+
+def delete_history_item(conn, kind, username, text=None, digest=None):
+    """Delete an item by its text or, for truncated previews, by its hash."""
+    _delete_history_item(conn, kind, username, text, digest)
+    _collect_garbage(conn)
+    return _bump_version(conn, username)
+
+
+def _clear_history(conn, kind, username):
+    table = _table(kind)
+    conn.execute(f"DELETE FROM {table} WHERE username = ?", (username,))
+    _record(conn, username, "clear", kind)
+    return _log_change(conn, username, kind, "clear")
+
+
+def clear_history(conn, kind, username):
+    _clear_history(conn, kind, username)
+    _collect_garbage(conn)
+    return _bump_version(conn, username)
+
+
+# Batches
+def _apply_op(conn, username, op):
+    name = op.get("op")
+    kind, text, digest = op.get("list"), op.get("text"), op.get("hash")
+    if name == "add" and text is not None:
+        return _add_history_item(conn, kind, username, text)
+    if name == "delete" and (text is not None or digest):
+        return _delete_history_item(conn, kind, username, text, digest)
+    if name == "clear":
+        return _clear_history(conn, kind, username)
+    if name == "clipboard" and text is not None:
+        event = _set_clipboard(conn, username, text)
+        if event is None:
+            raise ValueError(f"Unknown user: {username}")
+        return event
+    raise ValueError(f"Invalid batch operation: {name!r}")
+
+
+def apply_batch(conn, username, ops):
+    """Apply add/delete/clear/clipboard operations in one transaction.
+
+    Each op is a dict with "op" plus "list", "text" and/or "hash" as the operation needs.
+    Any invalid op raises ValueError and rolls the whole batch back. Every op still gets
+    its own version, so clients can tell the resulting events apart.
+    Returns (version, events), with one change event (including its version) per op.
+    """
+    if not ops:
+        raise ValueError("Batch is empty")
+    if len(ops) > MAX_BATCH_OPS:
+        raise ValueError(f"Batch has more than {MAX_BATCH_OPS} operations")
+    events = []
+    for op in ops:
+        event = _apply_op(conn, username, op)
+        event["version"] = _bump_version(conn, username)
+        events.append(event)
+    _collect_garbage(conn)
+    return events[-1]["version"], events
+
+
+# Capture agent uploads
+def ingest_copied_text(conn, username, agent, items):
+    """Add copied text captured by an agent, skipping items an earlier upload already applied.
+
+    items are dicts with an "id" (increasing per agent, from the agent's outbox) and "text".
+    Returns (last_id, events): the highest id applied for the agent, which it can drop from
+    its outbox, and one change event (including its version) per newly added item.
+    """
+    if len(items) > MAX_BATCH_OPS:
+        raise ValueError(f"Upload has more than {MAX_BATCH_OPS} items")
+    row = conn.execute("SELECT username, last_id FROM agents WHERE agent = ?", (agent,)).fetchone()
+    if row is not None and row[0] != username:
+        raise ValueError(f"Agent {agent!r} uploads for another user")
+    last_id = row[1] if row else 0
+    events = []
+    for item in sorted(items, key=lambda item: item["id"]):
+        if item["id"] <= last_id:
+            continue  # Already applied; the agent never saw the response
+        if not item.get("text"):
+            raise ValueError(f"Item {item['id']} has no text")
+        event = _add_history_item(conn, "copied", username, item["text"])
+        event["version"] = _bump_version(conn, username)
+        events.append(event)
+        last_id = item["id"]
+    conn.execute(
+        "INSERT INTO agents (agent, username, last_id) VALUES (?, ?, ?) "
+        "ON CONFLICT(agent) DO UPDATE SET last_id = excluded.last_id",
+        (agent, username, last_id),
+    )
+    _collect_garbage(conn)
+    return last_id, events
+
+
+# Replication
+def _setting(conn, key):
+    return conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()[0]
+
+
+def node_id(conn):
+    return _setting(conn, "node_id")
+
+
+def _tick(conn, seen=None):
+    """Next stamp for a local change, or (with `seen`) advance the clock past a remote one.
+
+    A hybrid clock: wall time, but never behind a stamp already issued or received,
+    so a change made after seeing another always wins against it.
+    """
+    clock = float(_setting(conn, "clock"))
+    stamp = max(clock, seen) if seen is not None else max(time.time(), clock + 1e-6)
+    conn.execute("UPDATE settings SET value = ? WHERE key = 'clock'", (repr(stamp),))
+    return stamp
+
+
+def _register_key(op, kind, digest):
+    if op == "clipboard":
+        return "clipboard"
+    return f"{kind}:*" if op == "clear" else f"{kind}:{digest}"
+
+
+def _wins(conn, username, key, stamp, node):
+    """Whether a change stamped (stamp, node) is newer than the last one applied to `key`."""
+    row = conn.execute(
+        "SELECT stamp, node FROM replication_registers WHERE username = ? AND key = ?", (username, key)
+    ).fetchone()
+    return row is None or (stamp, node) > tuple(row)
+
+
+def _append_log(conn, node, seq, stamp, username, op, kind, digest):
+    conn.execute(
+        "INSERT OR IGNORE INTO replication_log (node, seq, stamp, username, op, list, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (node, seq, stamp, username, op, kind, digest),
+    )
+    conn.execute(
+        "INSERT INTO replication_state (node, seq) VALUES (?, ?) "
+        "ON CONFLICT(node) DO UPDATE SET seq = max(seq, excluded.seq)",
+        (node, seq),
+    )
+    if seq % REPLICATION_TRIM_EVERY == 0:
+        _trim_replication_log(conn, node, seq)
+
+
+def _trim_replication_log(conn, node, seq):
+    conn.execute("DELETE FROM replication_log WHERE node = ? AND seq <= ?", (node, seq - REPLICATION_LOG_ROWS))
+    # Registers older than every retained entry can't be contested by a change still to arrive
+    oldest = conn.execute("SELECT MIN(stamp) FROM replication_log").fetchone()[0]
+    if oldest is not None:
+        conn.execute("DELETE FROM replication_registers WHERE stamp < ?", (oldest,))
+
+
+def _record(conn, username, op, kind=None, digest=None, stamp=None):
+    """Append an applied change to the replication log and make it the last writer of its key.
+
+    Local changes get this node's next seq and a fresh stamp; a replicated change being
+    applied (conn.origin) keeps its origin's, so it can be passed on to further peers.
+    Without REPLICATE, local changes aren't recorded (see _sync_replication_log).
+    """
+    if conn.origin is None and not REPLICATE:
+        return
+    if conn.origin is not None:
+        node, seq, stamp = conn.origin
+    else:
+        node = node_id(conn)
+        row = conn.execute("SELECT seq FROM replication_state WHERE node = ?", (node,)).fetchone()
+        seq = (row[0] if row else 0) + 1
+        stamp = stamp if stamp is not None else _tick(conn)
+    _append_log(conn, node, seq, stamp, username, op, kind, digest)
+    conn.execute(
+        "INSERT INTO replication_registers (username, key, stamp, node) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT(username, key) DO UPDATE SET stamp = excluded.stamp, node = excluded.node",
+        (username, _register_key(op, kind, digest), stamp, node),
+    )
+
+
+def replication_vector(conn):
+    """{node: highest seq recorded from it}, this node included; a puller's checkpoint."""
+    return dict(conn.execute("SELECT node, seq FROM replication_state"))
+
+
+def replication_entries(conn, since, limit=REPLICATION_BATCH):
+    """Replication log entries a peer at version vector `since` hasn't recorded yet.
+
+    Returns {"node", "entries", "more", "gaps"}. Entries are dicts with node, seq, stamp,
+    username, op, list, hash and, for adds and clipboard changes, the full text (None if
+    the payload has since been deleted here; a later entry supersedes it). Each origin's
+    entries come in seq order. gaps lists origins whose log no longer reaches back to
+    the peer's checkpoint, so some of their changes can't be sent.
+    """
+    limit = max(1, min(int(limit), REPLICATION_BATCH))
+    entries, gaps, size, more = [], [], 0, False
+    for node, seq in conn.execute("SELECT node, seq FROM replication_state ORDER BY node").fetchall():
+        after = int(since.get(node, 0))
+        if seq <= after:
+            continue
+        if len(entries) >= limit or size >= REPLICATION_BATCH_BYTES:
+            more = True
+            break
+        oldest = conn.execute("SELECT MIN(seq) FROM replication_log WHERE node = ?", (node,)).fetchone()[0]
+        if oldest is not None and oldest > after + 1:
+            gaps.append(node)
+        rows = conn.execute(
+            "SELECT seq, stamp, username, op, list, hash FROM replication_log WHERE node = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (node, after, limit - len(entries)),
+        ).fetchall()
+        for entry_seq, stamp, username, op, kind, digest in rows:
+            text = None
+            if op in ("add", "clipboard"):
+                chunks = _open_blob(conn, digest)
+                text = None if chunks is None else b"".join(chunks).decode("utf-8")
+                size += len(text or "")
+            entries.append({
+                "node": node, "seq": entry_seq, "stamp": stamp, "username": username,
+                "op": op, "list": kind, "hash": digest, "text": text,
+            })
+            if size >= REPLICATION_BATCH_BYTES:
+                break
+        if entries and entries[-1]["node"] == node and entries[-1]["seq"] < seq:
+            more = True
+    return {"node": node_id(conn), "entries": entries, "more": more, "gaps": gaps}
+
+
+def _apply_replicated(conn, entry):
+    """Apply one pulled entry if it wins last-writer-wins; returns its change events (empty if it lost)."""
+    username, op, kind, digest, text = entry["username"], entry["op"], entry.get("list"), entry.get("hash"), entry.get("text")
+    stamp, node = entry["stamp"], entry["node"]
+    if op == "clipboard":
+        if text is None or not _wins(conn, username, "clipboard", stamp, node):
+            return []
+        conn.execute("INSERT OR IGNORE INTO users (username) VALUES (?)", (username,))
+        return [_set_clipboard(conn, username, text)]
+    table = _table(kind)
+    if not _wins(conn, username, f"{kind}:*", stamp, node):
+        return []  # The list was cleared after this change
+    if op == "add":
+        if text is None or not _wins(conn, username, f"{kind}:{digest}", stamp, node):
+            return []
+        events = []
+        # Replicated adds track presence, not copies: move the item to the top instead of duplicating it
+        if conn.execute(f"DELETE FROM {table} WHERE username = ? AND hash = ?", (username, digest)).rowcount:
+            events.append(_log_change(conn, username, kind, "delete", digest))
+        return events + [_add_history_item(conn, kind, username, text, timestamp=stamp)]
+    if op == "delete":
+        if not _wins(conn, username, f"{kind}:{digest}", stamp, node):
+            return []
+        return [_delete_history_item(conn, kind, username, digest=digest)]
+    if op == "clear":
+        # Items added or deleted after the clear (by stamp) keep their state
+        newer = [
+            key.split(":", 1)[1] for (key,) in conn.execute(
+                "SELECT key FROM replication_registers WHERE username = ? AND key > ? AND key < ? AND (stamp, node) > (?, ?)",
+                (username, f"{kind}:", f"{kind};", stamp, node),
+            )
+        ]
+        if not newer:
+            return [_clear_history(conn, kind, username)]
+        placeholders = ",".join("?" * len(newer))
+        conn.execute(f"DELETE FROM {table} WHERE username = ? AND hash NOT IN ({placeholders})", (username, *newer))
+        _record(conn, username, "clear", kind)
+        return [_log_change(conn, username, kind, "resync")]  # Clients reload rather than clear everything
+    raise ValueError(f"Invalid replicated operation: {op!r}")
+
+
+def apply_replicated(conn, entries):
+    """Apply entries pulled from a peer (see replication_entries()) in one transaction.
+
+    Entries this node already recorded (from their origin or through another peer) are
+    skipped. The rest are appended to the log whether or not they win, so they are passed
+    on to other peers, and applied when they are newer than the item's last change.
+    Returns [(username, event)] for the applied ones, each event with its version.
+    """
+    state = replication_vector(conn)
+    events = []
+    for entry in entries:
+        node, seq, stamp = entry["node"], entry["seq"], entry["stamp"]
+        if entry["op"] not in REPLICATED_OPS:
+            raise ValueError(f"Invalid replicated operation: {entry['op']!r}")
+        if seq <= state.get(node, 0):
+            continue
+        state[node] = seq
+        _tick(conn, stamp)
+        conn.origin = (node, seq, stamp)
+        try:
+            applied = _apply_replicated(conn, entry)
+        finally:
+            conn.origin = None
+        if not applied:
+            _append_log(conn, node, seq, stamp, entry["username"], entry["op"], entry.get("list"), entry.get("hash"))
+            continue
+        version = _bump_version(conn, entry["username"])
+        for event in applied:
+            event["version"] = version
+            events.append((entry["username"], event))
+    _collect_garbage(conn)
+    return events
+
+
+# Bulk export and import
+def export_page(conn, kind, username, after=None, limit=EXPORT_BATCH):
+    """Oldest-first items of a history list after (timestamp, id) `after`.
+
+    Items have id, timestamp, hash and size, plus the text itself when it is stored
+    inline; fetch larger ones with open_blob(), one at a time.
+    """
+    table = _table(kind)
+    after = after or (-1, 0)
+    rows = conn.execute(
+        f"SELECT h.id, h.timestamp, h.hash, b.size, b.encoding, b.text FROM {table} h JOIN blobs b ON b.hash = h.hash "
+        f"WHERE h.username = ? AND (h.timestamp, h.id) > (?, ?) ORDER BY h.timestamp, h.id LIMIT ?",
+        (username, after[0], after[1], limit),
+    )
+    page = []
+    for item_id, timestamp, digest, size, encoding, text in rows:
+        item = {"id": item_id, "timestamp": timestamp, "hash": digest, "size": size}
+        if encoding == "text":
+            item["text"] = text
+        page.append(item)
+    return page
+
+
+def import_items(conn, username, items):
+    """Add exported items ({"list", "text", "timestamp"}) to a user's lists in one transaction.
+
+    Items already present with the same content and timestamp (e.g. from an earlier,
+    interrupted import of the same file) are skipped. The user's history limit applies.
+    Returns (version, imported); the version is bumped once for the whole batch.
+    """
+    if len(items) > MAX_IMPORT_ITEMS:
+        raise ValueError(f"Import batch has more than {MAX_IMPORT_ITEMS} items")
+    imported = 0
+    for item in items:
+        kind, text, timestamp = item.get("list"), item.get("text"), item.get("timestamp")
+        table = _table(kind)
+        if not isinstance(text, str) or not text or not isinstance(timestamp, (int, float)):
+            raise ValueError("Imported items need a list, non-empty text and a timestamp")
+        if conn.execute(
+            f"SELECT 1 FROM {table} WHERE username = ? AND hash = ? AND timestamp = ?",
+            (username, content_hash(text), int(timestamp)),
+        ).fetchone():
+            continue
+        _add_history_item(conn, kind, username, text, timestamp=timestamp)
+        imported += 1
+    _log_change(conn, username, None, "resync")
+    _collect_garbage(conn)
+    return _bump_version(conn, username), imported
+
+
+# Maintenance
+def get_retention_days(conn, username):
+    row = conn.execute("SELECT retention_days FROM users WHERE username = ?", (username,)).fetchone()
+    return row[0] if row and row[0] is not None else RETENTION_DAYS
+
+
+def set_retention_days(conn, username, days):
+    # Applied by the next retention run, in batches, rather than in this write
+    conn.execute("UPDATE users SET retention_days = ? WHERE username = ?", (days, username))
+
+
+def retention_candidates(conn, now):
+    """(username, cutoff, limit) for every user with items older than their age limit or past their history limit.
+
+    cutoff is the timestamp items must be newer than (None without an age limit).
+    """
+    users = conn.execute(
+        "SELECT username, COALESCE(retention_days, ?), COALESCE(history_limit, ?) FROM users",
+        (RETENTION_DAYS, MAX_HISTORY_ITEMS),
+    ).fetchall()
+    candidates = []
+    for username, days, limit in users:
+        cutoff = int(now - days * 86400) if days > 0 else None
+        for table in HISTORY_TABLES.values():
+            expired = cutoff is not None and conn.execute(
+                f"SELECT 1 FROM {table} WHERE username = ? AND timestamp < ? LIMIT 1", (username, cutoff)
+            ).fetchone()
+            excess = conn.execute(
+                f"SELECT 1 FROM {table} WHERE username = ? ORDER BY timestamp DESC, id DESC LIMIT 1 OFFSET ?",
+                (username, limit),
+            ).fetchone()
+            if expired or excess:
+                candidates.append((username, cutoff, limit))
+                break
+    return candidates
+
+
+def apply_retention(conn, username, cutoff, limit, batch=RETENTION_BATCH):
+    """Delete up to `batch` of a user's items: those older than `cutoff`, then those past `limit`.
+
+    Like trimming, retention is local policy and isn't replicated. Returns (deleted,
+    version); version is None when nothing was deleted.
+    """
+    deleted = 0
+    for table in HISTORY_TABLES.values():
+        if cutoff is not None and deleted < batch:
+            deleted += conn.execute(
+                f"DELETE FROM {table} WHERE id IN ("
+                f"SELECT id FROM {table} WHERE username = ? AND timestamp < ? ORDER BY timestamp LIMIT ?)",
+                (username, cutoff, batch - deleted),
+            ).rowcount
+        if deleted < batch:
+            deleted += conn.execute(
+                f"DELETE FROM {table} WHERE id IN ("
+                f"SELECT id FROM {table} WHERE username = ? ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?)",
+                (username, batch - deleted, limit),
+            ).rowcount
+    if not deleted:
+        return 0, None
+    _log_change(conn, username, None, "resync")
+    _collect_garbage(conn)
+    return deleted, _bump_version(conn, username)
+
+
+def database_stats(conn):
+    """Page counts and file sizes of the database, for maintenance decisions and reports."""
+    def pragma(name):
+        return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    page_size = pragma("page_size")
+    try:
+        wal_bytes = os.path.getsize(f"{path}-wal")
+    except OSError:
+        wal_bytes = 0
+    return {
+        "page_size": page_size,
+        "pages": pragma("page_count"),
+        "free_pages": pragma("freelist_count"),
+        "file_bytes": pragma("page_count") * page_size,
+        "wal_bytes": wal_bytes,
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}[pragma("auto_vacuum")],
+    }
+
+
+@autocommit
+def vacuum_step(conn, pages):
+    """Return up to `pages` free pages to the filesystem (incremental auto_vacuum). Returns the number freed."""
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")  # Steps the pragma to completion
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+@autocommit
+def convert_to_incremental(conn):
+    """Switch a database created without incremental auto_vacuum over to it.
+
+    Runs a full VACUUM, which rewrites the whole file and blocks every other write until it is done.
+    """
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def analyze(conn):
+    # Sampled, so its cost stays bounded however large the tables grow
+    conn.execute(f"PRAGMA analysis_limit={ANALYZE_LIMIT}")
+    conn.execute("ANALYZE")
+
+
+def merge_search_index(conn, pages=FTS_MERGE_PAGES):
+    """Merge some of the full-text index's segments. Returns False once there was nothing left to merge."""
+    before = conn.total_changes
+    conn.execute("INSERT INTO blobs_fts (blobs_fts, rank) VALUES ('merge', ?)", (pages,))
+    return conn.total_changes - before > 1
+
+
+@autocommit
+def checkpoint(conn, mode="PASSIVE"):
+    """Checkpoint the WAL (PASSIVE, or TRUNCATE to also shrink it). Returns (busy, wal pages, checkpointed pages)."""
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    return tuple(conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone())
+
+
+def claim_maintenance(conn, holder, now, ttl):
+    """Take or renew the maintenance lease for `holder` unless another holder's is still current.
+
+    With several worker processes on one database, only the lease holder runs the schedule.
+    """
+    row = conn.execute("SELECT value FROM settings WHERE key = 'maintenance_lease'").fetchone()
+    if row is not None:
+        current, expires = row[0].rsplit(" ", 1)
+        if current != holder and float(expires) > now:
+            return False
+    conn.execute(
+        "INSERT INTO settings (key, value) VALUES ('maintenance_lease', ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (f"{holder} {now + ttl}",),
+    )
+    return True
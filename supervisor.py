@@ -0,0 +1,298 @@
+"""Runs server.py and typer.py as supervised child processes (used by gui.py, or headless).
+
+    python supervisor.py --server --typer
+
+Each Service restarts its process when it exits, with exponential backoff so a process
+that crashes on startup can't spin the CPU. Services with a health URL are also probed
+and restarted when they stop answering. Stopping sends SIGTERM, then SIGKILL if the
+process hasn't exited within kill_timeout. sample() reports CPU and RSS from /proc.
+"""
+import argparse
+import functools
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import log_pipeline
+
+SERVER_URL = "http://127.0.0.1:8010"
+CHILD_ENV = dict(os.environ, PYTHONUNBUFFERED="1")  # Child output arrives line by line as it is printed
+
+# Restart and probe settings
+BACKOFF_BASE = 1.0  # Seconds before the first restart, doubled after each consecutive crash
+BACKOFF_MAX = 60.0
+STABLE_AFTER = 30.0  # A process that ran this long resets the backoff
+PROBE_INTERVAL = 2.0
+PROBE_TIMEOUT = 1.0
+STARTUP_GRACE = 10.0  # Seconds after start before failed probes count
+MAX_PROBE_FAILURES = 3  # Consecutive failed probes before a restart
+KILL_TIMEOUT = 5.0  # Seconds between SIGTERM and SIGKILL
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def read_proc_stats(pid):
+    """(CPU seconds used, RSS in bytes) of a process from /proc, or None where /proc isn't available."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()  # The command name may contain spaces
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+    except (OSError, IndexError, ValueError):
+        return None
+    utime, stime = int(fields[11]), int(fields[12])
+    return (utime + stime) / CLOCK_TICKS, rss_kb * 1024
+
+
+def probe(url, timeout=PROBE_TIMEOUT):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+class Service:
+    """One supervised child process.
+
+    state is "stopped", "starting", "running", "unhealthy", "backoff" or "stopping".
+    The supervisor's own messages go to output(line). The process's output is read by
+    attach(pipe, prefix="[name] ") (by default log_pipeline.attach into output), so a
+    LogPipeline can take it directly with attach=pipeline.attach.
+    on_spawn(service), if set, runs after every (re)start, e.g. to replay control commands.
+    """
+
+    def __init__(self, name, cmd, output=print, health_url=None, stdin=False, cwd=None, on_spawn=None, attach=None,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, stable_after=STABLE_AFTER,
+                 probe_interval=PROBE_INTERVAL, startup_grace=STARTUP_GRACE,
+                 max_probe_failures=MAX_PROBE_FAILURES, kill_timeout=KILL_TIMEOUT):
+        self.name = name
+        self.cmd = cmd
+        self.output = output
+        self.attach = attach or functools.partial(log_pipeline.attach, emit=output)
+        self.health_url = health_url
+        self.stdin = stdin
+        self.cwd = cwd
+        self.on_spawn = on_spawn
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.probe_interval = probe_interval
+        self.startup_grace = startup_grace
+        self.max_probe_failures = max_probe_failures
+        self.kill_timeout = kill_timeout
+        self.state = "stopped"
+        self.process = None
+        self.restarts = 0
+        self.failures = 0  # Consecutive crashes, for the backoff
+        self.last_exit = None
+        self._last_sample = None  # (monotonic time, CPU seconds) of the previous sample()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"supervise-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the process (SIGTERM, then SIGKILL after kill_timeout) and don't restart it."""
+        self._stop.set()
+        self._terminate()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def send(self, line):
+        """Write a line to the process's stdin (stdin=True services). Returns False if it isn't running."""
+        process = self.process
+        if not self.stdin or process is None or process.poll() is not None:
+            return False
+        try:
+            process.stdin.write(f"{line}\n")
+            process.stdin.flush()
+            return True
+        except OSError:
+            return False
+
+    def sample(self):
+        """{"pid", "cpu" (percent of one core since the last sample), "rss" (bytes)}, or None if not running."""
+        process = self.process
+        if process is None or process.poll() is not None:
+            self._last_sample = None
+            return None
+        stats = read_proc_stats(process.pid)
+        if stats is None:
+            return {"pid": process.pid, "cpu": None, "rss": None}
+        cpu_seconds, rss = stats
+        now = time.monotonic()
+        cpu = None
+        if self._last_sample is not None and self._last_sample[0] < now:
+            cpu = 100 * (cpu_seconds - self._last_sample[1]) / (now - self._last_sample[0])
+        self._last_sample = (now, cpu_seconds)
+        return {"pid": process.pid, "cpu": cpu, "rss": rss}
+
+    def status(self):
+        """One-line summary for a status bar."""
+        text = f"{self.name}: {self.state}"
+        sample = self.sample()
+        if sample is not None:
+            text += f" pid {sample['pid']}"
+            if sample["cpu"] is not None:
+                text += f" cpu {sample['cpu']:.0f}%"
+            if sample["rss"] is not None:
+                text += f" rss {sample['rss'] / 1e6:.0f} MB"
+        if self.restarts:
+            text += f" restarts {self.restarts}"
+        return text
+
+    def _log(self, message):
+        self.output(f"[supervisor] {message}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self._spawn()
+            except OSError as e:
+                self._log(f"Failed to start {self.name}: {e}")
+            else:
+                self.last_exit = self._watch()
+                if self._stop.is_set():
+                    break
+                self._log(f"{self.name} exited with code {self.last_exit}")
+            if time.monotonic() - started >= self.stable_after:
+                self.failures = 0
+            self.failures += 1
+            self.restarts += 1
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+            self.state = "backoff"
+            self._log(f"Restarting {self.name} in {delay:.1f} s")
+            self._stop.wait(delay)
+        self.state = "stopped"
+
+    def _spawn(self):
+        self.state = "starting"
+        self.process = subprocess.Popen(
+            self.cmd,
+            stdin=subprocess.PIPE if self.stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            cwd=self.cwd,
+            env=CHILD_ENV,
+        )
+        self._last_sample = None
+        prefix = f"[{self.name}] "
+        self._readers = [self.attach(self.process.stdout, prefix=prefix), self.attach(self.process.stderr, prefix=prefix)]
+        self._log(f"Started {self.name} (pid {self.process.pid})")
+        if self.on_spawn is not None:
+            self.on_spawn(self)
+
+    def _watch(self):
+        """Wait for the process to exit, probing its health meanwhile. Returns the exit code."""
+        process = self.process
+        probe_from = time.monotonic() + self.startup_grace
+        misses = 0
+        if self.health_url is None:
+            self.state = "running"
+        while True:
+            try:
+                code = process.wait(timeout=self.probe_interval)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            if self._stop.is_set():
+                self._terminate()  # stop() ran before this process was spawned
+                continue
+            if self.health_url is None:
+                continue
+            if probe(self.health_url):
+                misses = 0
+                self.state = "running"
+            elif time.monotonic() >= probe_from:
+                misses += 1
+                self.state = "unhealthy"
+                if misses >= self.max_probe_failures:
+                    self._log(f"{self.name} failed {misses} health checks; restarting it")
+                    self._terminate()
+        for reader in self._readers:
+            reader.join(timeout=1.0)
+        return code
+
+    def _terminate(self):
+        process = self.process
+        if process is None or process.poll() is not None:
+            return
+        self.state = "stopping"
+        process.terminate()
+        try:
+            process.wait(timeout=self.kill_timeout)
+        except subprocess.TimeoutExpired:
+            self._log(f"{self.name} did not exit {self.kill_timeout:.0f} s after SIGTERM; sending SIGKILL")
+            process.kill()
+            process.wait()
+
+
+class Supervisor:
+    """The services gui.py (or the CLI below) manages, by name."""
+
+    def __init__(self, output=print, cwd=None, attach=None):
+        here = cwd or os.path.dirname(os.path.abspath(__file__))
+        self.services = {
+            "server": Service(
+                "server", [sys.executable, "server.py"], output, health_url=f"{SERVER_URL}/health", cwd=here, attach=attach,
+            ),
+            "typer": Service("typer", [sys.executable, "typer.py", "--control"], output, stdin=True, cwd=here, attach=attach),
+        }
+
+    def __getitem__(self, name):
+        return self.services[name]
+
+    def status(self):
+        return " | ".join(service.status() for service in self.services.values())
+
+    def stop_all(self):
+        for service in self.services.values():
+            service.send("quit")
+            service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run server.py and/or typer.py under supervision, without the GUI")
+    parser.add_argument("--server", action="store_true", help="Run server.py")
+    parser.add_argument("--typer", action="store_true", help="Run typer.py")
+    parser.add_argument("--status-interval", type=float, default=30.0, help="Seconds between status lines (0 = never)")
+    args = parser.parse_args()
+    if not (args.server or args.typer):
+        parser.error("choose --server and/or --typer")
+
+    supervisor = Supervisor(output=lambda line: print(line, flush=True))
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    for name in ("server", "typer"):
+        if getattr(args, name):
+            supervisor[name].start()
+    while not stop.wait(args.status_interval or None):
+        print(f"[supervisor] {supervisor.status()}", flush=True)
+    supervisor.stop_all()
+
+
+if __name__ == "__main__":
+    main()
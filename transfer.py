@@ -0,0 +1,216 @@
+"""Streaming transfer of large payloads and whole histories.
+
+UploadManager receives request bodies straight into files, enforcing a size cap while
+reading, and keeps chunked uploads resumable: an upload's offset is the size of its
+file, so a client that lost its connection asks for the offset and sends the rest.
+export_lines() and iter_ndjson() stream a history out and back in as NDJSON without
+holding more than one batch of items (or one line) in memory.
+"""
+import asyncio
+import codecs
+import json
+import os
+import re
+import time
+import uuid
+
+import storage
+
+MAX_UPLOAD_BYTES = int(os.environ.get("CLIPBOARD_MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+MAX_JSON_BYTES = int(os.environ.get("CLIPBOARD_MAX_JSON_BYTES", str(32 * 1024 * 1024)))  # JSON bodies read whole
+MAX_IMPORT_LINE = 64 * 1024 * 1024  # Bytes in one NDJSON import line
+IMPORT_BATCH_BYTES = 8 * 1024 * 1024  # Import items applied per transaction, by size (and MAX_IMPORT_ITEMS)
+UPLOAD_TTL = 24 * 3600  # Seconds an unfinished chunked upload is kept
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadNotFound(LookupError):
+    pass
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class OffsetMismatch(ValueError):
+    """A chunk was sent for an offset other than the upload's current one."""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload is at offset {offset}")
+        self.offset = offset
+
+
+async def read_capped(request, limit=MAX_JSON_BYTES):
+    """The request body, read in chunks and refused as soon as it passes `limit` bytes."""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise UploadTooLarge(f"Body is larger than {limit} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise UploadTooLarge(f"Body is larger than {limit} bytes")
+    return bytes(body)
+
+
+class UploadManager:
+    """Upload files under `directory`: <id>.part holds the data, <id>.user its owner."""
+
+    def __init__(self, directory, max_bytes=MAX_UPLOAD_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, upload_id, suffix):
+        if not UPLOAD_ID.match(upload_id):
+            raise UploadNotFound(upload_id)
+        return os.path.join(self.directory, f"{upload_id}.{suffix}")
+
+    def create(self, username):
+        os.makedirs(self.directory, exist_ok=True)
+        self.expire()
+        upload_id = uuid.uuid4().hex
+        with open(self._path(upload_id, "user"), "w") as f:
+            f.write(username)
+        open(self._path(upload_id, "part"), "wb").close()
+        return upload_id
+
+    def offset(self, upload_id, username):
+        try:
+            with open(self._path(upload_id, "user")) as f:
+                owner = f.read()
+            size = os.path.getsize(self._path(upload_id, "part"))
+        except OSError:
+            raise UploadNotFound(upload_id)
+        if owner != username:
+            raise UploadNotFound(upload_id)
+        return size
+
+    async def append(self, upload_id, username, offset, chunks):
+        """Write `chunks` (an async iterator of bytes) at `offset`. Returns the new offset."""
+        current = self.offset(upload_id, username)
+        if offset != current:
+            raise OffsetMismatch(current)
+        return await self._receive(self._path(upload_id, "part"), current, chunks)
+
+    async def receive(self, chunks):
+        """Write a whole body to a new file outside any chunked upload. Returns its path."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{uuid.uuid4().hex}.body")
+        try:
+            await self._receive(path, 0, chunks)
+        except BaseException:
+            self._remove(path)
+            raise
+        return path
+
+    async def _receive(self, path, size, chunks):
+        loop = asyncio.get_running_loop()
+        with open(path, "ab") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise UploadTooLarge(f"Upload is larger than {self.max_bytes} bytes")
+                await loop.run_in_executor(None, f.write, chunk)  # Disk writes stay off the event loop
+        return size
+
+    def finish(self, upload_id, username):
+        """Close a chunked upload. Returns the path of its data, now owned by the caller."""
+        self.offset(upload_id, username)
+        path = self._path(upload_id, "body")
+        os.replace(self._path(upload_id, "part"), path)
+        self._remove(self._path(upload_id, "user"))
+        return path
+
+    def discard(self, upload_id, username):
+        self.offset(upload_id, username)
+        for suffix in ("part", "user"):
+            self._remove(self._path(upload_id, suffix))
+
+    def expire(self):
+        cutoff = time.time() - UPLOAD_TTL
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# NDJSON export: one item per line, oldest first, as {"list", "timestamp", "hash", "size", "cursor", "text"}
+def encode_cursor(kind, timestamp, item_id):
+    return f"{kind}:{timestamp}:{item_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        kind, timestamp, item_id = cursor.split(":")
+        return kind, (int(timestamp), int(item_id))
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def export_lines(username, kinds, cursor=None):
+    """NDJSON lines (bytes) of a user's lists. Pass a line's cursor to resume after it.
+
+    Items are read EXPORT_BATCH at a time, each batch in its own read. Large payloads
+    are fetched one by one and encoded to JSON chunk by chunk, so none is held whole.
+    """
+    store = storage.get_store()
+    resume_kind, after = decode_cursor(cursor) if cursor else (None, None)
+    if resume_kind is not None:
+        kinds = kinds[kinds.index(resume_kind):] if resume_kind in kinds else []
+    for kind in kinds:
+        position = after if kind == resume_kind else None
+        while True:
+            page = store.read(storage.export_page, kind, username, position)
+            for item in page:
+                position = (item["timestamp"], item["id"])
+                if "text" in item:
+                    chunks = [item["text"].encode("utf-8")]
+                else:
+                    chunks = store.read(storage.open_blob, username, item["hash"])
+                    if chunks is None:
+                        continue  # Deleted since the page was read
+                head = {
+                    "list": kind, "timestamp": item["timestamp"], "hash": item["hash"], "size": item["size"],
+                    "cursor": encode_cursor(kind, *position),
+                }
+                yield json.dumps(head)[:-1].encode() + b', "text": "'
+                decoder = codecs.getincrementaldecoder("utf-8")()
+                for chunk in chunks:
+                    yield json.dumps(decoder.decode(chunk))[1:-1].encode()
+                yield b'"}\n'
+            if len(page) < storage.EXPORT_BATCH:
+                break
+
+
+async def iter_ndjson(chunks, max_line=MAX_IMPORT_LINE):
+    """Parsed objects from NDJSON arriving as an async iterator of bytes, one line buffered at a time.
+
+    Raises UploadTooLarge for a line over max_line bytes, ValueError for one that isn't JSON.
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(buffer[start:end]).strip()
+            start = end + 1
+            if line:
+                yield json.loads(line)
+        del buffer[:start]
+        if len(buffer) > max_line:
+            raise UploadTooLarge(f"Import line is larger than {max_line} bytes")
+    if buffer.strip():
+        yield json.loads(bytes(buffer))
@@ -1,87 +1,115 @@
-import keyboard
-import pyperclip
-import time
+import os
+import sys
 import threading
+import time
+from clipboard_watcher import ClipboardWatcher
+from typing_engine import TypingEngine
+
+# Typing speed settings
+TYPING_CPS = float(os.environ.get("TYPER_CPS", "40"))  # Target characters per second (0 = as fast as possible)
+TYPING_CHUNK_SIZE = int(os.environ.get("TYPER_CHUNK_SIZE", "4"))  # Characters per keyboard.write call
+TYPING_JITTER = float(os.environ.get("TYPER_JITTER", "0"))  # 0..1, randomizes cadence around the target rate
+
+# Clipboard change source shared with server.py and clipboard_monitor.py
+clipboard_watcher = ClipboardWatcher()
+
+# The keyboard package, imported by register_hotkeys(): loading it installs OS keyboard hooks,
+# which importing this module shouldn't pay for
+keyboard = None
+
+# Hotkeys do nothing while disabled. With --control, gui.py toggles this over stdin
+# instead of restarting the process, so starting the typer again is instant.
+enabled = threading.Event()
+enabled.set()
+
+# Called when automatic typing reaches the end of the text
+def on_typing_complete():
+    print("[DEBUG] Automatic typing complete.")
+    keyboard.write("\n")  # Add a newline after completion
+
+# Send text as keystrokes
+def type_text(text):
+    keyboard.write(text)
 
-# Global variables
-script_text = ""  # Clipboard content
-text_index = 0      # Current typing position
-auto_typing = False # Automatic typing toggle
-
-# Lock for clipboard access
-clipboard_lock = threading.Lock()
-
-# Function to monitor clipboard for updates
-def monitor_clipboard():
-    global script_text, text_index
-    while True:
-        with clipboard_lock:
-            new_text = pyperclip.paste()  # Get current clipboard content
-            if new_text != script_text:  # Update only if clipboard text has changed
-                script_text = new_text
-                text_index = 0  # Reset position when clipboard updates
-                print(f"[DEBUG] Clipboard updated in typer.py: {script_text}")
-        time.sleep(0.5)  # Check every 500ms
+# Chunked, rate-limited typing of the clipboard content
+engine = TypingEngine(
+    type_text,
+    cps=TYPING_CPS,
+    chunk_size=TYPING_CHUNK_SIZE,
+    jitter=TYPING_JITTER,
+    on_complete=on_typing_complete,
+)
+
+# Function to handle clipboard updates from the watcher
+def on_clipboard_change(new_text):
+    if new_text != engine.text:  # Update only if clipboard text has changed
+        engine.load(new_text)  # Reset position when clipboard updates
+        print(f"[DEBUG] Clipboard updated in typer.py ({len(new_text)} chars)")
 
 # Function to type one character at a time
 def type_one_character():
-    global text_index, script_text
-    if text_index < len(script_text):
-        char_to_type = script_text[text_index]
-        try:
-            keyboard.write(char_to_type)  # Simulate typing the character
-            print(f"[DEBUG] Typed: {char_to_type}")  # Debug log for each character
-            text_index += 1
-            time.sleep(0.01)  # Add a slight delay between keystrokes
-        except Exception as e:
-            print(f"[ERROR] Error typing character '{char_to_type}': {e}")
-    else:
-        print("[DEBUG] Typing complete.")
-        keyboard.write("\n")  # Add a newline after completion
-        text_index = 0  # Reset for next typing
-
-# Function for automatic typing
-def automatic_typing():
-    global auto_typing, text_index, script_text
-    while auto_typing:
-        if text_index < len(script_text):
-            char_to_type = script_text[text_index]
-            keyboard.write(char_to_type)
-            text_index += 1
-            time.sleep(0.3)  # Typing delay
-        else:
-            auto_typing = False  # Stop when typing is complete
-            print("[DEBUG] Automatic typing complete.")
+    try:
+        if not engine.step():
+            print("[DEBUG] Typing complete.")
             keyboard.write("\n")  # Add a newline after completion
-            text_index = 0  # Reset for next typing
+            engine.reset()  # Reset for next typing
+    except Exception as e:
+        print(f"[ERROR] Error typing character at index {engine.index}: {e}")
 
-# Function to toggle automatic typing
+# Function to toggle automatic typing (pauses and resumes at the current index)
 def toggle_auto_typing():
-    global auto_typing
-    if not auto_typing:
-        auto_typing = True
-        print("[DEBUG] Automatic typing started.")
-        threading.Thread(target=automatic_typing, daemon=True).start()
+    if engine.toggle():
+        print(f"[DEBUG] Automatic typing started at index {engine.index}.")
     else:
-        auto_typing = False
-        print("[DEBUG] Automatic typing stopped.")
+        print(f"[DEBUG] Automatic typing paused at index {engine.index}.")
 
 # Function to reset typing to the beginning
 def reset_typing():
-    global text_index
-    text_index = 0
+    engine.reset()
     print("[DEBUG] Typing reset to the beginning.")
 
-# Thread to handle clipboard monitoring
+# Start the event-driven clipboard watcher and pick up the current clipboard content
 def start_clipboard_monitor():
-    monitor_thread = threading.Thread(target=monitor_clipboard, daemon=True)
-    monitor_thread.start()
+    clipboard_watcher.subscribe(on_clipboard_change)
+    clipboard_watcher.start()
+    on_clipboard_change(clipboard_watcher.current or "")
+
+# Enable or disable the hotkeys; disabling also pauses automatic typing
+def set_enabled(on):
+    if on:
+        enabled.set()
+        print("[INFO] Typer enabled.")
+    else:
+        enabled.clear()
+        engine.pause()
+        print("[INFO] Typer disabled.")
+
+# Run a hotkey action only while the typer is enabled
+def when_enabled(action):
+    return lambda: action() if enabled.is_set() else None
+
+# Read "enable", "disable" and "quit" commands from stdin (one per line) until quit or EOF
+def run_control_loop():
+    for line in sys.stdin:
+        command = line.strip()
+        if command == "enable":
+            set_enabled(True)
+        elif command == "disable":
+            set_enabled(False)
+        elif command == "quit":
+            break
+        elif command:
+            print(f"[WARNING] Unknown command: {command}")
+    print("[INFO] Typing script terminated.")
 
 # Keyboard hotkey setup
-keyboard.add_hotkey('insert', type_one_character)  # Manual character-by-character typing
-keyboard.add_hotkey('ctrl+b', toggle_auto_typing)  # Start/stop automatic typing
-keyboard.add_hotkey('$', lambda: toggle_auto_typing() if auto_typing else None)  # Stop automatic typing with $
-keyboard.add_hotkey('ctrl+m', reset_typing)  # Reset typing to the beginning
+def register_hotkeys():
+    global keyboard
+    import keyboard
+    keyboard.add_hotkey('insert', when_enabled(type_one_character))  # Manual character-by-character typing
+    keyboard.add_hotkey('ctrl+b', when_enabled(toggle_auto_typing))  # Start/stop automatic typing
+    keyboard.add_hotkey('$', when_enabled(lambda: toggle_auto_typing() if engine.running else None))  # Stop automatic typing with $
+    keyboard.add_hotkey('ctrl+m', when_enabled(reset_typing))  # Reset typing to the beginning
 
 # Main execution
 if __name__ == "__main__":
@@ -91,8 +119,14 @@ if __name__ == "__main__":
     print("Press '$' to stop automatic typing.")
     print("Press 'Ctrl+M' to reset typing to the beginning.")
 
+    register_hotkeys()
+
     # Start clipboard monitoring
     start_clipboard_monitor()
+    if "--control" in sys.argv[1:]:
+        # Long-lived process driven by gui.py
+        run_control_loop()
+        sys.exit(0)
     try:
         while True:
             time.sleep(1)  # Prevent high CPU usage
@@ -0,0 +1,166 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger("typing_engine")
+
+
+class TypingEngine:
+    """Types a text through write_fn in chunks at a target characters-per-second rate.
+
+    write_fn receives each chunk as a string (keyboard.write in typer.py, a mock in the
+    benchmark). Chunks are scheduled against a monotonic clock, so the rate does not
+    drift with the cost of write_fn. With jitter > 0 each delay is scaled by a random
+    factor in [1 - jitter, 1 + jitter] and chunk sizes vary, for a human-like cadence
+    with the same average rate.
+
+    index is the number of characters typed so far. pause() takes effect after the
+    chunk being written, so index is exact and resume() continues from it.
+    """
+
+    def __init__(self, write_fn, cps=40.0, chunk_size=4, jitter=0.0, on_complete=None, rng=None):
+        self.write_fn = write_fn
+        self.cps = cps
+        self.chunk_size = max(1, chunk_size)
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self.on_complete = on_complete
+        self.rng = rng or random.Random()
+        self.text = ""
+        self.index = 0
+        self.typed = 0  # Characters written since the engine was created
+        self._running = False
+        self._writing = False  # A chunk is being written outside the lock
+        self._generation = 0  # Bumped by load()/seek() so a sleeping loop re-reads its position
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def load(self, text):
+        """Replace the text and rewind to its start."""
+        with self._cond:
+            self.text = text
+            self.index = 0
+            self._generation += 1
+            self._cond.notify_all()
+
+    def seek(self, index):
+        with self._cond:
+            self.index = max(0, min(index, len(self.text)))
+            self._generation += 1
+            self._cond.notify_all()
+
+    def reset(self):
+        self.seek(0)
+
+    def step(self, count=1):
+        """Type the next `count` characters immediately (manual mode). Returns False at the end of the text."""
+        with self._cond:
+            chunk = self.text[self.index:self.index + count]
+            if not chunk:
+                return False
+            self.index += len(chunk)
+        self.write_fn(chunk)
+        self.typed += len(chunk)
+        return True
+
+    def start(self):
+        """Start or resume automatic typing from the current index."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="typing-engine", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def pause(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    resume = start
+
+    def toggle(self):
+        if self._running:
+            self.pause()
+        else:
+            self.start()
+        return self._running
+
+    def wait_idle(self, timeout=None):
+        """Block until automatic typing has stopped (paused or finished) and no chunk is in flight."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._running or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _next_chunk_size(self):
+        if self.jitter and self.chunk_size > 1:
+            return self.rng.randint(1, self.chunk_size)
+        return self.chunk_size
+
+    def _delay(self, length):
+        if not self.cps:
+            return 0.0  # Unthrottled
+        delay = length / self.cps
+        if self.jitter:
+            delay *= self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
+
+    def _run(self):
+        # Hot loop: no logging or printing per chunk, only at state changes
+        with self._cond:
+            while True:
+                while not self._running:
+                    self._cond.wait()
+                generation = self._generation
+                next_due = time.monotonic()
+                while self._running and generation == self._generation:
+                    now = time.monotonic()
+                    if now < next_due:
+                        self._cond.wait(next_due - now)  # Woken early by pause(), load() or seek()
+                        continue
+                    chunk = self.text[self.index:self.index + self._next_chunk_size()]
+                    if not chunk:
+                        self._finish()
+                        break
+                    self.index += len(chunk)
+                    self._writing = True
+                    self._cond.release()
+                    try:
+                        self.write_fn(chunk)
+                    except Exception as e:
+                        logger.error(f"Typing failed at index {self.index - len(chunk)}: {e}")
+                        self._cond.acquire()
+                        if generation == self._generation:
+                            self.index -= len(chunk)  # Retry this chunk on resume
+                        self._running = self._writing = False
+                        self._cond.notify_all()
+                        break
+                    self._cond.acquire()
+                    self._writing = False
+                    self._cond.notify_all()
+                    self.typed += len(chunk)
+                    # Schedule from the previous due time, not from now, so write_fn's cost doesn't slow the rate;
+                    # after a long stall, don't burst to catch up
+                    next_due = max(next_due + self._delay(len(chunk)), time.monotonic() - 0.1)
+
+    def _finish(self):
+        self._running = False
+        self.index = 0
+        self._cond.notify_all()
+        if self.on_complete is not None:
+            self._cond.release()
+            try:
+                self.on_complete()
+            finally:
+                self._cond.acquire()